@@ -1,40 +1,60 @@
+import time
+_run_start = time.perf_counter()
+
+import functools
+
 import streamlit as st
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage
-from dotenv import load_dotenv
-import os
-import importlib.util
 import pandas as pd
 from datetime import datetime
-import io
-import speech_recognition as sr
-import pydeck as pdk
 
-# --- Load environment and model ---
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-llm = ChatOpenAI(openai_api_key=api_key, temperature=0)
+import resources
+import query_cache
+import result_cache
+import templates
+import pipeline
+import planner
+import compaction
+import tracing
+import chat_store
+import followups
+import bulk_writes
+import image_cache
+import pagination
+import text_search
 
-# --- Dynamic module loading ---
-def load_module(path, name):
-    spec = importlib.util.spec_from_file_location(name, path)
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
-    return mod
+# --- Backend modules ---
+# Regular imports are cached in sys.modules, so Streamlit reruns reuse the
+# already-loaded backends; their clients and LLM handles are built lazily by
+# `resources` once per process and shared across sessions.
+import maincpy_cleaned as nosql_module
+import sqlrest_cleaned as sql_module
 
-nosql_module = load_module("maincpy_cleaned.py", "nosql_module")
-sql_module = load_module("sqlrest_cleaned.py", "sql_module")
-
-# --- Keywords for backend detection ---
-sql_keywords = {"restaurant", "menu", "reviews"}
-nosql_keywords = {"listing", "review", "housing", "apartment"}
+llm = resources.get_openai_llm()
+# Text-index checks start in the background instead of inside the first question
+text_search.warm(sql_module.db_config)
 
 # --- Streamlit Page Config ---
 st.set_page_config(page_title="Smart Data Chatbot", layout="wide", page_icon="🤖")
 
 # --- Chat History State ---
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# The full history lives in chat_store (SQLite, keyed by ?session= in the URL);
+# st.session_state.messages is only the last CHAT_WINDOW messages
+history = chat_store.get_chat_store()
+if "session_id" not in st.session_state:
+    session_id = st.query_params.get("session")
+    # Anything but an id we minted gets a fresh session
+    st.session_state.session_id = session_id if chat_store.valid_session_id(session_id) else chat_store.new_session_id()
+    st.query_params["session"] = st.session_state.session_id
+    st.session_state.messages = history.recent(st.session_state.session_id)
+    st.session_state.older_pages = 0
+
+
+def add_message(role, content, timestamp=None):
+    timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    message = history.append(st.session_state.session_id, role, content, timestamp)
+    st.session_state.messages.append(message)
+    del st.session_state.messages[:-chat_store.CHAT_WINDOW]
+
 
 # --- Sidebar: Mode, Reset, Voice Input, Download ---
 with st.sidebar:
@@ -43,17 +63,20 @@ with st.sidebar:
      "Housing", "Restaurant"])
 
     if st.button("🧹 Clear Chat"):
+        # History is append-only: clearing starts a new session
+        st.session_state.session_id = chat_store.new_session_id()
+        st.query_params["session"] = st.session_state.session_id
         st.session_state.messages = []
+        st.session_state.older_pages = 0
+        st.session_state.query_state = None
+        pagination.close_cursor(st.session_state)
         st.rerun()
 
     if st.button("📥 Download Chat History"):
         if st.session_state.messages:
-            df_chat = pd.DataFrame(st.session_state.messages)
-            buffer = io.StringIO()
-            df_chat.to_csv(buffer, index=False)
             st.download_button(
                 label="Download as CSV",
-                data=buffer.getvalue(),
+                data=history.export_download(st.session_state.session_id),
                 file_name="chat_history.csv",
                 mime="text/csv"
             )
@@ -61,6 +84,7 @@ with st.sidebar:
             st.info("No chat history to download.")
 
     if st.button("🎙️ Start Voice Input"):
+        sr = resources.optional_module("speech_recognition")
         recognizer = sr.Recognizer()
         with sr.Microphone() as source:
             st.info("🎤 Listening... Please speak clearly.")
@@ -82,122 +106,260 @@ st.title("🤖 Unified Chatbot Interface")
 st.markdown("Chat with your **🏡 housing** or **🍽️ restaurant** data in natural language.")
 
 # --- Display Chat History ---
-for msg in st.session_state.messages:
+# Only the in-memory window is rendered; older turns are read from the store a
+# page at a time when asked for
+older = []
+if st.session_state.messages:
+    first_id = st.session_state.messages[0]["id"]
+    if st.session_state.older_pages:
+        older = history.before(st.session_state.session_id, first_id,
+                               st.session_state.older_pages * chat_store.CHAT_PAGE_SIZE)
+    if history.before(st.session_state.session_id, older[0]["id"] if older else first_id, 1):
+        if st.button("⬆️ Show earlier messages"):
+            st.session_state.older_pages += 1
+            st.rerun()
+
+for msg in older + st.session_state.messages:
     timestamp = msg.get("timestamp", "")
     with st.chat_message(msg["role"], avatar="🧑" if msg["role"] == "user" else "🤖"):
         st.markdown(f"{msg['content']}")
         if timestamp:
             st.caption(f"🕒 {timestamp}")
 
-# --- Query Backend Detector ---
-def detect_backend(query: str) -> str:
-    if selected_mode == "Restaurant": return "sql"
-    if selected_mode == "Housing": return "mongo"
-
-    query_lower = query.lower()
-    sql_match = any(word in query_lower for word in sql_keywords)
-    nosql_match = any(word in query_lower for word in nosql_keywords)
-
-    if sql_match and not nosql_match: return "sql"
-    elif nosql_match and not sql_match: return "mongo"
-    elif sql_match and nosql_match:
-        classification_prompt = f"""
-        The user asked: \"{query}\"
-
-        Decide which database to use to answer this: SQL (for restaurant/menu/reviews) or MongoDB (for housing/listing data/review).
-        Reply with just one word: SQL or MongoDB.
-        """
-        try:
-            result = llm.invoke([HumanMessage(content=classification_prompt)]).content.strip().lower()
-            return "mongo" if "mongo" in result else "sql"
-        except:
-            return "unknown"
+# --- Menu Photos ---
+MENU_PHOTOS_MAX = 8
+
+
+def show_menu_photos(df):
+    photos = df[df["image_url"].astype(str).str.startswith("http")].head(MENU_PHOTOS_MAX)
+    if photos.empty:
+        return
+    with tracing.span("render.images", shown=len(photos)), st.expander("🖼️ Menu Photos", expanded=True):
+        slots = {}
+        label = "item_name" if "item_name" in photos.columns else None
+        columns = st.columns(4)
+        for i, (_, row) in enumerate(photos.iterrows()):
+            column = columns[i % len(columns)]
+            nosql_module.image_slot(column, row["image_url"], slots)
+            if label:
+                column.caption(str(row[label]))
+        nosql_module.fill_image_slots(slots)
+
+
+# --- Answer Rendering ---
+# Tiny results are formatted directly; anything bigger is summarized by the LLM
+# while the table renders
+def answer_frame(query, df, summary_prompt, deadline, title, cursor=None):
+    """Render and answer ``df``; with a ``cursor``, ``df`` is its first page and the table goes to the result pager."""
+    summary_future, direct_answer = None, None
+    if not df.empty:
+        direct_answer = compaction.format_small_result(df)
+    if direct_answer is None and not df.empty:
+        prompt, summary_report = summary_prompt(query, df, cursor.total if cursor else None)
+        summary_future = pipeline.start_summary(prompt)
+    if cursor is not None:
+        pagination.open_cursor(st.session_state, cursor)
     else:
-        classification_prompt = f"""
-        Decide if the following question should be handled using SQL (for relational data) or MongoDB (for NoSQL documents).
-        Reply with one word: SQL or MongoDB.
-
-        Question: {query}
-        """
-        try:
-            result = llm.invoke([HumanMessage(content=classification_prompt)]).content.strip().lower()
-            return "mongo" if "mongo" in result else "sql"
-        except:
-            return "unknown"
+        with st.expander(title):
+            if df.attrs.get("more_available"):
+                st.info(f"{len(df)} rows shown, more available")
+            st.dataframe(df)
+        if "image_url" in df.columns:
+            show_menu_photos(df)
+
+    if direct_answer is not None:
+        compaction.record_summary("formatted")
+        st.subheader("🧠 Natural Language Answer")
+        st.markdown(direct_answer)
+        st.caption("🧮 Small result shown directly, no summary LLM call")
+        add_message("assistant", direct_answer)
+    elif summary_future is not None:
+        compaction.record_summary("llm")
+        with st.expander("📏 Summary Prompt Size"):
+            st.json(summary_report)
+        st.subheader("🧠 Natural Language Answer")
+        with tracing.span("summarize"):
+            final_response = st.write_stream(summary_future.chunks(deadline))
+        add_message("assistant", final_response)
+    return not df.empty
+
+
+SUMMARY_PROMPTS = {
+    "sql": sql_module.sql_summary_prompt,
+    "mongo": lambda query, df, total=None: nosql_module.mongo_summary_prompt(query, df.to_dict("records"), total=total),
+}
+
+# --- Query Planner ---
+# Routed locally against both schemas; when unsure, the LLM classification and
+# both backends' query generation run concurrently (see planner.py)
+def plan_query(query: str, deadline):
+    return planner.plan(query, selected_mode, deadline)
 
 # --- Chat Input (Text or Voice) ---
 query = st.session_state.pop("voice_input", None) or st.chat_input("Ask me anything...")
 
 if query:
+    st.session_state.pending_write = None  # a new question drops an unconfirmed write
+    pagination.close_cursor(st.session_state)
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    st.session_state.messages.append({"role": "user", "content": query, "timestamp": timestamp})
+    add_message("user", query, timestamp)
     with st.chat_message("user", avatar="🧑"):
         st.markdown(query)
         st.caption(f"🕒 {timestamp}")
 
     with st.chat_message("assistant", avatar="🤖"):
         with st.spinner("🧠 Thinking..."):
-            db_type = detect_backend(query)
+            deadline = pipeline.Deadline()
+            trace = tracing.start_trace(query, mode=selected_mode)
             try:
-                if db_type == "sql":
+                # Refinements of the previous result ("now only the ones in Texas") skip generation
+                started = time.perf_counter()
+                with tracing.span("followup") as span:
+                    followup = followups.refine(query, st.session_state.get("query_state"), selected_mode)
+                    span.set(kind=followup.kind if followup else None)
+                if followup is not None:
+                    templates.record_path(followup.backend, "followup", time.perf_counter() - started)
+                    st.caption("♻️ Follow-up on the previous result: " + "; ".join(followup.refinement.describe()))
+                plan = (planner.Plan(followup.backend, followup.query_text(), "followup") if followup is not None
+                        else plan_query(query, deadline))
+                db_type = "followup" if followup is not None and followup.kind == "local" else plan.backend
+                trace.set(backend=plan.backend, path=plan.path, speculative=plan.speculative)
+                if plan.speculative:
+                    st.caption("🔀 Routing was uncertain: both backends' queries were generated while classifying")
+                if db_type == "followup":
+                    st.caption("⚡ Query path: followup (applied to the previous result, no LLM or database call)")
+                    with st.expander("🧾 Equivalent Query"):
+                        st.code(followup.query_text(), language="sql" if followup.backend == "sql" else "json")
+                    st.session_state.query_state = followups.remember(followup.backend, query, followup.query,
+                                                                      followup.frame)
+                    df = followup.frame.copy()
+                    df.index += 1
+                    if not answer_frame(query, df, SUMMARY_PROMPTS[followup.backend], deadline, "📊 Refined Results"):
+                        msg = "⚠️ None of the previous results match."
+                        st.warning(msg)
+                        add_message("assistant", msg)
+                elif db_type == "sql":
                     st.markdown("### 🗂️ Detected: SQL")
-                    sql_query = sql_module.get_gemini_response(query, sql_module.prompt)
+                    sql_query, path, prompt_report = plan.generated()
+                    st.caption(f"⚡ Query path: {path}")
+                    if prompt_report:
+                        with st.expander("📏 Prompt Token Budget"):
+                            st.json(prompt_report)
                     with st.expander("🧾 SQL Query"):
                         st.code(sql_query, language="sql")
 
                     if sql_query.lower().strip().startswith("select"):
-                        df = sql_module.read_sql_query(sql_query, sql_module.db_config)
-                        df.index += 1
-                        with st.expander("📊 SQL Data Results"):
-                            st.dataframe(df)
-
-                        if not df.empty:
-                            summary_prompt = f"""You are a helpful assistant. \nUser asked: \"{query}\"\nHere are the SQL results:\n{df.head(10).to_markdown(index=False)}\nExplain this in plain English."""
-                            final_response = llm.invoke([HumanMessage(content=summary_prompt)]).content
-                            st.subheader("🧠 Natural Language Answer")
-                            st.write(final_response)
-                            st.session_state.messages.append({"role": "assistant", "content": final_response, "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
-                        else:
+                        # Only the first page (and a COUNT(*) alongside) is read; later pages reuse the query
+                        cursor = pagination.Cursor("sql", sql_query, functools.partial(
+                            sql_module.read_sql_page, sql_query, sql_module.db_config,
+                            timeout_ms=deadline.ms("execute")))
+                        df = pipeline.run_stage(deadline, "execute", cursor.load).rows
+                        st.session_state.query_state = followups.remember(
+                            "sql", query, sql_query, df, complete=cursor.complete)
+                        if not answer_frame(query, df, sql_module.sql_summary_prompt, deadline, "📊 SQL Data Results",
+                                            cursor):
                             st.warning("⚠️ No data returned from SQL.")
                     else:
-                        success, msg = sql_module.execute_sql_query(sql_query, sql_module.db_config)
-                        if success:
-                            st.success(msg)
-                            st.session_state.messages.append({"role": "assistant", "content": msg, "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+                        previews = sql_module.preview_sql_write(sql_query, sql_module.db_config)
+                        matched = sum(count or 0 for _, count in previews)
+                        with st.expander("🔍 Dry Run"):
+                            st.dataframe(pd.DataFrame(previews, columns=["statement", "rows"]), hide_index=True)
+                        uncounted = any(count is None for _, count in previews)
+                        if bulk_writes.CONFIRM and (uncounted or matched > 1 or len(previews) > 1):
+                            description = f"{len(previews)} statement(s) would write {matched:,} row(s)"
+                            if uncounted:
+                                description += " (some could not be counted)"
+                            st.session_state.pending_write = bulk_writes.PendingWrite(
+                                "sql", description,
+                                lambda sql=sql_query: sql_module.execute_sql_query(sql, sql_module.db_config))
                         else:
-                            st.error("❌ SQL Execution Failed:")
-                            st.code(msg)
+                            success, msg = sql_module.execute_sql_query(sql_query, sql_module.db_config)
+                            if success:
+                                st.session_state.query_state = None  # the kept result may no longer hold
+                                compaction.record_summary("write_ack")
+                                st.success(msg)
+                                add_message("assistant", msg)
+                            else:
+                                tracing.record_error(RuntimeError(msg))
+                                st.error("❌ SQL Execution Failed:")
+                                st.code(msg)
 
                 elif db_type == "mongo":
                     st.markdown("### 🍃 Detected: MongoDB")
-                    df = nosql_module.handle_mongo_query(query, show_detailed_results=True)
-                    if isinstance(df, pd.DataFrame) and not df.empty:
-                        df.index += 1
-                        with st.expander("📊 MongoDB Data Results"):
-                            st.dataframe(df)
-
-                        if 'latitude' in df.columns and 'longitude' in df.columns:
-                            st.subheader("🗺️ Map View of Listings")
-                            map_df = df[['latitude', 'longitude']].dropna()
-                            st.map(map_df)
-
-                        summary_prompt = f"""You are a helpful assistant. \nUser asked: \"{query}\"\nHere are the MongoDB results:\n{df.head(10).to_markdown(index=False)}\nExplain this in plain English."""
-                        final_response = llm.invoke([HumanMessage(content=summary_prompt)]).content
-                        st.subheader("🧠 Natural Language Answer")
-                        st.write(final_response)
-                        st.session_state.messages.append({"role": "assistant", "content": final_response, "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
-                    else:
-                        pass
+                    st.session_state.query_state = nosql_module.handle_mongo_query(
+                        query, show_detailed_results=True, generated=plan.generated(), deadline=deadline)
                 elif db_type == "mixed":
                     msg = "⚠️ Your question refers to both SQL and MongoDB. Please split it."
                     st.warning(msg)
-                    st.session_state.messages.append({"role": "assistant", "content": msg, "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+                    add_message("assistant", msg)
                 else:
                     msg = "🤖 Couldn't detect backend. Please rephrase."
                     st.warning(msg)
-                    st.session_state.messages.append({"role": "assistant", "content": msg, "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+                    add_message("assistant", msg)
             except Exception as e:
+                trace.fail(e)
                 st.error(f"Unexpected error: {e}")
+            finally:
+                st.session_state["last_trace"] = tracing.finish_trace(trace)
+
+# --- Result Pager ---
+# The latest result is shown a page at a time; Previous / Next re-run its stored
+# query for another page (see pagination.py), without an LLM call
+def turn_page(cursor, number):
+    trace = tracing.start_trace(f"page {number + 1}", mode="page", backend=cursor.backend)
+    try:
+        cursor.load(number)
+    except Exception as e:
+        trace.fail(e)
+        st.session_state.page_error = f"Could not load page {number + 1}: {e}"
+    finally:
+        tracing.finish_trace(trace)
+
+
+cursor = pagination.active_cursor(st.session_state)
+if cursor is not None and cursor.page is not None:
+    page = cursor.page
+    with st.chat_message("assistant", avatar="🤖"):
+        st.markdown(f"**📊 {page.describe()}**")
+        if st.session_state.get("page_error"):
+            st.error(st.session_state.pop("page_error"))
+        if cursor.backend == "sql":
+            frame = page.rows.copy()
+            frame.index = range(page.start + 1, page.start + len(frame) + 1)
+            st.dataframe(frame)
+            if "image_url" in frame.columns:
+                show_menu_photos(frame)
+        else:
+            nosql_module.show_documents(page.rows)
+        previous_col, next_col = st.columns(2)
+        previous_col.button("◀ Previous", key="page_previous", disabled=page.number == 0,
+                            on_click=turn_page, args=(cursor, page.number - 1))
+        next_col.button("Next ▶", key="page_next", disabled=not page.has_next,
+                        on_click=turn_page, args=(cursor, page.number + 1))
+
+# --- Pending Bulk Write ---
+# Multi-row / multi-document writes are only applied once their dry run is confirmed
+pending = st.session_state.get("pending_write")
+if pending is not None:
+    with st.chat_message("assistant", avatar="🤖"):
+        st.warning(f"⚠️ Dry run: {pending.description}. Nothing has been changed yet.")
+        apply_col, cancel_col = st.columns(2)
+        if apply_col.button("✅ Apply write", key="apply_pending_write"):
+            st.session_state.pending_write = None
+            trace = tracing.start_trace(pending.description, mode="confirm_write", backend=pending.backend)
+            try:
+                success, msg = pending.apply()
+            finally:
+                tracing.finish_trace(trace)
+            if success:
+                compaction.record_summary("write_ack")
+                st.session_state.query_state = None
+            add_message("assistant", ("✅ " if success else "❌ ") + msg)
+            st.rerun()
+        if cancel_col.button("✖️ Cancel", key="cancel_pending_write"):
+            st.session_state.pending_write = None
+            add_message("assistant", "Write cancelled, nothing was changed.")
+            st.rerun()
 
 # --- Style Tweaks ---
 st.markdown("""
@@ -207,3 +369,30 @@ st.markdown("""
         .stChatMessage { max-width: 90%; }
     </style>
 """, unsafe_allow_html=True)
+
+# --- Startup / Rerun Timing Report ---
+resources.record_rerun(time.perf_counter() - _run_start)
+with st.sidebar:
+    with st.expander("⏱️ Startup / Rerun Timings"):
+        st.json(resources.timing_report())
+    with st.expander("🧩 Query Paths (template / cache / LLM)"):
+        st.json(templates.path_stats())
+    with st.expander("🗃️ Query Translation Cache"):
+        st.json(query_cache.get_translation_cache().stats())
+    with st.expander("🧮 Summary Calls"):
+        st.json(compaction.summary_stats())
+    with st.expander("⚡ Result Cache"):
+        st.json(result_cache.get_result_cache().stats())
+    with st.expander("🔌 MySQL Connection Pool"):
+        st.json(sql_module.pool_metrics(sql_module.db_config))
+    with st.expander("🖼️ Image Cache"):
+        st.json(image_cache.get_image_cache().metrics())
+    with st.expander("🦆 SQL Backend"):
+        st.json(sql_module.backend_metrics(sql_module.db_config))
+    with st.expander("🔤 Text Search"):
+        st.json(text_search.metrics())
+    if st.checkbox("🔎 Debug: last request trace") and st.session_state.get("last_trace"):
+        last_trace = st.session_state["last_trace"]
+        st.caption(f"{last_trace['duration_ms']:.0f} ms, {last_trace['status']}, trace {last_trace['trace_id']}")
+        st.dataframe(pd.DataFrame(last_trace["spans"])[["name", "start_ms", "duration_ms"]], hide_index=True)
+        st.json(last_trace)
@@ -0,0 +1,673 @@
+import argparse
+import concurrent.futures as cf
+import json
+import math
+import operator
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+import resources
+
+# --- Headless replay benchmark ---
+# Replays a corpus of questions through the stages of a chat turn
+# (route -> generate -> execute -> summarize) without Streamlit, LLM APIs or
+# database servers:
+#   * the corpus is sample.txt's read questions plus the example questions in
+#     the sqlrest_cleaned prompt;
+#   * LLM calls are answered from recorded responses (the sample.txt pipeline,
+#     the closest sample SQL query, or a --recordings file) after a simulated latency;
+#   * SQL runs on the embedded backend (sql_backends) over the bundled CSVs;
+#   * MongoDB runs on a small in-process aggregation engine (or, with
+#     --mongomock, on mongomock, which lacks $geoNear, so those turns fail)
+#     over synthetic listings and the real host.csv.
+# Caches start empty and, unless --warm, never store anything, so every turn
+# takes the uncached path. Reports per-stage p50/p95, throughput for N
+# concurrent sessions and the tracemalloc peak, and exits with status 1 when a
+# turn failed or a saved baseline is worse by more than the tolerance.
+#
+#   python benchmark.py --save-baseline          # record this machine's baseline
+#   python benchmark.py                          # compare against it
+#   python benchmark.py --sessions 16 --llm-latency-ms 400
+
+STAGES = ("route", "generate", "execute", "summarize", "total")
+BASELINE_PATH = resources.cache_path("benchmark_baseline.json")
+TOLERANCE = float(resources.getenv("BENCH_TOLERANCE", "0.25"))
+# Differences below these are noise, whatever the ratio
+LATENCY_FLOOR_MS = 5.0
+MEMORY_FLOOR_MB = 1.0
+
+SUMMARY_TEXT = ("The query returned the rows shown above. The most relevant results match the question's filters, "
+                "and the figures summarize the values across every returned row.")
+_CLASSIFY_RE = re.compile(r'The user asked: "(.*)"')
+_USER_QUESTION_RE = re.compile(r"User question: (.*)")
+
+
+@dataclass
+class Turn:
+    question: str
+    backend: str      # "sql" or "mongo"
+    response: str     # recorded answer of the generation LLM call
+
+
+# --- Corpus ---
+def _sql_questions(prompt_text):
+    section = prompt_text.split("-- ✅ Schema Exploration:", 1)[1].split("-- ✅ Sample Queries:", 1)[0]
+    return [line.strip() for line in section.splitlines()
+            if line.strip() and not line.strip().endswith(";")]
+
+
+def build_corpus(recordings=None):
+    """Read-only turns from sample.txt and the SQL prompt; ``recordings`` maps questions to LLM responses."""
+    import maincpy_cleaned
+    import sqlrest_cleaned
+
+    recordings = recordings or {}
+    turns = []
+    _, examples = maincpy_cleaned.parse_samples(resources.read_text("sample.txt", default=""))
+    for question, query in examples:
+        response = recordings.get(question, query)
+        # Write operations would change the data between repeats
+        if response.startswith("["):
+            turns.append(Turn(question, "mongo", response))
+    _, _, samples, _, _, index = sqlrest_cleaned._sql_prompt_parts(sqlrest_cleaned.prompt[0])
+    for question in _sql_questions(sqlrest_cleaned.prompt[0]):
+        closest = (index.search(question, k=1) or [0])[0]
+        response = recordings.get(question, samples[closest])
+        if response.lower().startswith("select"):
+            turns.append(Turn(question, "sql", response))
+    return turns
+
+
+# --- Recorded LLM ---
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class RecordedLLM:
+    """Stands in for both the OpenAI chat handle and the Gemini model, answering from the corpus."""
+
+    model_name = "recorded"
+
+    def __init__(self, turns, latency_s=0.0):
+        import query_cache
+        self._normalize = query_cache.normalize_question
+        self.turns = {self._normalize(t.question): t for t in turns}
+        self.latency_s = latency_s
+        self.calls = Counter()
+
+    def _turn(self, question):
+        return self.turns[self._normalize(question.strip())]
+
+    def invoke(self, messages):
+        text = messages[-1].content
+        time.sleep(self.latency_s)
+        classify = _CLASSIFY_RE.search(text)
+        if classify:
+            self.calls["classify"] += 1
+            return _Message("MongoDB" if self._turn(classify.group(1)).backend == "mongo" else "SQL")
+        self.calls["mongo_generate"] += 1
+        return _Message(self._turn(_USER_QUESTION_RE.findall(text)[-1]).response)
+
+    def generate_content(self, parts, **kwargs):
+        time.sleep(self.latency_s)
+        self.calls["sql_generate"] += 1
+        return SimpleNamespace(text=self._turn(parts[-1]).response)
+
+    def stream(self, messages):
+        self.calls["summary"] += 1
+        words = SUMMARY_TEXT.split(" ")
+        for i in range(0, len(words), 4):
+            time.sleep(self.latency_s / (len(words) / 4))
+            yield _Message(" ".join(words[i:i + 4]) + " ")
+
+
+# --- In-process MongoDB stand-in ---
+_MISSING = object()
+_COMPARE = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+
+def _get(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list):
+            value = [v[part] for v in value if isinstance(v, dict) and part in v]
+        elif isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _comparable(a, b):
+    numbers = (int, float)
+    return isinstance(a, numbers) == isinstance(b, numbers) and not isinstance(a, (dict, list))
+
+
+def _op_matches(value, op, arg, condition):
+    values = value if isinstance(value, list) else [value]
+    if op == "$eq":
+        return _value_matches(value, arg)
+    if op == "$ne":
+        return not _value_matches(value, arg)
+    if op in _COMPARE:
+        return any(v is not _MISSING and v is not None and _comparable(v, arg) and _COMPARE[op](v, arg)
+                   for v in values)
+    if op == "$in":
+        return any(v in arg for v in values)
+    if op == "$nin":
+        return not any(v in arg for v in values)
+    if op == "$exists":
+        return (value is not _MISSING) == bool(arg)
+    if op == "$regex":
+        flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+        return any(isinstance(v, str) and re.search(arg, v, flags) for v in values)
+    if op == "$options":
+        return True
+    raise NotImplementedError(f"query operator {op}")
+
+
+def _value_matches(value, condition):
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        return all(_op_matches(value, op, arg, condition) for op, arg in condition.items())
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return (None if value is _MISSING else value) == condition
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        if key == "$and":
+            ok = all(_matches(doc, q) for q in condition)
+        elif key == "$or":
+            ok = any(_matches(doc, q) for q in condition)
+        elif key.startswith("$"):
+            raise NotImplementedError(f"query operator {key}")
+        else:
+            ok = _value_matches(_get(doc, key), condition)
+        if not ok:
+            return False
+    return True
+
+
+def _evaluate(doc, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, dict):
+        if len(expr) == 1 and next(iter(expr)) == "$literal":
+            return expr["$literal"]
+        if any(k.startswith("$") for k in expr):
+            raise NotImplementedError(f"expression {next(iter(expr))}")
+        return {k: _evaluate(doc, v) for k, v in expr.items()}
+    return expr
+
+
+def _pick(value, parts):
+    if isinstance(value, list):
+        return [p for p in (_pick(v, parts) for v in value) if p is not _MISSING]
+    if not isinstance(value, dict) or parts[0] not in value:
+        return _MISSING
+    if len(parts) == 1:
+        return {parts[0]: value[parts[0]]}
+    inner = _pick(value[parts[0]], parts[1:])
+    return _MISSING if inner is _MISSING else {parts[0]: inner}
+
+
+def _merge(target, picked):
+    for key, value in picked.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        elif isinstance(value, list) and isinstance(target.get(key), list):
+            for existing, new in zip(target[key], value):
+                if isinstance(existing, dict) and isinstance(new, dict):
+                    _merge(existing, new)
+        else:
+            target[key] = value
+
+
+def _project(doc, spec):
+    inclusion = any(v not in (0, False) for k, v in spec.items() if k != "_id")
+    if not inclusion:
+        return {k: v for k, v in doc.items() if spec.get(k, 1) not in (0, False)}
+    out = {"_id": doc["_id"]} if "_id" in doc and spec.get("_id", 1) not in (0, False) else {}
+    for key, value in spec.items():
+        if key == "_id":
+            continue
+        if value in (1, True):
+            picked = _pick(doc, key.split("."))
+            if picked is not _MISSING:
+                _merge(out, picked)
+        else:
+            out[key] = _evaluate(doc, value)
+    return out
+
+
+def _sort_key(value):
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, str(value))
+
+
+def _group(docs, spec):
+    groups = {}
+    for doc in docs:
+        key = _evaluate(doc, spec["_id"])
+        state = groups.setdefault(json.dumps(key, sort_keys=True, default=str), ({"_id": key}, defaultdict(list)))
+        for name, accumulator in spec.items():
+            if name != "_id":
+                op, arg = next(iter(accumulator.items()))
+                value = _evaluate(doc, arg)
+                if value is not None:
+                    state[1][name].append(value)
+    out = []
+    for result, collected in groups.values():
+        for name, accumulator in spec.items():
+            if name == "_id":
+                continue
+            op = next(iter(accumulator))
+            values = collected[name]
+            numbers = [v for v in values if isinstance(v, (int, float))]
+            if op == "$sum":
+                result[name] = sum(numbers)
+            elif op == "$avg":
+                result[name] = statistics.fmean(numbers) if numbers else None
+            elif op in ("$min", "$max"):
+                result[name] = (min if op == "$min" else max)(values, key=_sort_key) if values else None
+            elif op in ("$first", "$last"):
+                result[name] = (values[0] if op == "$first" else values[-1]) if values else None
+            elif op == "$push":
+                result[name] = values
+            elif op == "$addToSet":
+                result[name] = list({json.dumps(v, sort_keys=True, default=str): v for v in values}.values())
+            else:
+                raise NotImplementedError(f"accumulator {op}")
+        out.append(result)
+    return out
+
+
+def _lookup(db, docs, spec):
+    foreign = defaultdict(list)
+    for other in db[spec["from"]].docs:
+        key = _get(other, spec["foreignField"])
+        for k in key if isinstance(key, list) else [key]:
+            if k is not _MISSING:
+                foreign[k].append(other)
+    out = []
+    for doc in docs:
+        local = _get(doc, spec["localField"])
+        keys = local if isinstance(local, list) else [local]
+        matched = [other for k in keys if k is not _MISSING for other in foreign.get(k, [])]
+        if "pipeline" in spec:
+            matched = run_pipeline(db, matched, spec["pipeline"])
+        out.append(dict(doc, **{spec["as"]: matched}))
+    return out
+
+
+def _unwind(docs, spec):
+    spec = {"path": spec} if isinstance(spec, str) else spec
+    path, keep = spec["path"].lstrip("$"), spec.get("preserveNullAndEmptyArrays", False)
+    out = []
+    for doc in docs:
+        value = _get(doc, path)
+        if isinstance(value, list) and value:
+            out += [dict(doc, **{path: item}) for item in value]
+        elif value is not _MISSING and not isinstance(value, list):
+            out.append(doc)
+        elif keep:
+            out.append({k: v for k, v in doc.items() if k != path})
+    return out
+
+
+def _geo_near(docs, spec):
+    lon, lat = (math.radians(c) for c in spec["near"]["coordinates"])
+    out = []
+    for doc in docs:
+        point = _get(doc, spec.get("key", "location"))
+        if not isinstance(point, dict) or spec.get("query") and not _matches(doc, spec["query"]):
+            continue
+        plon, plat = (math.radians(c) for c in point["coordinates"])
+        # Haversine distance in meters
+        a = math.sin((plat - lat) / 2) ** 2 + math.cos(lat) * math.cos(plat) * math.sin((plon - lon) / 2) ** 2
+        distance = 2 * 6371008.8 * math.asin(math.sqrt(a))
+        if distance <= spec.get("maxDistance", math.inf):
+            out.append(dict(doc, **{spec["distanceField"]: distance}))
+    return sorted(out, key=lambda d: d[spec["distanceField"]])
+
+
+def run_pipeline(db, docs, pipeline):
+    """Evaluate the aggregation stages the corpus uses; anything else raises NotImplementedError."""
+    for stage in pipeline:
+        op, spec = next(iter(stage.items()))
+        if op == "$match":
+            docs = [d for d in docs if _matches(d, spec)]
+        elif op == "$project":
+            docs = [_project(d, spec) for d in docs]
+        elif op in ("$addFields", "$set"):
+            docs = [dict(d, **{k: _evaluate(d, v) for k, v in spec.items()}) for d in docs]
+        elif op == "$sort":
+            docs = list(docs)
+            for key, direction in reversed(list(spec.items())):
+                docs.sort(key=lambda d: _sort_key(_get(d, key)), reverse=direction < 0)
+        elif op == "$limit":
+            docs = docs[:spec]
+        elif op == "$skip":
+            docs = docs[spec:]
+        elif op == "$count":
+            docs = [{spec: len(docs)}]
+        elif op == "$group":
+            docs = _group(docs, spec)
+        elif op == "$lookup":
+            docs = _lookup(db, docs, spec)
+        elif op == "$unwind":
+            docs = _unwind(docs, spec)
+        elif op == "$geoNear":
+            docs = _geo_near(docs, spec)
+        else:
+            raise NotImplementedError(f"stage {op}")
+    return docs
+
+
+class MemoryCollection:
+    def __init__(self, database, name, docs):
+        self.database = database
+        self.name = name
+        self.docs = docs
+
+    def aggregate(self, pipeline, **options):
+        return iter([dict(d) for d in run_pipeline(self.database, self.docs, pipeline)])
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+
+class MemoryDatabase:
+    def __init__(self, collections):
+        self._collections = {name: MemoryCollection(self, name, docs) for name, docs in collections.items()}
+
+    def __getitem__(self, name):
+        return self._collections.setdefault(name, MemoryCollection(self, name, []))
+
+
+# --- Synthetic MongoDB data ---
+_CITIES = [("Washington", "DC", 38.90, -77.03), ("Arlington", "VA", 38.88, -77.10), ("Alexandria", "VA", 38.80, -77.05),
+           ("Seattle", "WA", 47.61, -122.33), ("Austin", "TX", 30.27, -97.74), ("Denver", "CO", 39.74, -104.99),
+           ("Boston", "MA", 42.36, -71.06), ("Chicago", "IL", 41.88, -87.63), ("Atlanta", "GA", 33.75, -84.39)]
+_PETS = ["Cats,Dogs", "Cats", "Dogs", "None"]
+_AMENITIES = ["Dishwasher", "Parking", "Pool", "Gym", "Patio/Deck", "Washer Dryer", "AC"]
+
+
+def mongo_data(listings, seed=7):
+    """Synthetic listings and reviews plus the real host.csv, as plain documents."""
+    import loader
+    from bson import ObjectId
+
+    rng = random.Random(seed)
+    spec = loader.TABLES["host"]
+    hosts = []
+    for chunk in loader.read_chunks(spec):
+        columns = list(chunk.columns)
+        hosts += [{c: v for c, v in zip(columns, row) if v is not None}
+                  for row in loader.records(loader.normalize(chunk, spec))]
+    for doc in hosts:
+        doc["_id"] = ObjectId()
+    host_ids = [h["host_id"] for h in hosts if "host_id" in h] or [0]
+    listing_docs, review_docs = [], []
+    for n in range(listings):
+        city, state, lat, lon = rng.choice(_CITIES)
+        lat, lon = round(lat + rng.uniform(-0.15, 0.15), 5), round(lon + rng.uniform(-0.15, 0.15), 5)
+        bedrooms, price = rng.randint(0, 4), rng.randrange(700, 6000, 5)
+        address = "3707 Woodley Rd NW" if n == 0 else f"{rng.randint(100, 9999)} {rng.choice('ABCDEFGHKLMNPR')} St"
+        listing_docs.append({
+            "_id": ObjectId(), "id": 5000000000 + n, "category": "housing/rent/apartment",
+            "title": f"{bedrooms} BR apartment in {city}", "body": f"Bright {bedrooms} bedroom unit in {city}, {state}.",
+            "amenities": ",".join(rng.sample(_AMENITIES, rng.randint(1, 4))), "bathrooms": rng.choice([1, 1.5, 2, 2.5]),
+            "bedrooms": bedrooms, "currency": "USD", "fee": rng.choice(["No", "Yes"]), "has_photo": "Thumbnail",
+            "picture_url": f"https://example.com/listing/{n}.jpg", "pets_allowed": rng.choice(_PETS), "price": price,
+            "price_display": f"${price:,}", "price_type": "Monthly", "square_feet": rng.randint(350, 2500),
+            "host_id": rng.choice(host_ids), "address": address,
+            "cityname": "Washington" if n == 0 else city, "state": "DC" if n == 0 else state,
+            "latitude": lat, "longitude": lon, "location": {"type": "Point", "coordinates": [lon, lat]},
+            "source": "RentLingo", "time": 1577000000 + n,
+        })
+        if rng.random() < 0.6:
+            review_docs.append({"_id": ObjectId(), "id": 5000000000 + n, "number_of_reviews": rng.randint(1, 300),
+                                "first_review": "2019-01-01", "last_review": "2024-06-01",
+                                "review_scores": round(rng.uniform(2.5, 5.0), 1)})
+    return {"listing": listing_docs, "host": hosts, "review": review_docs}
+
+
+def mongo_stand_in(listings, seed=7, use_mongomock=False):
+    data = mongo_data(listings, seed)
+    if not use_mongomock:
+        return MemoryDatabase(data), "in-process"
+    mongomock = resources.optional_module("mongomock")
+    db = mongomock.MongoClient()["house"]
+    for name, docs in data.items():
+        db[name].insert_many(docs)
+    return db, "mongomock"
+
+
+# --- Replay ---
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.paths = Counter()
+        self.errors = Counter()
+        self.misroutes = 0
+        self.turns = 0
+
+    def add(self, other):
+        for stage, values in other.samples.items():
+            self.samples[stage] += values
+        self.paths.update(other.paths)
+        self.errors.update(other.errors)
+        self.misroutes += other.misroutes
+        self.turns += other.turns
+
+
+def run_turn(turn, recorder):
+    """One chat turn through the headless runner's stages (the app's stage functions, minus the rendering)."""
+    import headless
+
+    record = headless.run_question(turn.question, check_plan=False)
+    for stage, seconds in record["timings"].items():
+        recorder.samples[stage].append(seconds)
+    recorder.paths[(record["path"] or "none").split(":")[0]] += 1
+    if record["backend"] != turn.backend:
+        recorder.misroutes += 1
+    recorder.turns += 1
+    return record["answer"]
+
+
+def replay(turns, repeat, seed=0):
+    recorder = Recorder()
+    order = list(turns) * repeat
+    random.Random(seed).shuffle(order)
+    for turn in order:
+        try:
+            run_turn(turn, recorder)
+        except Exception as e:
+            recorder.errors[f"{turn.question[:60]}: {type(e).__name__}: {e}"] += 1
+    return recorder
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))]
+
+
+def stage_stats(recorder):
+    return {stage: {"p50_ms": round(percentile(recorder.samples[stage], 50) * 1000, 3),
+                    "p95_ms": round(percentile(recorder.samples[stage], 95) * 1000, 3),
+                    "n": len(recorder.samples[stage])}
+            for stage in STAGES if recorder.samples[stage]}
+
+
+def configure(args, workdir):
+    """Point every app module at the stand-ins; must run before the app modules are imported."""
+    os.environ.update({"CHATBOT_CACHE_DIR": workdir, "SQL_BACKEND": "embedded",
+                       "SQL_EMBEDDED_SYNC": "off", "SQL_EMBEDDED_FALLBACK": "0"})
+    if not args.warm:
+        os.environ.update({"RESULT_CACHE_MAX_BYTES": "0", "TRANSLATION_CACHE_MAX_ENTRIES": "0"})
+    if args.mongomock:
+        os.environ["MONGO_LOOKUP_PIPELINE"] = "0"  # mongomock has no pipeline-form $lookup
+    recordings = {}
+    if args.recordings:
+        with open(args.recordings, encoding="utf-8") as f:
+            recordings = json.load(f)
+    turns = build_corpus(recordings)
+    llm = RecordedLLM(turns, args.llm_latency_ms / 1000)
+    db, mongo_kind = mongo_stand_in(args.listings, args.seed, args.mongomock)
+    resources.get_openai_llm = lambda: llm
+    resources.get_gemini_model = lambda model_name="gemini-2.0-flash": llm
+    resources.get_collection = lambda name, db_name="house": db[name]
+    return turns, llm, mongo_kind
+
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix="chatbot-bench-") as workdir:
+        turns, llm, mongo_kind = configure(args, workdir)
+        started = time.perf_counter()
+        warmup = replay(turns, 1, args.seed)  # builds the embedded tables, router, prompt indexes
+        startup_s = time.perf_counter() - started
+
+        single = replay(turns, args.repeat, args.seed)
+
+        concurrent = Recorder()
+        started = time.perf_counter()
+        with cf.ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            for recorder in pool.map(lambda s: replay(turns, args.repeat, args.seed + s), range(args.sessions)):
+                concurrent.add(recorder)
+        wall_s = time.perf_counter() - started
+
+        tracemalloc.start()
+        memory = replay(turns, 1, args.seed)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    errors = Counter()
+    for recorder in (warmup, single, concurrent, memory):
+        errors.update(recorder.errors)
+    return {
+        "config": {"sessions": args.sessions, "repeat": args.repeat, "llm_latency_ms": args.llm_latency_ms,
+                   "listings": args.listings, "warm": args.warm, "turns": len(turns),
+                   "recordings": bool(args.recordings), "mongo": mongo_kind},
+        "startup_s": round(startup_s, 3),
+        "stages": stage_stats(single),
+        "under_load": stage_stats(concurrent)["total"] if concurrent.turns else {},
+        "throughput_tps": round(concurrent.turns / wall_s, 2) if wall_s else 0.0,
+        "peak_memory_mb": round(peak / 2 ** 20, 2),
+        "paths": dict(single.paths),
+        "llm_calls": dict(llm.calls),
+        "misroutes": single.misroutes,
+        "errors": sum(errors.values()),
+        "error_samples": sorted(errors)[:10],
+    }
+
+
+# --- Baseline comparison ---
+def compare(report, baseline, tolerance=TOLERANCE):
+    """Descriptions of every metric that is worse than ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    for stage, old in baseline["stages"].items():
+        new = report["stages"].get(stage)
+        for key in ("p50_ms", "p95_ms"):
+            if new and new[key] > old[key] * (1 + tolerance) and new[key] - old[key] > LATENCY_FLOOR_MS:
+                regressions.append(f"{stage} {key}: {old[key]:.2f} -> {new[key]:.2f}")
+    old, new = baseline["throughput_tps"], report["throughput_tps"]
+    if new < old * (1 - tolerance):
+        regressions.append(f"throughput: {old:.2f} -> {new:.2f} turns/s")
+    old, new = baseline["peak_memory_mb"], report["peak_memory_mb"]
+    if new > old * (1 + tolerance) and new - old > MEMORY_FLOOR_MB:
+        regressions.append(f"peak memory: {old:.2f} -> {new:.2f} MB")
+    if report["errors"] > baseline["errors"]:
+        regressions.append(f"errors: {baseline['errors']} -> {report['errors']}")
+    return regressions
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"{config['turns']} turns x {config['repeat']} repeats, {config['sessions']} sessions, "
+          f"LLM latency {config['llm_latency_ms']} ms, MongoDB stand-in: {config['mongo']}, "
+          f"caches {'warm' if config['warm'] else 'off'}")
+    print(f"startup (first pass) {report['startup_s']:.2f}s")
+    print(f"{'stage':<10} {'p50 ms':>10} {'p95 ms':>10} {'n':>6}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<10} {stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f} {stats['n']:>6}")
+    if report["under_load"]:
+        load = report["under_load"]
+        print(f"total with {config['sessions']} sessions: p50 {load['p50_ms']:.2f} ms, p95 {load['p95_ms']:.2f} ms")
+    print(f"throughput {report['throughput_tps']:.2f} turns/s, peak traced memory {report['peak_memory_mb']:.2f} MB")
+    print(f"paths {report['paths']}, LLM calls {report['llm_calls']}, misroutes {report['misroutes']}")
+    if report["errors"]:
+        print(f"{report['errors']} failed turns, e.g.:")
+        for sample in report["error_samples"]:
+            print(f"  {sample}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the sample questions headlessly and report per-stage latency")
+    parser.add_argument("--sessions", type=int, default=int(resources.getenv("BENCH_SESSIONS", "4")),
+                        help="concurrent simulated sessions for the throughput pass")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the corpus per session")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency of every LLM call")
+    parser.add_argument("--listings", type=int, default=5000, help="synthetic listings in the MongoDB stand-in")
+    parser.add_argument("--recordings", help="JSON file mapping questions to recorded LLM responses")
+    parser.add_argument("--warm", action="store_true", help="let the translation / result caches store entries")
+    parser.add_argument("--mongomock", action="store_true",
+                        help="run MongoDB on mongomock instead of the in-process engine ($geoNear turns fail)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed relative slowdown (0.25 = 25%%)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if report["errors"]:
+        # Failed turns are left out of the latency figures, so the run measured a different workload
+        print("FAILED: turns raised errors; no baseline saved or compared")
+        return 1
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except OSError:
+        print("No baseline yet; run with --save-baseline to record one")
+        return 0
+    if baseline["config"] != report["config"]:
+        print(f"Baseline was recorded with different settings: {baseline['config']}")
+        return 2
+    regressions = compare(report, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions beyond {args.tolerance:.0%} of the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+import re
+from dataclasses import dataclass
+
+import resources
+import tracing
+import index_advisor
+import result_cache
+import text_search
+
+# --- Bulk writes with a dry-run preview ---
+# MongoDB write operations generated by the model ({"operation": "updateMany",
+# "collection": "review", "filter": ..., "update": ...}) go to the collection
+# they name, are previewed with count_documents, and run through unordered
+# bulk_write calls of MONGO_WRITE_CHUNK operations. Multi-document operations
+# wait for the user to confirm the preview unless BULK_WRITE_CONFIRM=0.
+#
+# SQL writes are split into statements; consecutive INSERTs into the same
+# columns with literal VALUES are merged into executemany batches of
+# SQL_WRITE_CHUNK rows, and the whole script runs in one transaction.
+
+MONGO_CHUNK = int(resources.getenv("MONGO_WRITE_CHUNK", "500"))
+SQL_CHUNK = int(resources.getenv("SQL_WRITE_CHUNK", "500"))
+CONFIRM = resources.getenv("BULK_WRITE_CONFIRM", "1") == "1"
+PREVIEW_MAX_TIME_MS = int(resources.getenv("WRITE_PREVIEW_MAX_TIME_MS", "5000"))
+
+MONGO_OPERATIONS = ("insertOne", "insertMany", "updateOne", "updateMany", "deleteOne", "deleteMany")
+
+
+class InvalidWrite(Exception):
+    pass
+
+
+@dataclass
+class PendingWrite:
+    """A previewed write waiting for confirmation; ``apply()`` returns ``(success, message)``."""
+    backend: str
+    description: str
+    apply: object
+
+
+# --- MongoDB ---
+@dataclass
+class MongoWrite:
+    operation: str
+    collection: str
+    filter: dict = None
+    update: object = None
+    documents: list = None
+
+    @property
+    def bulk(self):
+        return self.operation.endswith("Many")
+
+    @property
+    def verb(self):
+        return re.match(r"[a-z]+", self.operation).group(0)
+
+    @classmethod
+    def parse(cls, response, collections, default="listing"):
+        """Validate a generated write; ``collections`` are the names writes may target."""
+        operation = response.get("operation")
+        if operation not in MONGO_OPERATIONS:
+            raise InvalidWrite(f"Unsupported operation {operation!r}")
+        name = str(response.get("collection") or default).removesuffix("_collection")
+        if name not in collections:
+            raise InvalidWrite(f"Unknown collection {name!r}")
+        if operation.startswith("insert"):
+            documents = response.get("documents") if operation == "insertMany" else [response.get("document")]
+            if not documents or not all(isinstance(doc, dict) for doc in documents):
+                raise InvalidWrite(f"{operation} needs document(s) to insert")
+            return cls(operation, name, documents=documents)
+        query_filter = response.get("filter")
+        if not isinstance(query_filter, dict):
+            raise InvalidWrite(f"{operation} needs a filter")
+        if operation.startswith("update") and not isinstance(response.get("update"), (dict, list)):
+            raise InvalidWrite(f"{operation} needs an update")
+        return cls(operation, name, filter=query_filter, update=response.get("update"))
+
+    def preview(self):
+        """Documents the write would touch, counted without changing anything."""
+        if self.documents is not None:
+            return len(self.documents)
+        options = {"maxTimeMS": PREVIEW_MAX_TIME_MS}
+        if not self.bulk:
+            options["limit"] = 1
+        return resources.get_collection(self.collection).count_documents(self.filter, **options)
+
+    def requests(self):
+        from pymongo import DeleteMany, DeleteOne, InsertOne, UpdateMany, UpdateOne
+
+        if self.documents is not None:
+            return [InsertOne(doc) for doc in self.documents]
+        return [{"updateOne": lambda: UpdateOne(self.filter, self.update),
+                 "updateMany": lambda: UpdateMany(self.filter, self.update),
+                 "deleteOne": lambda: DeleteOne(self.filter),
+                 "deleteMany": lambda: DeleteMany(self.filter)}[self.operation]()]
+
+    def apply(self, chunk_size=MONGO_CHUNK):
+        """Run the write as unordered bulk_write chunks; returns ``(success, message)``."""
+        from pymongo.errors import BulkWriteError
+
+        collection = resources.get_collection(self.collection)
+        if self.filter is not None:
+            index_advisor.record_mongo(self.collection, query_filter=self.filter)
+        requests = self.requests()
+        totals = {"inserted": 0, "matched": 0, "modified": 0, "deleted": 0}
+        errors = []
+        with tracing.span("db.mongo_write", collection=self.collection, operation=self.operation) as span:
+            try:
+                for start in range(0, len(requests), chunk_size):
+                    try:
+                        result = collection.bulk_write(requests[start:start + chunk_size], ordered=False)
+                        counts = {"inserted": result.inserted_count, "matched": result.matched_count,
+                                  "modified": result.modified_count, "deleted": result.deleted_count}
+                    except BulkWriteError as e:
+                        # Unordered: the rest of the chunk was still applied
+                        counts = {"inserted": e.details.get("nInserted", 0), "matched": e.details.get("nMatched", 0),
+                                  "modified": e.details.get("nModified", 0), "deleted": e.details.get("nRemoved", 0)}
+                        errors += [err.get("errmsg", str(err)) for err in e.details.get("writeErrors", [])]
+                    for key, value in counts.items():
+                        totals[key] += value
+            finally:
+                result_cache.get_result_cache().invalidate(self.collection)
+                text_search.invalidate(self.collection)
+            span.set(rows_affected=totals["inserted"] + totals["modified"] + totals["deleted"], failed=len(errors))
+        done = {"insert": f"Inserted {totals['inserted']}",
+                "update": f"Updated {totals['modified']} of {totals['matched']} matched",
+                "delete": f"Deleted {totals['deleted']}"}[self.verb]
+        message = f"{done} document(s) in `{self.collection}`"
+        if errors:
+            return False, f"{message}; {len(errors)} write(s) failed, first: {errors[0]}"
+        return True, message
+
+    def describe(self, matched):
+        return f"`{self.operation}` would {self.verb} {matched:,} document(s) in `{self.collection}`"
+
+
+# --- SQL ---
+_STRING = r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\""
+_LITERAL_RE = re.compile(r"\s*(" + _STRING + r"|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|NULL|TRUE|FALSE)\s*(,|\))", re.IGNORECASE)
+_INSERT_RE = re.compile(r"^\s*(INSERT\s+(?:IGNORE\s+)?INTO\s+[`\w.]+\s*\([^)]*\))\s*VALUES\s*", re.IGNORECASE)
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "0": "\0", "b": "\b", "Z": "\x1a"}
+
+
+def split_statements(sql):
+    """Split a script on semicolons outside quoted strings and backticks."""
+    statements, start, quote, i = [], 0, None, 0
+    while i < len(sql):
+        ch = sql[i]
+        if quote:
+            if ch == "\\" and quote != "`":
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in "'\"`":
+            quote = ch
+        elif ch == ";":
+            statements.append(sql[start:i].strip())
+            start = i + 1
+        i += 1
+    statements.append(sql[start:].strip())
+    return [s for s in statements if s]
+
+
+def _unquote(token):
+    body = token[1:-1].replace(token[0] * 2, token[0])
+    return re.sub(r"\\(.)", lambda m: _ESCAPES.get(m.group(1), m.group(1)), body)
+
+
+def _literal(token):
+    upper = token.upper()
+    if upper == "NULL":
+        return None
+    if upper in ("TRUE", "FALSE"):
+        return int(upper == "TRUE")
+    if token[0] in "'\"":
+        return _unquote(token)
+    return float(token) if any(c in token for c in ".eE") else int(token)
+
+
+def parse_insert(statement):
+    """``(prefix, rows)`` for an INSERT of literal VALUES tuples, else None (run the statement as it is)."""
+    m = _INSERT_RE.match(statement)
+    if not m:
+        return None
+    rows, pos, text = [], m.end(), statement
+    while True:
+        if text[pos:pos + 1] != "(":
+            return None
+        pos, row = pos + 1, []
+        while True:
+            literal = _LITERAL_RE.match(text, pos)
+            if not literal:
+                return None  # an expression (NOW(), a subquery...)
+            row.append(_literal(literal.group(1)))
+            pos = literal.end()
+            if literal.group(2) == ")":
+                break
+        rows.append(tuple(row))
+        rest = re.match(r"\s*,\s*", text[pos:])
+        if not rest:
+            break
+        pos += rest.end()
+    if text[pos:].strip():
+        return None  # ON DUPLICATE KEY UPDATE ... and the like
+    if len({len(row) for row in rows}) != 1:
+        return None
+    return re.sub(r"\s+", " ", m.group(1)), rows
+
+
+def plan_sql(sql, chunk_size=SQL_CHUNK):
+    """Batches for a write script: ``("many", template, rows)`` per executemany chunk, ``("one", statement)`` otherwise."""
+    batches = []
+    for statement in split_statements(sql):
+        parsed = parse_insert(statement)
+        if parsed is None:
+            batches.append(("one", statement))
+            continue
+        prefix, rows = parsed
+        template = f"{prefix} VALUES ({', '.join(['%s'] * len(rows[0]))})"
+        last = batches[-1] if batches else None
+        if last and last[0] == "many" and last[1] == template and len(last[2]) < chunk_size:
+            room = chunk_size - len(last[2])
+            last[2].extend(rows[:room])
+            rows = rows[room:]
+        for start in range(0, len(rows), chunk_size):
+            batches.append(("many", template, rows[start:start + chunk_size]))
+    return batches
+
+
+# Group 1 is the table (with its alias, if any), group 2 the WHERE condition
+_UPDATE_RE = re.compile(r"^\s*UPDATE\s+([`\w.]+(?:\s+(?:AS\s+)?(?!SET\b)\w+)?)\s+SET\s+.*?(?:\s+WHERE\s+(.*))?$",
+                        re.IGNORECASE | re.DOTALL)
+_DELETE_RE = re.compile(r"^\s*DELETE\s+FROM\s+([`\w.]+(?:\s+(?:AS\s+)?(?!WHERE\b)\w+)?)(?:\s+WHERE\s+(.*))?$",
+                        re.IGNORECASE | re.DOTALL)
+
+
+def count_queries(sql):
+    """``(statement, count_sql_or_rows)`` per statement of a write script for the dry-run preview.
+
+    INSERTs report their row count directly; single-table UPDATE / DELETE get a
+    ``SELECT COUNT(*)`` over the same WHERE clause; anything else gets None.
+    """
+    previews = []
+    for statement in split_statements(sql):
+        parsed = parse_insert(statement)
+        if parsed is not None:
+            previews.append((statement, len(parsed[1])))
+            continue
+        m = _DELETE_RE.match(statement) or _UPDATE_RE.match(statement)
+        if m and not re.search(r"\b(JOIN|ORDER\s+BY|LIMIT)\b", statement, re.IGNORECASE) and "," not in m.group(1):
+            where = f" WHERE {m.group(2)}" if m.group(2) else ""
+            previews.append((statement, f"SELECT COUNT(*) AS matched FROM {m.group(1)}{where}"))
+        else:
+            previews.append((statement, None))
+    return previews
@@ -0,0 +1,126 @@
+import csv
+import io
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import resources
+
+# --- Persistent chat history ---
+# Every message is appended to a local SQLite store keyed by a session id that
+# lives in the page URL (?session=...), so a reload or a server restart picks
+# the conversation back up. The Streamlit session keeps only the last
+# CHAT_WINDOW messages in memory; older turns are read a page at a time when
+# asked for, and exports are written row by row straight from the database.
+#
+#   python chat_store.py SESSION_ID chat.csv     # export one session
+
+STORE_PATH = resources.getenv("CHAT_STORE_PATH", resources.cache_path("chat_history.sqlite"))
+CHAT_WINDOW = int(resources.getenv("CHAT_WINDOW", "20"))
+CHAT_PAGE_SIZE = int(resources.getenv("CHAT_PAGE_SIZE", "20"))
+EXPORT_COLUMNS = ["role", "content", "timestamp"]
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def valid_session_id(value):
+    """Whether ``value`` has the new_session_id() format; anything else from the URL is not trusted as an id."""
+    return isinstance(value, str) and re.fullmatch(r"[0-9a-f]{32}", value) is not None
+
+
+class ChatStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                created REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        self._conn.commit()
+
+    @staticmethod
+    def _message(row):
+        return {"id": row[0], "role": row[1], "content": row[2], "timestamp": row[3]}
+
+    def append(self, session_id, role, content, timestamp):
+        """Store one message and return it (with its id) for the in-memory window."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO messages (session_id, role, content, timestamp, created) VALUES (?, ?, ?, ?, ?)",
+                (session_id, role, str(content), timestamp, time.time()))
+            self._conn.commit()
+        return {"id": cur.lastrowid, "role": role, "content": str(content), "timestamp": timestamp}
+
+    def recent(self, session_id, limit=CHAT_WINDOW):
+        """The last ``limit`` messages of a session, oldest first."""
+        return self.before(session_id, None, limit)
+
+    def before(self, session_id, before_id, limit=CHAT_PAGE_SIZE):
+        """The page of up to ``limit`` messages just before ``before_id`` (the latest when None), oldest first."""
+        query = "SELECT id, role, content, timestamp FROM messages WHERE session_id = ?"
+        params = [session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+        return [self._message(row) for row in reversed(rows)]
+
+    def count(self, session_id):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def _write_csv(self, session_id, f):
+        # A separate connection keeps a long export from holding the shared one
+        conn = sqlite3.connect(self.path)
+        written = 0
+        try:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            for row in conn.execute("SELECT role, content, timestamp FROM messages WHERE session_id = ? ORDER BY id",
+                                    (session_id,)):
+                writer.writerow(row)
+                written += 1
+        finally:
+            conn.close()
+        return written
+
+    def export_csv(self, session_id, path):
+        """Write a session to ``path`` as CSV, one row at a time; returns the number of messages written."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            return self._write_csv(session_id, f)
+
+    def export_download(self, session_id):
+        """A session's CSV export as bytes for a download button, written in one pass into a buffer."""
+        # The download button needs the whole export in memory anyway, so no file is written for it
+        buffer = io.StringIO(newline="")
+        self._write_csv(session_id, buffer)
+        return buffer.getvalue().encode("utf-8")
+
+
+@resources.resource
+def get_chat_store():
+    return ChatStore()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python chat_store.py SESSION_ID OUTPUT.csv")
+    count = get_chat_store().export_csv(sys.argv[1], sys.argv[2])
+    print(f"Exported {count} messages to {sys.argv[2]}")
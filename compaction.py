@@ -0,0 +1,189 @@
+import threading
+from collections import Counter
+
+import pandas as pd
+
+import resources
+import retrieval
+
+# --- Token-budgeted result compaction for summary prompts ---
+# Query results are never pasted into the summarization prompt whole. Both
+# backends hand their rows here and get back a compact text block: the row
+# count, a profile of every column (numeric aggregates over *all* rows, top
+# values for categorical columns), and as many leading rows as fit the token
+# budget with long text truncated.
+
+TOKEN_BUDGET = int(resources.getenv("SUMMARY_TOKEN_BUDGET", "1500"))
+MAX_ROWS = int(resources.getenv("SUMMARY_MAX_ROWS", "20"))
+MAX_TEXT_CHARS = int(resources.getenv("SUMMARY_MAX_TEXT_CHARS", "160"))
+TOP_VALUES = 3
+# Results at most this big are answered by formatting them, without a summary LLM call
+SMALL_RESULT_ROWS = int(resources.getenv("SMALL_RESULT_ROWS", "5"))
+SMALL_RESULT_COLUMNS = 3
+SMALL_RESULT_TEXT_CHARS = 60
+
+
+def to_frame(results):
+    """DataFrame view of a result set (DataFrame, list of documents or scalars)."""
+    if isinstance(results, pd.DataFrame):
+        return results
+    rows = [doc if isinstance(doc, dict) else {"value": doc} for doc in results or []]
+    df = pd.DataFrame(rows)
+    # ObjectIds mean nothing to a reader, but a $group _id is the group key
+    if "_id" in df.columns and any(type(v).__name__ == "ObjectId" for v in df["_id"]):
+        df = df.drop(columns=["_id"])
+    return df
+
+
+def truncate(value, limit=MAX_TEXT_CHARS):
+    text = str(value)
+    if len(text) <= limit:
+        return text
+    return text[:limit].rstrip() + f"… (+{len(text) - limit} chars)"
+
+
+def _format_number(value):
+    if pd.isna(value):
+        return "n/a"
+    if float(value).is_integer():
+        return str(int(value))
+    return f"{value:.4g}" if abs(value) < 1e6 else f"{value:,.0f}"
+
+
+def _hashable(series):
+    # Documents can hold lists / sub-documents; profile those by their text
+    return series.map(lambda v: v if isinstance(v, (str, int, float, bool)) or v is None else str(v))
+
+
+def column_profile(name, series):
+    non_null = series.dropna()
+    parts = [f"{len(non_null)} non-null"]
+    numeric = pd.to_numeric(non_null, errors="coerce") if len(non_null) else non_null
+    if len(non_null) and numeric.notna().all() and not pd.api.types.is_bool_dtype(non_null):
+        parts.append(f"min {_format_number(numeric.min())}, max {_format_number(numeric.max())}, "
+                     f"mean {_format_number(numeric.mean())}, sum {_format_number(numeric.sum())}")
+    elif len(non_null):
+        values = _hashable(non_null)
+        distinct = values.nunique()
+        parts.append(f"{distinct} distinct")
+        if distinct < len(values):
+            top = values.value_counts().head(TOP_VALUES)
+            parts.append("top: " + ", ".join(f"{truncate(v, 40)} ({n})" for v, n in top.items()))
+        lengths = values.astype(str).str.len()
+        if lengths.max() > MAX_TEXT_CHARS:
+            parts.append(f"long text, avg {int(lengths.mean())} chars")
+    return f"- {name}: " + "; ".join(parts)
+
+
+def format_row(row):
+    return ", ".join(f"{k}: {truncate(v)}" for k, v in row.items() if not (isinstance(v, float) and pd.isna(v)))
+
+
+def compact_results(results, budget=None, max_rows=MAX_ROWS, more_available=False):
+    """Return ``(text, report)`` describing ``results`` within roughly ``budget`` tokens."""
+    budget = TOKEN_BUDGET if budget is None else budget
+    df = to_frame(results)
+    more_available = more_available or bool(df.attrs.get("more_available"))
+    header = f"Rows returned: {len(df)}" + (" (more rows exist beyond this cap)" if more_available else "")
+    lines = [header]
+    used = retrieval.estimate_tokens(header)
+
+    if len(df.columns) > 1 or len(df) > 1:
+        profile = ["Columns (computed over all returned rows):"]
+        for name in df.columns:
+            line = column_profile(name, df[name])
+            cost = retrieval.estimate_tokens(line)
+            if used + cost > budget // 2:
+                profile.append(f"- … {len(df.columns) - len(profile) + 1} more columns")
+                break
+            profile.append(line)
+            used += cost
+        lines += profile
+
+    rows_shown = 0
+    row_lines = []
+    for _, row in df.head(max_rows).iterrows():
+        line = format_row(row)
+        cost = retrieval.estimate_tokens(line)
+        if used + cost > budget and rows_shown:
+            break
+        if used + cost > budget:
+            line = truncate(line, max(40, (budget - used) * 4))
+            cost = retrieval.estimate_tokens(line)
+        row_lines.append(line)
+        used += cost
+        rows_shown += 1
+    if row_lines:
+        lines.append(f"First {rows_shown} rows:" if rows_shown < len(df) else "Rows:")
+        lines += row_lines
+
+    text = "\n".join(lines)
+    report = {
+        "rows_total": len(df),
+        "rows_in_prompt": rows_shown,
+        "columns": len(df.columns),
+        "result_tokens": retrieval.estimate_tokens(text),
+        "uncompacted_tokens": _raw_tokens(df),
+        "token_budget": budget,
+    }
+    return text, report
+
+
+def _raw_tokens(df):
+    # What the old "k: v" dump of every row would have cost, without building it
+    if df.empty:
+        return 0
+    chars = int(df.astype(str).apply(lambda col: col.str.len()).to_numpy().sum())
+    chars += sum(len(str(c)) + 4 for c in df.columns) * len(df)
+    return -(-chars // 4)
+
+
+def finish_report(report, prompt):
+    """Add the final prompt size (results plus instructions) to a compaction report."""
+    return dict(report, prompt_tokens=retrieval.estimate_tokens(prompt))
+
+
+# --- LLM-free answers for tiny results ---
+_summary_counts = Counter()
+_summary_lock = threading.Lock()
+
+
+def _cell(value):
+    if isinstance(value, bool) or not pd.api.types.is_number(value):
+        return str(value)
+    if pd.isna(value):
+        return "n/a"
+    return f"{value:,.0f}" if float(value).is_integer() else f"{value:,.2f}"
+
+
+def _label(column):
+    return "Group" if column == "_id" else str(column)
+
+
+def format_small_result(results):
+    """Markdown answer for a single value or a tiny table, or None when the result needs an LLM summary."""
+    df = to_frame(results)
+    if df.empty or len(df) > SMALL_RESULT_ROWS or len(df.columns) > SMALL_RESULT_COLUMNS:
+        return None
+    if any(len(str(v)) > SMALL_RESULT_TEXT_CHARS or isinstance(v, (list, dict)) for v in df.to_numpy().ravel()):
+        return None
+    if df.shape == (1, 1):
+        return f"**{_label(df.columns[0])}**: {_cell(df.iat[0, 0])}"
+    lines = ["| " + " | ".join(_label(c) for c in df.columns) + " |",
+             "|" + " --- |" * len(df.columns)]
+    for row in df.itertuples(index=False):
+        lines.append("| " + " | ".join(_cell(v) for v in row) + " |")
+    return "\n".join(lines)
+
+
+def record_summary(kind):
+    """Count how an answer was produced: "llm", "formatted" (tiny result) or "write_ack" (write confirmation)."""
+    with _summary_lock:
+        _summary_counts[kind] += 1
+
+
+def summary_stats():
+    with _summary_lock:
+        stats = dict(_summary_counts)
+    stats["llm_calls_avoided"] = stats.get("formatted", 0) + stats.get("write_ack", 0)
+    return stats
@@ -0,0 +1,335 @@
+import json
+import re
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+import resources
+import templates
+import compaction
+
+# --- Follow-up refinement over the previous result ---
+# The last read-only query of a session and its (bounded) result set are kept
+# as a QueryState. A follow-up such as "now only the ones in Texas", "sort those
+# by price" or "just the names and phone numbers" is parsed locally into
+# filters / a sort / a limit / a projection over the columns of that result:
+#   local  the previous result was complete, so the refinement is applied to the
+#          kept frame with pandas (no LLM call, no database round trip)
+#   fold   the previous result was capped (SQL_MAX_ROWS / SQL_MAX_BYTES, the
+#          default $limit, or over FOLLOWUP_MAX_ROWS), so the refinement is
+#          wrapped around the previous SQL / appended to the previous pipeline
+#          and run again (no LLM call)
+# Anything the parser cannot fully account for goes through the planner as a
+# new question.
+
+ENABLED = resources.getenv("FOLLOWUPS", "1") == "1"
+MAX_ROWS = int(resources.getenv("FOLLOWUP_MAX_ROWS", "5000"))
+
+# A follow-up has to say so; "restaurants in Texas" on its own is a new question
+_MARKER_RE = re.compile(
+    r"^\s*(now|and|also|then|ok|okay|just|only|sort|order|rank|filter|narrow|keep|limit|of these|of those)\b"
+    r"|\b(those|these|them|the ones|ones|that list|the results?|same)\b")
+
+# Spoken names of result columns, resolved against the columns actually present
+COLUMN_PHRASES = dict(templates.SQL_COLUMNS, **{
+    "price": "price", "prices": "price", "cost": "price", "rent": "price",
+    "bedrooms": "bedrooms", "bedroom": "bedrooms", "beds": "bedrooms", "bed": "bedrooms",
+    "bathrooms": "bathrooms", "bathroom": "bathrooms", "baths": "bathrooms", "bath": "bathrooms",
+    "square feet": "square_feet", "sqft": "square_feet", "size": "square_feet",
+    "rating": "rating", "ratings": "rating", "stars": "rating", "health rating": "health_rating",
+    "reviews": "review_count", "review count": "review_count", "seating": "seating_capacity",
+    "capacity": "seating_capacity", "seating capacity": "seating_capacity",
+    "name": ("restaurant_name", "title", "name"), "names": ("restaurant_name", "title", "name"),
+    "title": "title", "titles": "title", "city": ("city", "cityname"), "cities": ("city", "cityname"),
+    "state": "state", "states": "state", "address": "address", "addresses": "address",
+})
+# "cheapest first" / "best rated" style sorts: phrase -> (column, ascending)
+SORT_SHORTCUTS = {
+    "cheapest": ("price", True), "least expensive": ("price", True), "lowest priced": ("price", True),
+    "most expensive": ("price", False), "priciest": ("price", False), "highest priced": ("price", False),
+    "best rated": ("rating", False), "highest rated": ("rating", False), "top rated": ("rating", False),
+    "worst rated": ("rating", True), "lowest rated": ("rating", True),
+    "biggest": ("square_feet", False), "largest": ("square_feet", False), "smallest": ("square_feet", True),
+}
+_COMPARISONS = {
+    "under": "<", "below": "<", "less than": "<", "cheaper than": "<", "fewer than": "<",
+    "over": ">", "above": ">", "more than": ">", "greater than": ">",
+    "at least": ">=", "at most": "<=", "no more than": "<=",
+}
+_DESCENDING = r"\b(descending|desc|highest first|high to low|largest first|biggest first|most first)\b"
+_ASCENDING = r"\b(ascending|asc|lowest first|low to high|smallest first|least first)\b"
+FILLER = templates.SQL_FILLER | templates.MONGO_FILLER | {
+    "now", "also", "then", "ok", "okay", "just", "only", "those", "these", "them", "ones", "one", "it",
+    "results", "result", "filter", "filtered", "narrow", "down", "keep", "limit", "sort", "sorted",
+    "order", "ordered", "rank", "ranked", "same", "first", "instead", "out", "from", "among",
+}
+
+
+@dataclass
+class QueryState:
+    backend: str                      # "sql" or "mongo"
+    question: str
+    query: object                     # SQL text or the aggregation pipeline (list of stages)
+    frame: pd.DataFrame               # the result; only its columns when over MAX_ROWS
+    complete: bool = True             # False when the rows were capped
+
+
+@dataclass
+class Refinement:
+    filters: list = field(default_factory=list)    # (column, op, value), op in == < <= > >=
+    sort: list = field(default_factory=list)       # (column, ascending)
+    limit: int = None
+    columns: list = field(default_factory=list)    # projection, in the order asked for
+
+    def __bool__(self):
+        return bool(self.filters or self.sort or self.limit or self.columns)
+
+    def referenced(self):
+        return {c for c, _, _ in self.filters} | {c for c, _ in self.sort} | set(self.columns)
+
+    def describe(self):
+        steps = [f"{column} {op} {value!r}" for column, op, value in self.filters]
+        steps += [f"sort by {column} {'ascending' if asc else 'descending'}" for column, asc in self.sort]
+        if self.limit:
+            steps.append(f"first {self.limit}")
+        if self.columns:
+            steps.append("columns " + ", ".join(self.columns))
+        return steps
+
+
+@dataclass
+class FollowUp:
+    kind: str                         # "local" or "fold"
+    backend: str
+    refinement: Refinement
+    query: object                     # the refined SQL text or aggregation pipeline
+    frame: pd.DataFrame = None        # local: the refined rows
+
+    def query_text(self):
+        return self.query if isinstance(self.query, str) else json.dumps(self.query, indent=2)
+
+
+def remember(backend, question, query, results, complete=True):
+    """QueryState for a finished read; the rows are dropped (columns kept) beyond MAX_ROWS."""
+    frame = compaction.to_frame(results).reset_index(drop=True)
+    if len(frame) > MAX_ROWS:
+        frame, complete = frame.iloc[:0], False
+    return QueryState(backend, question, query, frame, complete)
+
+
+# --- Parsing ---
+def _columns(frame):
+    """{phrase: column} for the columns of ``frame``, plus the bare column names."""
+    present = set(frame.columns)
+    phrases = {str(c).lower(): c for c in frame.columns if isinstance(c, str) and c != "_id"}
+    phrases.update({str(c).replace("_", " ").lower(): c for c in phrases.values()})
+    for phrase, candidates in COLUMN_PHRASES.items():
+        for column in candidates if isinstance(candidates, tuple) else (candidates,):
+            if column in present:
+                phrases[phrase] = column
+                break
+    return phrases
+
+
+def _is_text(series):
+    return not pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+def _alternation(phrases):
+    return "|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+
+
+def _number(text):
+    value = float(text.replace(",", ""))
+    return int(value) if value.is_integer() else value
+
+
+def _values(state, column):
+    """{lowercase: canonical} values ``column`` can be filtered on: known values plus those in the result."""
+    frame = state.frame
+    values = {}
+    known = templates.sql_values() if state.backend == "sql" else templates.mongo_values()
+    key = "city" if column in ("city", "cityname") else column
+    values.update(known.get(key, {}))
+    if column in frame.columns and _is_text(frame[column]):
+        for value in frame[column].dropna().unique()[:500]:
+            if isinstance(value, str) and 0 < len(value) <= 40:
+                values.setdefault(value.lower(), value)
+    return values
+
+
+def _take_state(q, state, column):
+    abbr = q.take_state_abbreviation()
+    full = None if abbr else q.take_value({name.lower(): name for name in templates.US_STATES.values()})
+    if not (abbr or full):
+        return None
+    sample = state.frame[column].dropna().astype(str) if column in state.frame.columns else pd.Series([], dtype=str)
+    # Listings store "TX", restaurants store "Texas"
+    uses_abbr = (sample.str.len() == 2).all() if len(sample) else state.backend == "mongo"
+    if uses_abbr:
+        return abbr or templates.STATE_ABBREVIATIONS[full.lower()]
+    return full or templates.US_STATES[abbr]
+
+
+def parse(question, state):
+    """Refinement the follow-up ``question`` asks of ``state``'s result, or None when it is not a pure refinement."""
+    text = question.strip().lower()
+    if not _MARKER_RE.search(text) or re.search(templates._WRITE_VERBS, text):
+        return None
+    q = templates._Question(question)
+    phrases = _columns(state.frame)
+    if not phrases:
+        return None
+    cols = _alternation(phrases)
+    refinement = Refinement()
+
+    m = q.take(r"\b(?:top|first|only|just)\s+" + templates._NUM + r"\b")
+    if m:
+        refinement.limit = templates._to_int(m.group(1))
+
+    # Projection: "just the names and phone numbers"
+    m = q.take(r"\b(?:just|only|show(?:\s+me)?)\s+(?:the\s+|their\s+)?(?:" + cols + r")"
+               r"(?:\s*(?:,|and)\s*(?:the\s+|their\s+)?(?:" + cols + r"))*\b")
+    if m:
+        for phrase in re.findall(r"(?<![a-z])(" + cols + r")(?![a-z])", m.group(0)):
+            if phrases[phrase] not in refinement.columns:
+                refinement.columns.append(phrases[phrase])
+
+    # Sort: "sort those by price", "order them by rating descending", "cheapest first"
+    m = q.take(r"\b(?:sort|sorted|order|ordered|rank|ranked)\s+(?:\w+\s+){0,2}?by\s+(?:the\s+|their\s+)?(" + cols + r")\b")
+    if m:
+        descending = q.take(_DESCENDING)
+        ascending = q.take(_ASCENDING)
+        refinement.sort.append((phrases[m.group(1)], not descending if descending or ascending else True))
+    shortcut = q.take_value({p: p for p in SORT_SHORTCUTS})
+    if shortcut:
+        column, ascending = SORT_SHORTCUTS[shortcut]
+        if column not in state.frame.columns:
+            return None
+        refinement.sort.append((column, ascending))
+
+    # Comparisons: "under $2000", "rating above 4", "at least 2 bedrooms"
+    comparisons = _alternation(_COMPARISONS)
+    while True:
+        m = q.take(r"(?:\b(" + cols + r")\s+)?(?:of\s+|is\s+)?\b(" + comparisons + r")\s+(\$)?(\d[\d,]*(?:\.\d+)?)"
+                   r"(?:\s*(?:dollars|usd))?(?:\s+(" + cols + r")\b)?")
+        if not m:
+            break
+        named = m.group(1) or m.group(5)
+        column = phrases[named] if named else "price" if m.group(3) or "cheaper" in m.group(2) else None
+        if column is None or column not in state.frame.columns:
+            return None
+        refinement.filters.append((column, _COMPARISONS[m.group(2)], _number(m.group(4))))
+    # Exact counts: "with 2 bedrooms"
+    while True:
+        m = q.take(r"\b(\d+)[- ]?(" + cols + r")\b")
+        if not m:
+            break
+        refinement.filters.append((phrases[m.group(2)], "==", int(m.group(1))))
+
+    # Values: states, Yes/No features, then any short text value of the result's columns
+    if "state" in state.frame.columns:
+        value = _take_state(q, state, "state")
+        if value:
+            refinement.filters.append(("state", "==", value))
+    while True:
+        feature = q.take_value({p: c for p, c in templates.SQL_FEATURES.items() if c in state.frame.columns})
+        if not feature:
+            break
+        refinement.filters.append((feature, "==", "yes"))
+    for column in state.frame.columns:
+        if not isinstance(column, str) or column in ("state", "_id") or not _is_text(state.frame[column]):
+            continue
+        value = q.take_value(_values(state, column))
+        if value:
+            refinement.filters.append((column, "==", value))
+
+    if q.leftover(FILLER) or not refinement:
+        return None
+    if not refinement.referenced() <= set(state.frame.columns):
+        return None
+    return refinement
+
+
+# --- Applying ---
+def apply_local(frame, refinement):
+    """Refined copy of ``frame``; text matches ignore case like MySQL's default collation."""
+    for column, op, value in refinement.filters:
+        series = frame[column]
+        if isinstance(value, str):
+            mask = series.astype(str).str.lower() == value.lower()
+        else:
+            numeric = pd.to_numeric(series, errors="coerce")
+            mask = {"==": numeric == value, "<": numeric < value, "<=": numeric <= value,
+                    ">": numeric > value, ">=": numeric >= value}[op]
+        frame = frame[mask]
+    if refinement.sort:
+        frame = frame.sort_values([c for c, _ in refinement.sort], ascending=[a for _, a in refinement.sort],
+                                  kind="stable", na_position="last")
+    if refinement.limit:
+        frame = frame.head(refinement.limit)
+    if refinement.columns:
+        frame = frame[refinement.columns]
+    return frame.reset_index(drop=True)
+
+
+def _sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+    return str(value)
+
+
+def fold_sql(sql, refinement):
+    """Wrap the previous SELECT as a derived table and refine it on the server."""
+    select = ", ".join(f"`{c}`" for c in refinement.columns) or "*"
+    folded = f"SELECT {select} FROM ({sql.strip().rstrip(';')}) AS previous"
+    if refinement.filters:
+        folded += " WHERE " + " AND ".join(f"`{c}` {'=' if op == '==' else op} {_sql_literal(v)}"
+                                           for c, op, v in refinement.filters)
+    if refinement.sort:
+        folded += " ORDER BY " + ", ".join(f"`{c}` {'ASC' if asc else 'DESC'}" for c, asc in refinement.sort)
+    if refinement.limit:
+        folded += f" LIMIT {int(refinement.limit)}"
+    return folded + ";"
+
+
+_MODE_BACKENDS = {"Restaurant": "sql", "Housing": "mongo"}
+_MONGO_OPS = {"<": "$lt", "<=": "$lte", ">": "$gt", ">=": "$gte"}
+
+
+def fold_pipeline(pipeline, refinement):
+    """The previous pipeline with the refinement appended as $match / $sort / $limit / $project stages."""
+    stages = list(pipeline)
+    match = {}
+    for column, op, value in refinement.filters:
+        match.setdefault(column, {}).update({"$eq": value} if op == "==" else {_MONGO_OPS[op]: value})
+    if match:
+        stages.append({"$match": match})
+    if refinement.sort:
+        stages.append({"$sort": {c: 1 if asc else -1 for c, asc in refinement.sort}})
+    if refinement.limit:
+        stages.append({"$limit": int(refinement.limit)})
+    if refinement.columns:
+        stages.append({"$project": dict({c: 1 for c in refinement.columns}, _id=0)})
+    return stages
+
+
+def refine(question, state, mode="Auto Detect"):
+    """FollowUp answering ``question`` from ``state`` without query generation, or None."""
+    if not ENABLED or state is None or _MODE_BACKENDS.get(mode) not in (None, state.backend):
+        return None
+    refinement = parse(question, state)
+    if refinement is None:
+        return None
+    if state.backend == "sql":
+        # A derived table can't repeat a column name
+        if not state.complete and state.frame.columns.duplicated().any():
+            return None
+        query = fold_sql(state.query, refinement)
+    elif isinstance(state.query, list):
+        query = fold_pipeline(state.query, refinement)
+    else:
+        return None
+    if state.complete:
+        return FollowUp("local", state.backend, refinement, query, apply_local(state.frame, refinement))
+    return FollowUp("fold", state.backend, refinement, query)
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+import resources
+
+# --- Geospatial support for listings ---
+# Listings get a GeoJSON `location` point (built server-side from latitude /
+# longitude) with a 2dsphere index so generated pipelines can use $geoNear and
+# $geoWithin. Map points are extracted column-wise, and large result sets are
+# binned into a grid before they are handed to pydeck, so the browser draws at
+# most a few thousand cells no matter how many listings matched.
+#
+#   python geo.py      # add `location` to listings that lack it and build the index
+
+LOCATION_FIELD = "location"
+MAP_MAX_POINTS = int(resources.getenv("MAP_MAX_POINTS", "3000"))
+MAP_GRID_CELLS = int(resources.getenv("MAP_GRID_CELLS", "150"))  # grid cells along the longer side when binning
+MAP_LAYER = resources.getenv("MAP_LAYER", "hexagon")  # "hexagon" or "heatmap" for binned maps
+
+
+def _as_double(field):
+    return {"$convert": {"input": f"${field}", "to": "double", "onError": None, "onNull": None}}
+
+
+def ensure_location_field(collection):
+    """Add a GeoJSON point to every document with usable coordinates, then build the 2dsphere index."""
+    lon, lat = _as_double("longitude"), _as_double("latitude")
+    valid = {"$and": [
+        {"$ne": [lon, None]}, {"$ne": [lat, None]},
+        {"$lte": [{"$abs": lon}, 180]}, {"$lte": [{"$abs": lat}, 90]},
+    ]}
+    # One server-side pipeline update instead of reading and rewriting every document
+    result = collection.update_many(
+        {LOCATION_FIELD: {"$exists": False}, "latitude": {"$exists": True}, "longitude": {"$exists": True}},
+        [{"$set": {LOCATION_FIELD: {"$cond": [valid, {"type": "Point", "coordinates": [lon, lat]}, "$$REMOVE"]}}}])
+    index_name = collection.create_index([(LOCATION_FIELD, "2dsphere")], name=f"ix_{collection.name}_{LOCATION_FIELD}")
+    return result.modified_count, index_name
+
+
+def coordinates_pipeline(pipeline, limit):
+    """``pipeline`` narrowed to the coordinate fields, to map every result while the documents are shown a page at a time."""
+    return pipeline + [{"$project": {"_id": 0, "latitude": 1, "longitude": 1, LOCATION_FIELD: 1}}, {"$limit": limit}]
+
+
+def coordinates(results):
+    """``lat`` / ``lon`` DataFrame of the valid coordinates in a result set, extracted column-wise."""
+    df = results if isinstance(results, pd.DataFrame) else pd.DataFrame(
+        [doc for doc in results or [] if isinstance(doc, dict)])
+    if {"latitude", "longitude"} <= set(df.columns):
+        lat = pd.to_numeric(df["latitude"], errors="coerce")
+        lon = pd.to_numeric(df["longitude"], errors="coerce")
+    elif LOCATION_FIELD in df.columns:
+        coords = df[LOCATION_FIELD].map(
+            lambda loc: loc.get("coordinates") if isinstance(loc, dict) else None).dropna()
+        coords = coords[coords.map(len) == 2]
+        lon = pd.to_numeric(coords.str[0], errors="coerce")
+        lat = pd.to_numeric(coords.str[1], errors="coerce")
+    else:
+        return pd.DataFrame(columns=["lat", "lon"])
+    points = pd.DataFrame({"lat": lat, "lon": lon}).dropna()
+    return points[points["lat"].between(-90, 90) & points["lon"].between(-180, 180)].reset_index(drop=True)
+
+
+def bin_points(points, cells=MAP_GRID_CELLS):
+    """Aggregate points into a regular grid: one row per non-empty cell with its centre and point count."""
+    lat, lon = points["lat"].to_numpy(), points["lon"].to_numpy()
+    span = max(lat.max() - lat.min(), lon.max() - lon.min(), 1e-6)
+    size = span / cells
+    rows = np.floor((lat - lat.min()) / size).astype(np.int64)
+    cols = np.floor((lon - lon.min()) / size).astype(np.int64)
+    keys, counts = np.unique(rows * (cells + 1) + cols, return_counts=True)
+    return pd.DataFrame({
+        "lat": lat.min() + (keys // (cells + 1) + 0.5) * size,
+        "lon": lon.min() + (keys % (cells + 1) + 0.5) * size,
+        "count": counts,
+    })
+
+
+def map_deck(points, pdk):
+    """pydeck Deck for the points: a scatter layer when few, a binned hexagon / heatmap layer when many."""
+    view = pdk.ViewState(latitude=float(points["lat"].mean()), longitude=float(points["lon"].mean()), zoom=3.5)
+    if len(points) <= MAP_MAX_POINTS:
+        layer = pdk.Layer("ScatterplotLayer", data=points, get_position=["lon", "lat"],
+                          get_radius=800, radius_min_pixels=3, get_fill_color=[255, 99, 71, 180], pickable=True)
+        return pdk.Deck(layers=[layer], initial_view_state=view, tooltip={"text": "{lat}, {lon}"})
+    bins = bin_points(points)
+    if MAP_LAYER == "heatmap":
+        layer = pdk.Layer("HeatmapLayer", data=bins, get_position=["lon", "lat"], get_weight="count")
+        return pdk.Deck(layers=[layer], initial_view_state=view)
+    layer = pdk.Layer("HexagonLayer", data=bins, get_position=["lon", "lat"], get_elevation_weight="count",
+                      get_color_weight="count", elevation_aggregation="SUM", color_aggregation="SUM",
+                      radius=20000, elevation_scale=50, extruded=True, pickable=True)
+    view.pitch = 40
+    return pdk.Deck(layers=[layer], initial_view_state=view, tooltip={"text": "{elevationValue} listings"})
+
+
+def downsample(points, limit=MAP_MAX_POINTS):
+    """Evenly spaced subset, for plain st.map when pydeck isn't installed."""
+    if len(points) <= limit:
+        return points
+    return points.iloc[np.linspace(0, len(points) - 1, limit).astype(np.int64)]
+
+
+if __name__ == "__main__":
+    modified, index_name = ensure_location_field(resources.get_collection("listing"))
+    print(f"Added `{LOCATION_FIELD}` to {modified} listings; index {index_name} is ready")
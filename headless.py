@@ -0,0 +1,355 @@
+import argparse
+import concurrent.futures as cf
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import resources
+import pipeline
+import planner
+import compaction
+import tracing
+import mongo_optimizer
+import maincpy_cleaned
+import sqlrest_cleaned
+
+# --- Headless batch / HTTP entry point ---
+# Answers questions without Streamlit, through the same stages as a chat turn
+# (planner routing + generation, capped execution, small-result formatting or
+# the summary LLM call). One process shares the LLM handles, the MySQL pool and
+# the MongoDB client across a bounded worker pool:
+#   * at most HEADLESS_WORKERS questions run at once and HEADLESS_QUEUE more may
+#     wait; the CLI then stops reading input, the HTTP API answers 503 + Retry-After
+#   * an LLM rate-limit error pauses every worker (exponential backoff with
+#     jitter) and the question is retried up to HEADLESS_RETRIES times
+#   * only reads are run: generated writes are returned, not executed
+# Each question is traced like a chat turn (tracing.py), and the runner reports
+# sustained questions per second.
+#
+#   python headless.py batch questions.txt -o answers.jsonl
+#   python headless.py serve --port 8080     # POST /ask {"question": "..."}, GET /stats, GET /metrics
+
+# Each question can hold up to three pipeline workers (speculative routing), so
+# the default leaves the shared pool room for all of them
+WORKERS = int(resources.getenv("HEADLESS_WORKERS", str(max(1, pipeline.WORKERS // 3))))
+QUEUE = int(resources.getenv("HEADLESS_QUEUE", "32"))
+RETRIES = int(resources.getenv("HEADLESS_RETRIES", "4"))
+BACKOFF_S = float(resources.getenv("HEADLESS_BACKOFF_S", "2"))
+BACKOFF_MAX_S = float(resources.getenv("HEADLESS_BACKOFF_MAX_S", "60"))
+RETURN_ROWS = int(resources.getenv("HEADLESS_RETURN_ROWS", "50"))
+MAX_BODY_BYTES = 64 * 1024
+
+_RATE_LIMIT_RE = re.compile(r"rate.?limit|\b429\b|quota|resource.?exhausted|too many requests", re.IGNORECASE)
+
+
+class Busy(Exception):
+    pass
+
+
+class WriteRefused(Exception):
+    pass
+
+
+def is_rate_limited(error):
+    return _RATE_LIMIT_RE.search(f"{type(error).__name__} {error}") is not None
+
+
+# --- One question ---
+def run_question(question, mode="Auto Detect", deadline=None, check_plan=True):
+    """Route, generate, execute and answer one question; returns the answer record with per-stage seconds.
+
+    ``check_plan`` explains uncached MongoDB pipelines first (see mongo_optimizer.check_plan).
+    """
+    deadline = deadline or pipeline.Deadline()
+    started = time.perf_counter()
+    plan = planner.plan(question, mode, deadline)
+    timings = {"route": plan.timings.get("route", 0.0),
+               "generate": plan.timings.get("generate", plan.timings.get("generate_after_route", 0.0))}
+    record = {"question": question, "backend": plan.backend, "path": plan.path, "query": plan.query,
+              "speculative": plan.speculative}
+    query = plan.query or ""
+
+    stage_start = time.perf_counter()
+    if plan.backend == "sql":
+        if not query.lower().strip().startswith("select"):
+            raise WriteRefused("Generated SQL is a write; headless mode only runs reads")
+        results = pipeline.run_stage(deadline, "execute", sqlrest_cleaned.read_sql_query, query,
+                                     sqlrest_cleaned.db_config, timeout_ms=deadline.ms("execute"))
+        if isinstance(results, tuple):
+            raise RuntimeError(results[1])
+        record["more_available"] = bool(results.attrs.get("more_available"))
+        summary_prompt = lambda: sqlrest_cleaned.sql_summary_prompt(question, results)
+    elif plan.backend == "mongo":
+        stages = json.loads(query)
+        if not isinstance(stages, list):
+            raise WriteRefused("Generated MongoDB operation is a write; headless mode only runs reads")
+        optimized = mongo_optimizer.optimize(stages, max_time_ms=deadline.ms("execute"))
+        results = pipeline.run_stage(deadline, "execute", maincpy_cleaned.run_mongo_pipeline, optimized.pipeline,
+                                     max_time_ms=optimized.options["maxTimeMS"],
+                                     batch_size=optimized.options["batchSize"], check_plan=check_plan)
+        summary_prompt = lambda: maincpy_cleaned.mongo_summary_prompt(
+            question, results, any("$lookup" in stage for stage in optimized.pipeline if isinstance(stage, dict)))
+    else:
+        raise RuntimeError("Could not route the question to a backend")
+    timings["execute"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    answer = compaction.format_small_result(results) if len(results) else None
+    if answer is None and len(results):
+        prompt, _ = summary_prompt()
+        with tracing.span("summarize"):
+            answer = "".join(pipeline.start_summary(prompt).chunks(deadline))
+    timings["summarize"] = time.perf_counter() - stage_start
+    timings["total"] = time.perf_counter() - started
+
+    frame = compaction.to_frame(results)
+    record.update(answer=answer or "No results.", rows=len(frame),
+                  data=json.loads(frame.head(RETURN_ROWS).to_json(orient="records", default_handler=str)),
+                  timings={stage: round(seconds, 4) for stage, seconds in timings.items()})
+    return record
+
+
+# --- Rate-limit backoff shared by every worker ---
+class Backoff:
+    """After a rate-limit error nobody calls the LLMs again until the pause is over."""
+
+    def __init__(self, base=BACKOFF_S, cap=BACKOFF_MAX_S):
+        self.base = base
+        self.cap = cap
+        self.resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def penalize(self, attempt):
+        delay = min(self.cap, self.base * 2 ** attempt) * random.uniform(0.5, 1.0)
+        with self._lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+        return delay
+
+
+# --- Throughput stats ---
+class Stats:
+    WINDOW_S = 60
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counts = Counter()
+        self.latencies = deque(maxlen=10000)
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def record(self, outcome, seconds=None):
+        now = time.monotonic()
+        with self._lock:
+            self.counts[outcome] += 1
+            if seconds is not None:
+                self.latencies.append(seconds)
+                self._recent.append(now)
+            while self._recent and self._recent[0] < now - self.WINDOW_S:
+                self._recent.popleft()
+
+    def report(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            latencies = sorted(self.latencies)
+            recent = len(self._recent)
+            counts = dict(self.counts)
+        answered = counts.get("ok", 0) + counts.get("error", 0)
+
+        def pct(q):
+            return round(latencies[min(len(latencies) - 1, round(q * (len(latencies) - 1)))] * 1000, 1) if latencies else 0.0
+
+        return dict(counts, answered=answered, elapsed_s=round(elapsed, 2),
+                    qps=round(answered / elapsed, 3) if elapsed else 0.0,
+                    qps_last_minute=round(recent / min(elapsed, self.WINDOW_S), 3) if elapsed else 0.0,
+                    p50_ms=pct(0.5), p95_ms=pct(0.95))
+
+
+# --- Bounded worker pool ---
+class Runner:
+    def __init__(self, workers=WORKERS, queue_size=QUEUE, retries=RETRIES):
+        self.workers = workers
+        self.retries = retries
+        self.executor = pipeline.ContextExecutor(max_workers=workers, thread_name_prefix="chatbot-headless")
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.backoff = Backoff()
+        self.stats = Stats()
+
+    def answer(self, question, mode="Auto Detect"):
+        """Answer one question (retrying rate-limited attempts); errors are returned in the record."""
+        started = time.perf_counter()
+        record = {"question": question}
+        for attempt in range(self.retries + 1):
+            self.backoff.wait()
+            trace = tracing.start_trace(question, mode=mode, source="headless")
+            try:
+                record = run_question(question, mode)
+                record["attempts"] = attempt + 1
+                trace.set(backend=record["backend"], path=record["path"], speculative=record["speculative"])
+                break
+            except Exception as e:
+                trace.fail(e)
+                record = {"question": question, "error": f"{type(e).__name__}: {e}"}
+                if not is_rate_limited(e) or attempt == self.retries:
+                    break
+                self.stats.record("rate_limited")
+                record["retried_after_s"] = round(self.backoff.penalize(attempt), 2)
+            finally:
+                record["trace_id"] = tracing.finish_trace(trace)["trace_id"]
+        self.stats.record("error" if "error" in record else "ok", time.perf_counter() - started)
+        return record
+
+    def submit(self, question, mode="Auto Detect", block=True):
+        """Queue a question; raises Busy when ``block`` is False and the pool and its queue are full."""
+        if not self.slots.acquire(blocking=block):
+            self.stats.record("rejected")
+            raise Busy(f"{self.workers} workers busy and the queue is full")
+        try:
+            future = self.executor.submit(self.answer, question, mode)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+# --- CLI batch ---
+def read_questions(path):
+    """Questions from a text file (one per line, # comments) or a JSONL file of {"question": ..., "mode": ...}."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                yield entry["question"], entry.get("mode", "Auto Detect")
+            else:
+                yield line, "Auto Detect"
+
+
+def run_batch(path, output, runner):
+    """Answer every question in ``path``, appending JSONL records to ``output`` as they finish."""
+    write_lock = threading.Lock()
+
+    def write(index, future):
+        record = dict(future.result(), id=index)
+        with write_lock:
+            output.write(json.dumps(record, default=str) + "\n")
+            output.flush()
+
+    futures = []
+    for index, (question, mode) in enumerate(read_questions(path)):
+        # Blocks while the pool and its queue are full, so the file is read as it is answered
+        future = runner.submit(question, mode)
+        future.add_done_callback(lambda f, i=index: write(i, f))
+        futures.append(future)
+    cf.wait(futures)
+    return runner.stats.report()
+
+
+# --- HTTP API ---
+class Handler(BaseHTTPRequestHandler):
+    runner = None
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self._send(200, self.runner.stats.report())
+        elif self.path == "/metrics":
+            self._send(200, tracing.get_metrics().render(), "text/plain; version=0.0.4")
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/ask":
+            self._send(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self._send(413, {"error": "request body too large"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            question = str(body["question"]).strip()
+        except (ValueError, KeyError, TypeError):
+            self._send(400, {"error": 'expected a JSON body like {"question": "..."}'})
+            return
+        try:
+            future = self.runner.submit(question, body.get("mode", "Auto Detect"), block=False)
+        except Busy as e:
+            self._send(503, {"error": str(e)}, headers={"Retry-After": str(max(1, round(BACKOFF_S)))})
+            return
+        record = future.result()
+        self._send(500 if "error" in record else 200, record)
+
+    def log_message(self, format, *args):
+        pass  # every request is already traced
+
+
+def serve(host, port, runner):
+    Handler.runner = runner
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving on http://{host}:{port} with {runner.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        runner.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer questions without the Streamlit UI")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="questions answered at the same time")
+    parser.add_argument("--queue", type=int, default=QUEUE, help="questions allowed to wait for a worker")
+    commands = parser.add_subparsers(dest="command", required=True)
+    batch = commands.add_parser("batch", help="answer a file of questions into JSONL")
+    batch.add_argument("questions", help="text file (one question per line) or JSONL with a question field")
+    batch.add_argument("-o", "--output", help="JSONL output file (default: stdout)")
+    http = commands.add_parser("serve", help="serve POST /ask over HTTP")
+    http.add_argument("--host", default=resources.getenv("HEADLESS_HOST", "127.0.0.1"))
+    http.add_argument("--port", type=int, default=int(resources.getenv("HEADLESS_PORT", "8080")))
+    args = parser.parse_args(argv)
+
+    runner = Runner(args.workers, args.queue)
+    if args.command == "serve":
+        serve(args.host, args.port, runner)
+        return 0
+    output = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    try:
+        report = run_batch(args.questions, output, runner)
+    finally:
+        runner.shutdown()
+        if args.output:
+            output.close()
+    print(json.dumps(report), file=sys.stderr)
+    return 1 if report.get("error") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import concurrent.futures as cf
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+import resources
+
+# --- Image prefetch + on-disk thumbnail cache ---
+# Listing pictures (picture_url) and menu photos (menu.image_url) are fetched
+# concurrently on a small dedicated pool with a per-request timeout, downscaled
+# to IMAGE_THUMBNAIL_PX thumbnails (when Pillow is installed; the original bytes
+# are kept otherwise) and stored under .cache/images as sha256(url) files. The
+# directory is an LRU bounded by IMAGE_CACHE_MAX_BYTES (file mtimes are the
+# recency). Cached thumbnails render straight away; misses render a placeholder
+# that is filled in as its fetch completes, and anything still in flight after
+# IMAGE_RENDER_WAIT_S keeps downloading for the next rerun.
+#
+#   python image_cache.py URL [URL ...]     # fetch cold, then warm, and time both
+
+CACHE_DIR = resources.getenv("IMAGE_CACHE_DIR", resources.cache_path("images"))
+MAX_BYTES = int(resources.getenv("IMAGE_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+THUMBNAIL_PX = int(resources.getenv("IMAGE_THUMBNAIL_PX", "320"))
+FETCH_TIMEOUT_S = float(resources.getenv("IMAGE_FETCH_TIMEOUT_S", "5"))
+FETCH_WORKERS = int(resources.getenv("IMAGE_FETCH_WORKERS", "8"))
+RENDER_WAIT_S = float(resources.getenv("IMAGE_RENDER_WAIT_S", "3"))
+MAX_DOWNLOAD_BYTES = int(resources.getenv("IMAGE_MAX_DOWNLOAD_BYTES", str(10 * 1024 * 1024)))
+FAILURE_TTL_S = 300  # a failed URL isn't retried for this long
+
+
+def cache_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def thumbnail(data, size=THUMBNAIL_PX):
+    """JPEG thumbnail of ``data`` no larger than ``size`` px, or the bytes unchanged without Pillow."""
+    try:
+        image_module = resources.optional_module("PIL.Image")
+    except ImportError:
+        return data
+    with image_module.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((size, size))
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=80, optimize=True)
+    return out.getvalue()
+
+
+def download(url, timeout=FETCH_TIMEOUT_S, max_bytes=MAX_DOWNLOAD_BYTES):
+    if not url.lower().startswith(("http://", "https://")):
+        raise ValueError(f"Not an http(s) URL: {url}")
+    request = urllib.request.Request(url, headers={"User-Agent": "smart-data-chatbot/1.0"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        data = response.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"Image larger than {max_bytes} bytes: {url}")
+    return data
+
+
+class ImageCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES, workers=FETCH_WORKERS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.executor = cf.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chatbot-images")
+        self.stats = {"hits": 0, "misses": 0, "fetched": 0, "failures": 0, "evictions": 0}
+        self._inflight = {}      # url -> Future
+        self._failed = {}        # url -> retry-after (monotonic)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def path(self, url):
+        return os.path.join(self.directory, cache_key(url))
+
+    def cached(self, url):
+        """Path of the cached thumbnail (marked recently used), or None."""
+        path = self.path(url)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return path
+
+    def _store(self, url, data):
+        path = self.path(url)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        try:
+            previous = os.path.getsize(path)
+        except OSError:
+            previous = 0
+        os.replace(tmp, path)
+        with self._lock:
+            self._size += len(data) - previous
+            over = self._size > self.max_bytes
+        if over:
+            self._evict()
+        return path
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        with self._lock:
+            self._size = sum(size for _, size, _ in entries)
+            # Trim to 90% so a full cache doesn't evict on every store
+            while entries and self._size > self.max_bytes * 0.9:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._size -= size
+                self.stats["evictions"] += 1
+
+    def _fetch(self, url):
+        try:
+            path = self._store(url, thumbnail(download(url)))
+            with self._lock:
+                self.stats["fetched"] += 1
+            return path
+        except Exception:
+            with self._lock:
+                self.stats["failures"] += 1
+                self._failed[url] = time.monotonic() + FAILURE_TTL_S
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+
+    def fetch(self, url):
+        """Future for the thumbnail path (None on failure); concurrent requests for one URL share a download."""
+        with self._lock:
+            if url in self._inflight:
+                return self._inflight[url]
+            if self._failed.get(url, 0) > time.monotonic():
+                future = cf.Future()
+                future.set_result(None)
+                return future
+            future = self._inflight[url] = self.executor.submit(self._fetch, url)
+        return future
+
+    def fetch_each(self, urls, timeout=RENDER_WAIT_S):
+        """Yield ``(url, path or None)`` for every URL as its fetch completes; unfinished ones after ``timeout`` yield None."""
+        futures = {}
+        for url in dict.fromkeys(urls):
+            futures.setdefault(self.fetch(url), []).append(url)
+        try:
+            for future in cf.as_completed(futures, timeout=timeout):
+                for url in futures.pop(future):
+                    yield url, future.result()
+        except cf.TimeoutError:
+            pass  # still downloading; cached for the next rerun
+        for pending in futures.values():
+            for url in pending:
+                yield url, None
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, bytes=self._size, max_bytes=self.max_bytes, in_flight=len(self._inflight))
+
+
+@resources.resource
+def get_image_cache():
+    return ImageCache()
+
+
+def main(urls):
+    cache = ImageCache()
+    for attempt in ("cold", "warm"):
+        started = time.perf_counter()
+        missing = [url for url in urls if cache.cached(url) is None]
+        results = dict(cache.fetch_each(missing, timeout=FETCH_TIMEOUT_S * 2))
+        failed = [url for url, path in results.items() if path is None]
+        print(f"{attempt}: {len(urls) - len(missing)} cached, {len(missing) - len(failed)} fetched, "
+              f"{len(failed)} failed in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(cache.metrics())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python image_cache.py URL [URL ...]")
+    main(sys.argv[1:])
@@ -0,0 +1,493 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+import resources
+from result_cache import canonical_sql
+
+# --- Workload-driven index advisor (MySQL tables + MongoDB collections) ---
+# Every statement and pipeline the app sends to a database is appended to a
+# workload log (.cache/workload.jsonl). The log is turned into a profile of
+# equality / sort / range predicates and join keys per table, from which
+# compound indexes are recommended in equality -> sort -> range order.
+#
+#   python index_advisor.py            # profile, recommendations, current explain costs
+#   python index_advisor.py --apply    # also create missing indexes, report before/after costs
+
+WORKLOAD_PATH = resources.getenv("INDEX_WORKLOAD_PATH", resources.cache_path("workload.jsonl"))
+RECORDING = resources.getenv("INDEX_WORKLOAD_RECORDING", "1") == "1"
+WORKLOAD_MAX_BYTES = int(resources.getenv("INDEX_WORKLOAD_MAX_BYTES", str(16 * 1024 * 1024)))
+MAX_INDEX_COLUMNS = 4
+TEXT_PREFIX_LENGTH = int(resources.getenv("INDEX_TEXT_PREFIX_LENGTH", "32"))
+
+# Column types from the README's CREATE TABLE statements; TEXT columns need a prefix length in MySQL indexes
+SQL_COLUMNS = {
+    "restaurant": {
+        "restaurant_id": "bigint", "restaurant_name": "text", "cuisine": "text", "city": "text", "state": "text",
+        "address": "text", "latitude": "float", "longitude": "float", "phone_number": "text", "email": "text",
+        "delivery_available": "text", "seating_capacity": "int", "opening_hours": "text", "has_wifi": "text",
+        "has_outdoor_seating": "text", "payment_methods": "text", "parking_available": "text",
+        "alcohol_served": "text", "reservation_required": "text", "music_type": "text", "health_rating": "int",
+        "has_kids_menu": "text",
+    },
+    "menu": {"restaurant_id": "bigint", "item_name": "text", "price_usd": "float", "is_vegetarian": "text",
+             "image_url": "text"},
+    "reviews": {"restaurant_id": "bigint", "rating": "float", "review_count": "int", "sample_review": "text",
+                "tags": "text"},
+}
+SQL_PRIMARY_KEYS = {"restaurant": ["restaurant_id"]}
+
+# Join keys the app relies on even before any workload has been recorded
+KNOWN_JOIN_KEYS = [
+    ("mongo", "host", "host_id"),       # listing.host_id -> host.host_id
+    ("mongo", "review", "id"),          # listing.id -> review.id
+    ("mongo", "listing", "host_id"),
+    ("sql", "menu", "restaurant_id"),
+    ("sql", "reviews", "restaurant_id"),
+]
+
+
+# --- Recording ---
+_write_lock = threading.Lock()
+
+
+def _append(entry):
+    if not RECORDING:
+        return
+    try:
+        with _write_lock:
+            os.makedirs(os.path.dirname(WORKLOAD_PATH), exist_ok=True)
+            if os.path.exists(WORKLOAD_PATH) and os.path.getsize(WORKLOAD_PATH) > WORKLOAD_MAX_BYTES:
+                os.replace(WORKLOAD_PATH, WORKLOAD_PATH + ".1")
+            with open(WORKLOAD_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+    except OSError:
+        pass  # recording must never break a query
+
+
+def record_sql(sql):
+    _append({"ts": time.time(), "backend": "sql", "sql": canonical_sql(sql)})
+
+
+def record_mongo(collection, pipeline=None, query_filter=None):
+    """Record an aggregation ``pipeline`` or the ``filter`` of a find / update / delete on ``collection``."""
+    entry = {"ts": time.time(), "backend": "mongo", "collection": collection}
+    if pipeline is not None:
+        entry["pipeline"] = pipeline
+    else:
+        entry["filter"] = query_filter or {}
+    _append(entry)
+
+
+def load_workload(path=WORKLOAD_PATH):
+    entries = []
+    for name in (path + ".1", path):
+        if not os.path.exists(name):
+            continue
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    return entries
+
+
+# --- Predicate extraction ---
+@dataclass
+class QueryShape:
+    backend: str
+    table: str
+    equality: tuple = ()
+    sort: tuple = ()        # ((field, direction), ...)
+    range: tuple = ()
+
+
+_SQL_KEYWORDS = {
+    "on", "where", "join", "left", "right", "inner", "outer", "cross", "group", "order", "limit", "using",
+    "having", "natural", "straight_join", "union", "and", "or", "not", "as", "set", "values",
+}
+_TABLE_RE = re.compile(r"\b(?:from|join|update|into)\s+`?(\w+)`?(?:\s+(?:as\s+)?`?(\w+)`?)?", re.IGNORECASE)
+_FROM_LIST_RE = re.compile(r"\bfrom\s+(.*?)(?=\bwhere\b|\bjoin\b|\bleft\b|\bright\b|\binner\b|\bgroup\s+by\b|"
+                           r"\border\s+by\b|\blimit\b|$)", re.IGNORECASE | re.DOTALL)
+_CLAUSE_END = r"(?=\bgroup\s+by\b|\border\s+by\b|\blimit\b|\bhaving\b|\bunion\b|$)"
+_WHERE_RE = re.compile(r"\bwhere\b(.*?)" + _CLAUSE_END, re.IGNORECASE | re.DOTALL)
+_ON_RE = re.compile(r"\bon\b(.*?)(?=\bjoin\b|\bleft\b|\bright\b|\binner\b|\bwhere\b|\bgroup\s+by\b|\border\s+by\b|\blimit\b|$)",
+                    re.IGNORECASE | re.DOTALL)
+_COLUMN = r"(?<![\w.(`'])((?:\w+\.)?\w+)"
+_COMPARE_RE = re.compile(_COLUMN + r"\s*(<=|>=|<>|!=|=|<|>)\s*((?:\w+\.)?\w+|\?|-?\d[\d.]*)", re.IGNORECASE)
+_IN_RE = re.compile(r"(\bnot\s+)?" + _COLUMN + r"\s+in\s*\(", re.IGNORECASE)
+_BETWEEN_RE = re.compile(_COLUMN + r"\s+between\b", re.IGNORECASE)
+_LIKE_RE = re.compile(_COLUMN + r"\s+like\s+'([^']*)'", re.IGNORECASE)
+_ORDER_RE = re.compile(r"\border\s+by\b(.*?)(?=\blimit\b|$)", re.IGNORECASE | re.DOTALL)
+_GROUP_RE = re.compile(r"\bgroup\s+by\b(.*?)(?=\bhaving\b|\border\s+by\b|\blimit\b|$)", re.IGNORECASE | re.DOTALL)
+_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+
+
+def _sql_aliases(sql):
+    aliases = {}
+    # "FROM a x, b y" joins list their extra tables after commas
+    listed = [item.split() for clause in _FROM_LIST_RE.findall(sql) for item in clause.split(",")[1:]]
+    extra = [(parts[0].strip("`"), parts[-1].strip("`") if len(parts) > 1 else "") for parts in listed if parts]
+    for table, alias in _TABLE_RE.findall(sql) + extra:
+        table = table.lower()
+        if table not in SQL_COLUMNS:
+            continue
+        aliases[table] = table
+        if alias and alias.lower() not in _SQL_KEYWORDS:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+def _resolve(column, aliases):
+    """``(table, column)`` for a possibly qualified column, or None when unknown / ambiguous."""
+    column = column.lower()
+    if "." in column:
+        alias, name = column.split(".", 1)
+        table = aliases.get(alias)
+        return (table, name) if table and name in SQL_COLUMNS[table] else None
+    owners = {t for t in aliases.values() if column in SQL_COLUMNS[t]}
+    return (owners.pop(), column) if len(owners) == 1 else None
+
+
+def sql_shapes(sql):
+    """Query shapes (one per table) and join keys ``[(table, column)]`` of a SQL statement."""
+    aliases = _sql_aliases(sql)
+    if not aliases:
+        return [], []
+    predicates = defaultdict(lambda: {"equality": [], "sort": [], "range": []})
+    joins = []
+
+    for condition in _ON_RE.findall(sql):
+        for left, op, right in _COMPARE_RE.findall(condition):
+            a, b = _resolve(left, aliases), _resolve(right, aliases)
+            if op == "=" and a and b:
+                joins += [a, b]
+
+    for where in _WHERE_RE.findall(sql):
+        for column, pattern in _LIKE_RE.findall(where):
+            resolved = _resolve(column, aliases)
+            if resolved and pattern and not pattern.startswith("%"):
+                predicates[resolved[0]]["range"].append(resolved[1])
+        bare = _LITERAL_RE.sub("?", where)
+        for left, op, right in _COMPARE_RE.findall(bare):
+            a = _resolve(left, aliases)
+            if not a:
+                continue
+            b = _resolve(right, aliases) if not right[0].isdigit() and right not in ("?", "-") else None
+            if b:
+                if op == "=":
+                    joins += [a, b]
+            elif op == "=":
+                predicates[a[0]]["equality"].append(a[1])
+            elif op in ("<", ">", "<=", ">="):
+                predicates[a[0]]["range"].append(a[1])
+        for negated, column in _IN_RE.findall(bare):
+            resolved = _resolve(column, aliases)
+            if resolved and not negated:
+                predicates[resolved[0]]["equality"].append(resolved[1])
+        for column in _BETWEEN_RE.findall(bare):
+            resolved = _resolve(column, aliases)
+            if resolved:
+                predicates[resolved[0]]["range"].append(resolved[1])
+
+    for regex in (_GROUP_RE, _ORDER_RE):
+        for clause in regex.findall(_LITERAL_RE.sub("?", sql)):
+            for item in clause.split(","):
+                parts = item.split()
+                if not parts or "(" in item:
+                    continue
+                resolved = _resolve(parts[0].strip("`"), aliases)
+                if resolved:
+                    direction = -1 if len(parts) > 1 and parts[1].lower() == "desc" else 1
+                    predicates[resolved[0]]["sort"].append((resolved[1], direction))
+
+    shapes = [
+        QueryShape("sql", table, tuple(sorted(set(p["equality"]))),
+                   tuple(dict.fromkeys(p["sort"])), tuple(dict.fromkeys(p["range"])))
+        for table, p in predicates.items()
+    ]
+    return shapes, [("sql",) + key for key in joins]
+
+
+_RANGE_OPS = {"$gt", "$gte", "$lt", "$lte"}
+
+
+def _mongo_match_fields(match, equality, ranges):
+    for key, condition in match.items():
+        if key in ("$and",):
+            for sub in condition:
+                _mongo_match_fields(sub, equality, ranges)
+            continue
+        if key.startswith("$"):
+            continue  # $or / $expr / $text are not served by one compound index
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            ops = set(condition)
+            if ops & {"$eq", "$in"}:
+                equality.append(key)
+            elif ops & _RANGE_OPS:
+                ranges.append(key)
+            elif "$regex" in ops and str(condition["$regex"]).startswith("^"):
+                ranges.append(key)
+        else:
+            equality.append(key)
+
+
+def mongo_shapes(collection, pipeline=None, query_filter=None):
+    """Query shapes and join keys of a pipeline, or of a write filter."""
+    shapes, joins = [], []
+    equality, ranges, sort = [], [], []
+    if query_filter is not None:
+        _mongo_match_fields(query_filter, equality, ranges)
+    leading = True
+    for stage in pipeline or []:
+        if not isinstance(stage, dict) or len(stage) != 1:
+            break
+        op, spec = next(iter(stage.items()))
+        if op == "$lookup" and isinstance(spec, dict):
+            if spec.get("from") and spec.get("foreignField"):
+                joins.append(("mongo", spec["from"], spec["foreignField"]))
+            leading = False
+        elif leading and op == "$match" and isinstance(spec, dict):
+            _mongo_match_fields(spec, equality, ranges)
+        elif leading and op == "$sort" and isinstance(spec, dict):
+            sort += [(f, -1 if d == -1 else 1) for f, d in spec.items() if isinstance(d, int)]
+            leading = False
+        elif op not in ("$match", "$project", "$limit", "$skip", "$geoNear"):
+            leading = False
+    if equality or ranges or sort:
+        shapes.append(QueryShape("mongo", collection, tuple(sorted(set(equality))),
+                                 tuple(dict.fromkeys(sort)), tuple(dict.fromkeys(ranges))))
+    return shapes, joins
+
+
+# --- Workload profile + recommendations ---
+@dataclass
+class IndexRecommendation:
+    backend: str
+    table: str
+    columns: list                 # [(field, direction)]
+    queries: int = 0
+    reasons: list = field(default_factory=list)
+
+    @property
+    def name(self):
+        return ("ix_" + self.table + "_" + "_".join(c for c, _ in self.columns))[:64]
+
+    def ddl(self):
+        if self.backend == "mongo":
+            keys = ", ".join(f'"{c}": {d}' for c, d in self.columns)
+            return f'db.{self.table}.createIndex({{{keys}}}, {{name: "{self.name}"}})'
+        types = SQL_COLUMNS.get(self.table, {})
+        parts = []
+        for column, direction in self.columns:
+            prefix = f"({TEXT_PREFIX_LENGTH})" if types.get(column) == "text" else ""
+            parts.append(f"`{column}`{prefix}" + (" DESC" if direction == -1 else ""))
+        return f"CREATE INDEX `{self.name}` ON `{self.table}` ({', '.join(parts)})"
+
+
+def build_profile(entries):
+    """Count query shapes and join keys over the recorded workload."""
+    shapes, joins = Counter(), Counter()
+    statements = Counter()
+    for entry in entries:
+        if entry.get("backend") == "sql" and entry.get("sql"):
+            found, keys = sql_shapes(entry["sql"])
+            statements[("sql", entry["sql"])] += 1
+        elif entry.get("backend") == "mongo" and entry.get("collection"):
+            found, keys = mongo_shapes(entry["collection"], entry.get("pipeline"), entry.get("filter"))
+            if "pipeline" in entry:
+                statements[("mongo", entry["collection"], json.dumps(entry["pipeline"], sort_keys=True))] += 1
+        else:
+            continue
+        for shape in found:
+            shapes[(shape.backend, shape.table, shape.equality, shape.sort, shape.range)] += 1
+        for key in keys:
+            joins[key] += 1
+    return {"shapes": shapes, "joins": joins, "statements": statements}
+
+
+def recommend(profile, include_known_joins=True):
+    """Compound indexes ordered equality -> sort -> range, most used first, with prefixes merged."""
+    field_counts = Counter()
+    for (backend, table, equality, _, _), count in profile["shapes"].items():
+        for column in equality:
+            field_counts[(backend, table, column)] += count
+
+    candidates = []
+    for (backend, table, equality, sort, ranges), count in profile["shapes"].items():
+        # Equality fields shared by more queries go first so one index serves more shapes
+        eq = sorted(equality, key=lambda c: (-field_counts[(backend, table, c)], c))
+        columns = [(c, 1) for c in eq]
+        columns += [(c, d) for c, d in sort if c not in equality]
+        columns += [(c, 1) for c in ranges[:1] if c not in equality and c not in dict(sort)]
+        if columns:
+            reason = "equality " + ", ".join(eq) if eq else "sort/range"
+            candidates.append(IndexRecommendation(backend, table, columns[:MAX_INDEX_COLUMNS], count, [reason]))
+
+    joins = Counter(profile["joins"])
+    if include_known_joins:
+        for key in KNOWN_JOIN_KEYS:
+            joins.setdefault(key, 0)
+    for (backend, table, column), count in joins.items():
+        candidates.append(IndexRecommendation(backend, table, [(column, 1)], count, ["join key"]))
+
+    merged = []
+    for rec in sorted(candidates, key=lambda r: (-len(r.columns), -r.queries)):
+        names = [c for c, _ in rec.columns]
+        cover = next((m for m in merged if m.backend == rec.backend and m.table == rec.table
+                      and [c for c, _ in m.columns][:len(names)] == names), None)
+        if cover:
+            cover.queries += rec.queries
+            cover.reasons += [r for r in rec.reasons if r not in cover.reasons]
+        elif not (rec.backend == "sql" and names == SQL_PRIMARY_KEYS.get(rec.table, [])[:len(names)]):
+            merged.append(rec)
+    return sorted(merged, key=lambda r: -r.queries)
+
+
+# --- Existing indexes, explain costs, apply ---
+def existing_indexes(rec, mysql_conn=None):
+    """Column lists of the indexes that already exist on ``rec.table``."""
+    if rec.backend == "mongo":
+        info = resources.get_collection(rec.table).index_information()
+        return [[field_name for field_name, _ in spec["key"]] for spec in info.values()]
+    cur = mysql_conn.cursor(dictionary=True)
+    try:
+        cur.execute(f"SHOW INDEX FROM `{rec.table}`")
+        by_name = defaultdict(list)
+        for row in cur.fetchall():
+            by_name[row["Key_name"]].append((row["Seq_in_index"], row["Column_name"]))
+    finally:
+        cur.close()
+    return [[c for _, c in sorted(cols)] for cols in by_name.values()]
+
+
+def is_covered(rec, existing):
+    names = [c for c, _ in rec.columns]
+    return any(cols[:len(names)] == names for cols in existing)
+
+
+def _sum_key(value, key):
+    if isinstance(value, dict):
+        return sum(v for k, v in value.items() if k == key and isinstance(v, (int, float))) + \
+            sum(_sum_key(v, key) for v in value.values() if isinstance(v, (dict, list)))
+    if isinstance(value, list):
+        return sum(_sum_key(v, key) for v in value)
+    return 0
+
+
+def explain_cost(statement, mysql_conn=None):
+    """MySQL ``query_cost`` of a SELECT, or documents examined by a MongoDB pipeline."""
+    if statement[0] == "sql":
+        sql = statement[1]
+        if not sql.lower().startswith("select"):
+            return None
+        cur = mysql_conn.cursor()
+        try:
+            cur.execute("EXPLAIN FORMAT=JSON " + sql)
+            plan = json.loads(cur.fetchone()[0])
+        finally:
+            cur.close()
+        return float(plan.get("query_block", {}).get("cost_info", {}).get("query_cost", 0))
+    _, collection, pipeline = statement
+    db = resources.get_mongo_db()
+    plan = db.command({"explain": {"aggregate": collection, "pipeline": json.loads(pipeline), "cursor": {}},
+                       "verbosity": "executionStats"}, maxTimeMS=30000)
+    return _sum_key(plan, "totalDocsExamined")
+
+
+def create_index(rec, mysql_conn=None):
+    if rec.backend == "mongo":
+        resources.get_collection(rec.table).create_index(rec.columns, name=rec.name)
+        return
+    cur = mysql_conn.cursor()
+    try:
+        cur.execute(rec.ddl())
+    finally:
+        cur.close()
+
+
+def _costs(statements, mysql_conn):
+    costs = {}
+    for statement in statements:
+        try:
+            costs[statement] = explain_cost(statement, mysql_conn)
+        except Exception as e:
+            costs[statement] = f"error: {e}"
+    return costs
+
+
+def _label(statement):
+    text = statement[1] if statement[0] == "sql" else f"{statement[1]}.aggregate({statement[2]})"
+    return text if len(text) <= 90 else text[:87] + "..."
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recommend (and optionally create) indexes from the recorded workload.")
+    parser.add_argument("--apply", action="store_true", help="create the recommended indexes and compare explain costs")
+    parser.add_argument("--workload", default=WORKLOAD_PATH)
+    parser.add_argument("--top", type=int, default=20, help="number of distinct recorded queries to explain")
+    parser.add_argument("--no-explain", action="store_true", help="only print the profile and recommendations")
+    args = parser.parse_args(argv)
+
+    entries = load_workload(args.workload)
+    profile = build_profile(entries)
+    recommendations = recommend(profile)
+    print(f"Workload: {len(entries)} recorded statements, {len(profile['shapes'])} query shapes, "
+          f"{len(profile['joins'])} join keys")
+    for (backend, table, equality, sort, ranges), count in profile["shapes"].most_common(15):
+        print(f"  {count:>5}  {backend:5} {table:12} eq={list(equality)} sort={list(sort)} range={list(ranges)}")
+    if args.no_explain:
+        print("\nRecommended indexes:")
+        for rec in recommendations:
+            print(f"  [{rec.queries:>5} queries; {', '.join(rec.reasons)}] {rec.ddl()}")
+        return
+
+    # Imported here: sqlrest_cleaned pulls in the SQL generation stack, which the recorder doesn't need
+    import sql_pool
+    import sqlrest_cleaned
+
+    statements = [s for s, _ in profile["statements"].most_common(args.top)]
+    with sql_pool.get_pool(sqlrest_cleaned.db_config).connection(timeout_ms=60000) as mysql_conn:
+        missing = []
+        print("\nRecommended indexes:")
+        for rec in recommendations:
+            try:
+                covered = is_covered(rec, existing_indexes(rec, mysql_conn))
+            except Exception as e:
+                print(f"  (could not read indexes of {rec.table}: {e})")
+                covered = False
+            status = "exists" if covered else "missing"
+            print(f"  [{status:7}] [{rec.queries:>5} queries; {', '.join(rec.reasons)}] {rec.ddl()}")
+            if not covered:
+                missing.append(rec)
+
+        before = _costs(statements, mysql_conn)
+        if args.apply:
+            for rec in missing:
+                try:
+                    create_index(rec, mysql_conn)
+                    print(f"  created {rec.name}")
+                except Exception as e:
+                    print(f"  failed {rec.name}: {e}")
+            after = _costs(statements, mysql_conn)
+        else:
+            after = {}
+
+    print("\nExplain cost per recorded query (MySQL query_cost / MongoDB documents examined):")
+    for statement in statements:
+        line = f"  {str(before[statement]):>14}"
+        if args.apply:
+            line += f" -> {str(after[statement]):>14}"
+        print(f"{line}  x{profile['statements'][statement]:<4} {_label(statement)}")
+    if not args.apply and missing:
+        print("\nRun with --apply to create the missing indexes.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import argparse
+import concurrent.futures as cf
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+import resources
+import index_advisor
+
+# --- Bulk CSV loader ---
+# Loads the bundled CSVs into their databases (host.csv -> MongoDB `host`;
+# restaurant.csv / menu.csv / review.csv -> MySQL restaurant / menu / reviews):
+# chunked reads with explicit dtypes, dates and booleans normalized, batched
+# insert_many(ordered=False) / executemany writes, tables loaded in parallel.
+# Progress is checkpointed per chunk, so a failed run resumes where it stopped
+# (for MySQL tables in the same transaction as the chunk's rows); indexes are
+# built once the data is in.
+#
+#   python loader.py                      # load everything (resumes a previous run)
+#   python loader.py menu reviews --restart --truncate
+
+CHUNK_ROWS = int(resources.getenv("LOADER_CHUNK_ROWS", "5000"))
+MONGO_BATCH = int(resources.getenv("LOADER_MONGO_BATCH", "1000"))
+SQL_BATCH = int(resources.getenv("LOADER_SQL_BATCH", "1000"))
+WORKERS = int(resources.getenv("LOADER_WORKERS", "4"))
+CHECKPOINT_PATH = resources.cache_path("loader_checkpoint.json")
+
+_TRUE = {"true", "yes", "y", "1", "t"}
+_FALSE = {"false", "no", "n", "0", "f"}
+
+
+@dataclass
+class TableSpec:
+    name: str                       # MySQL table / Mongo collection
+    csv: str
+    backend: str                    # "sql" or "mongo"
+    dtypes: dict                    # columns not listed are read as strings
+    dates: dict = field(default_factory=dict)      # column -> strptime format
+    booleans: list = field(default_factory=list)  # normalized to 'TRUE' / 'FALSE' text
+    key: str = None                 # primary key column, if any (duplicates are skipped)
+
+
+TABLES = {
+    "host": TableSpec("host", "host.csv", "mongo",
+                      {"host_name": "string", "host_since": "string", "host_response_time": "string",
+                       "host_id": "Int64", "host_about": "string"},
+                      dates={"host_since": "%m/%d/%y"}),
+    "restaurant": TableSpec("restaurant", "restaurant.csv", "sql",
+                            {"restaurant_id": "Int64", "seating_capacity": "Int64", "health_rating": "Int64"},
+                            key="restaurant_id"),
+    "menu": TableSpec("menu", "menu.csv", "sql",
+                      {"restaurant_id": "Int64", "item_name": "string", "price_usd": "float64",
+                       "is_vegetarian": "string"},
+                      booleans=["is_vegetarian"]),
+    "reviews": TableSpec("reviews", "review.csv", "sql",
+                         {"restaurant_id": "Int64", "rating": "float64", "review_count": "Int64",
+                          "sample_review": "string", "tags": "string"}),
+}
+
+# Same definitions as the README's setup section, for a fresh database
+SQL_DDL = {
+    "restaurant": """CREATE TABLE IF NOT EXISTS restaurant (
+  restaurant_id BIGINT PRIMARY KEY, restaurant_name TEXT, cuisine TEXT, city TEXT, state TEXT, address TEXT,
+  latitude FLOAT, longitude FLOAT, phone_number TEXT, email TEXT, delivery_available TEXT, seating_capacity INT,
+  opening_hours TEXT, has_wifi TEXT, has_outdoor_seating TEXT, payment_methods TEXT, parking_available TEXT,
+  alcohol_served TEXT, reservation_required TEXT, music_type TEXT, health_rating INT, has_kids_menu TEXT)""",
+    "menu": """CREATE TABLE IF NOT EXISTS menu (
+  restaurant_id BIGINT, item_name TEXT, price_usd FLOAT, is_vegetarian TEXT, image_url TEXT)""",
+    "reviews": """CREATE TABLE IF NOT EXISTS reviews (
+  restaurant_id BIGINT, rating FLOAT, review_count INT, sample_review TEXT, tags TEXT)""",
+}
+
+# menu and reviews have no key to skip duplicates on, so a chunk committed just
+# before a crash must not be loaded again: their row count is kept here and
+# updated in the chunk's own transaction
+PROGRESS_TABLE = "loader_progress"
+PROGRESS_DDL = f"""CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+  table_name VARCHAR(64) PRIMARY KEY, rows_done BIGINT NOT NULL)"""
+
+
+# --- Checkpoint ---
+class Checkpoint:
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def rows_done(self, table):
+        return self.state.get(table, {}).get("rows_done", 0)
+
+    def complete(self, table):
+        return self.state.get(table, {}).get("complete", False)
+
+    def update(self, table, rows_done, complete=False):
+        with self._lock:
+            self.state[table] = {"rows_done": rows_done, "complete": complete}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.state, f)
+            os.replace(tmp, self.path)
+
+    def reset(self, tables):
+        for table in tables:
+            self.update(table, 0)
+
+
+# --- Reading + normalization ---
+def read_chunks(spec, chunk_rows=CHUNK_ROWS):
+    path = os.path.join(resources.BASE_DIR, spec.csv)
+    # utf-8-sig drops the BOM on host.csv's header; quoted multi-line fields are handled by the parser
+    dtypes = defaultdict(lambda: "string", spec.dtypes)
+    return pd.read_csv(path, chunksize=chunk_rows, dtype=dtypes, encoding="utf-8-sig")
+
+
+def to_bool(series):
+    lowered = series.astype("string").str.strip().str.lower()
+    return lowered.map(lambda v: True if v in _TRUE else False if v in _FALSE else None, na_action="ignore")
+
+
+def normalize(chunk, spec):
+    chunk = chunk.copy()
+    for column, fmt in spec.dates.items():
+        if column in chunk:
+            # ISO dates compare correctly as strings (the prompts filter host_since with "$lt": "2015-01-01")
+            chunk[column] = pd.to_datetime(chunk[column], format=fmt, errors="coerce").dt.strftime("%Y-%m-%d")
+    for column in spec.booleans:
+        if column in chunk:
+            # Kept as text: the SQL prompt filters with is_vegetarian = 'TRUE'
+            chunk[column] = to_bool(chunk[column]).map({True: "TRUE", False: "FALSE"})
+    for column in chunk.columns:
+        if chunk[column].dtype == "string":
+            chunk[column] = chunk[column].str.replace("\r\n", "\n", regex=False).str.strip()
+    return chunk
+
+
+def records(chunk):
+    """Rows as plain Python values with missing values as None."""
+    clean = chunk.astype(object).where(chunk.notna(), None)
+    return [tuple(row) for row in clean.itertuples(index=False, name=None)]
+
+
+def _object_id(table, row_number):
+    from bson import ObjectId
+    # Deterministic ids make a retried chunk a no-op (duplicate keys are ignored) instead of a duplicate load
+    return ObjectId(hashlib.sha256(f"{table}:{row_number}".encode()).digest()[:12])
+
+
+# --- Writers ---
+def write_mongo(spec, chunk, start_row, batch_size=MONGO_BATCH):
+    from pymongo.errors import BulkWriteError
+    collection = resources.get_collection(spec.name)
+    columns = list(chunk.columns)
+    docs = []
+    for offset, row in enumerate(records(chunk)):
+        doc = {c: v for c, v in zip(columns, row) if v is not None}
+        doc["_id"] = _object_id(spec.name, start_row + offset)
+        docs.append(doc)
+    for i in range(0, len(docs), batch_size):
+        try:
+            collection.insert_many(docs[i:i + batch_size], ordered=False)
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+
+def write_sql(spec, chunk, conn, batch_size=SQL_BATCH, rows_done=None):
+    """Insert ``chunk`` in one transaction, recording ``rows_done`` in the progress table in the same commit."""
+    columns = list(chunk.columns)
+    verb = "INSERT IGNORE" if spec.key else "INSERT"
+    statement = (f"{verb} INTO `{spec.name}` ({', '.join(f'`{c}`' for c in columns)}) "
+                 f"VALUES ({', '.join(['%s'] * len(columns))})")
+    rows = records(chunk)
+    cur = conn.cursor()
+    try:
+        # One transaction per chunk: a chunk is either fully loaded and checkpointed or not at all
+        for i in range(0, len(rows), batch_size):
+            cur.executemany(statement, rows[i:i + batch_size])
+        if rows_done is not None:
+            _set_progress(cur, spec.name, rows_done)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _execute(conn, statement):
+    cur = conn.cursor()
+    try:
+        cur.execute(statement)
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def _set_progress(cur, table, rows_done):
+    cur.execute(f"INSERT INTO {PROGRESS_TABLE} (table_name, rows_done) VALUES (%s, %s) "
+                f"ON DUPLICATE KEY UPDATE rows_done = VALUES(rows_done)", (table, rows_done))
+
+
+def _sql_progress(conn, table, restart=False):
+    """Rows of ``table`` already committed, from the progress table (reset to 0 on a restart)."""
+    cur = conn.cursor()
+    try:
+        cur.execute(PROGRESS_DDL)
+        if restart:
+            _set_progress(cur, table, 0)
+        cur.execute(f"SELECT rows_done FROM {PROGRESS_TABLE} WHERE table_name = %s", (table,))
+        row = cur.fetchone()
+        conn.commit()
+    finally:
+        cur.close()
+    return row[0] if row else 0
+
+
+# --- Table loads ---
+def load_table(spec, checkpoint, chunk_rows=CHUNK_ROWS, mongo_batch=MONGO_BATCH, sql_batch=SQL_BATCH, truncate=False,
+               restart=False):
+    """Load one table, resuming after the last checkpointed row; returns ``(rows_written, seconds)``."""
+    started = time.perf_counter()
+    done = checkpoint.rows_done(spec.name)
+    written = 0
+    pool = None
+    if spec.backend == "sql":
+        import sql_pool
+        import sqlrest_cleaned
+        pool = sql_pool.get_pool(sqlrest_cleaned.db_config)
+        with pool.connection() as conn:
+            _execute(conn, SQL_DDL[spec.name])
+            if truncate:
+                _execute(conn, f"TRUNCATE TABLE `{spec.name}`")
+            # The JSON file is written after the commit and can be a chunk behind; the database's count can't
+            done = _sql_progress(conn, spec.name, restart)
+    elif truncate:
+        resources.get_collection(spec.name).delete_many({})
+
+    position = 0
+    for chunk in read_chunks(spec, chunk_rows):
+        start, position = position, position + len(chunk)
+        if position <= done:
+            continue
+        chunk = normalize(chunk.iloc[max(0, done - start):], spec)
+        first_row = max(done, start)
+        if spec.backend == "mongo":
+            write_mongo(spec, chunk, first_row, mongo_batch)
+        else:
+            with pool.connection() as conn:
+                write_sql(spec, chunk, conn, sql_batch, rows_done=position)
+        written += len(chunk)
+        checkpoint.update(spec.name, position)
+    checkpoint.update(spec.name, position, complete=True)
+    return written, time.perf_counter() - started
+
+
+def build_indexes(tables):
+    """Create the advisor's recommended indexes for the loaded tables (join keys + recorded workload)."""
+    import sql_pool
+    import sqlrest_cleaned
+    recommendations = [r for r in index_advisor.recommend(index_advisor.build_profile(index_advisor.load_workload()))
+                       if r.table in tables]
+    created = []
+    with sql_pool.get_pool(sqlrest_cleaned.db_config).connection(timeout_ms=600000) as conn:
+        for rec in recommendations:
+            if not index_advisor.is_covered(rec, index_advisor.existing_indexes(rec, conn)):
+                index_advisor.create_index(rec, conn)
+                created.append(rec.ddl())
+    return created
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load the bundled CSVs into MongoDB and MySQL.")
+    parser.add_argument("tables", nargs="*", help=f"tables to load: {', '.join(TABLES)} (default: all)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--mongo-batch", type=int, default=MONGO_BATCH)
+    parser.add_argument("--sql-batch", type=int, default=SQL_BATCH)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and load from the first row")
+    parser.add_argument("--truncate", action="store_true", help="empty each table before loading (use with --restart)")
+    parser.add_argument("--no-indexes", action="store_true", help="skip building indexes after the load")
+    args = parser.parse_args(argv)
+    tables = args.tables or list(TABLES)
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        parser.error(f"unknown table(s): {', '.join(sorted(unknown))}")
+
+    checkpoint = Checkpoint()
+    if args.restart:
+        checkpoint.reset(tables)
+    pending = [t for t in tables if not checkpoint.complete(t)]
+    for table in set(tables) - set(pending):
+        print(f"{table:12} already loaded (use --restart to reload)")
+
+    failed = False
+    total_rows, started = 0, time.perf_counter()
+    with cf.ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {
+            executor.submit(load_table, TABLES[t], checkpoint, args.chunk_rows, args.mongo_batch, args.sql_batch,
+                            args.truncate and args.restart, args.restart): t
+            for t in pending
+        }
+        for future in cf.as_completed(futures):
+            table = futures[future]
+            try:
+                rows, seconds = future.result()
+            except Exception as e:
+                failed = True
+                print(f"{table:12} FAILED after {checkpoint.rows_done(table)} rows: {e} (rerun to resume)")
+                continue
+            total_rows += rows
+            print(f"{table:12} {rows:>8} rows in {seconds:6.2f}s  ({rows / seconds if seconds else 0:,.0f} rows/s)")
+    elapsed = time.perf_counter() - started
+    print(f"{'total':12} {total_rows:>8} rows in {elapsed:6.2f}s  ({total_rows / elapsed if elapsed else 0:,.0f} rows/s)")
+
+    if not failed and not args.no_indexes:
+        for ddl in build_indexes(tables):
+            print(f"created index: {ddl}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
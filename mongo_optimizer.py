@@ -0,0 +1,249 @@
+import copy
+from dataclasses import dataclass, field
+
+import resources
+
+# --- Rewriting + guardrail layer for LLM-generated aggregation pipelines ---
+# Pipelines from the model are rewritten before they reach the server:
+#   * $match conditions that don't read a joined field are moved ahead of the
+#     $lookup / $unwind stages they follow, so fewer documents get joined;
+#   * a $project keeping only the fields used later is added before the first
+#     $lookup, and each $lookup uses the pipeline form to return only the
+#     joined fields that are read afterwards (host / review documents are wide);
+#   * a default $limit, maxTimeMS and cursor batch size are applied.
+# Nothing is ever moved ahead of $geoNear, which must stay the first stage.
+# check_plan() runs explain() and rejects collection scans on large collections.
+
+DEFAULT_LIMIT = int(resources.getenv("MONGO_DEFAULT_LIMIT", "1000"))
+MAX_TIME_MS = int(resources.getenv("MONGO_MAX_TIME_MS", "15000"))
+BATCH_SIZE = int(resources.getenv("MONGO_BATCH_SIZE", "200"))
+COLLSCAN_MAX_DOCS = int(resources.getenv("MONGO_COLLSCAN_MAX_DOCS", "100000"))
+# The localField/foreignField + pipeline form of $lookup needs MongoDB 5.0+
+LOOKUP_PIPELINE = resources.getenv("MONGO_LOOKUP_PIPELINE", "1") == "1"
+
+# Stages whose field references are understood well enough to rewrite around
+_WINDOW_STAGES = {"$match", "$sort", "$limit", "$skip", "$unwind", "$lookup", "$project"}
+_WRITE_STAGES = {"$out", "$merge"}
+
+
+class PipelineRejected(Exception):
+    pass
+
+
+@dataclass
+class OptimizedPipeline:
+    pipeline: list
+    rewrites: list = field(default_factory=list)
+    options: dict = field(default_factory=dict)  # aggregate() keyword options
+
+
+def _op(stage):
+    return next(iter(stage)) if isinstance(stage, dict) and len(stage) == 1 else None
+
+
+def _collect_refs(value, refs, keys_are_fields=True):
+    if isinstance(value, dict):
+        for key, sub in value.items():
+            if keys_are_fields and not key.startswith("$"):
+                refs.add(key)
+            _collect_refs(sub, refs, keys_are_fields)
+    elif isinstance(value, list):
+        for sub in value:
+            _collect_refs(sub, refs, keys_are_fields)
+    elif isinstance(value, str) and value.startswith("$") and not value.startswith("$$"):
+        refs.add(value[1:])
+
+
+def stage_refs(stage):
+    """Field paths a window stage reads (None for stages that aren't understood)."""
+    op = _op(stage)
+    spec = stage[op] if op else None
+    refs = set()
+    if op in ("$match", "$sort", "$project"):
+        _collect_refs(spec, refs)
+    elif op == "$unwind":
+        _collect_refs(spec if isinstance(spec, str) else spec.get("path"), refs)
+    elif op == "$lookup":
+        if spec.get("localField"):
+            refs.add(spec["localField"])
+        _collect_refs(spec.get("let", {}), refs, keys_are_fields=False)
+    elif op not in ("$limit", "$skip"):
+        return None
+    return refs
+
+
+def _top(path):
+    return path.split(".")[0]
+
+
+def _join_output(stage):
+    op = _op(stage)
+    if op == "$lookup":
+        return stage[op].get("as")
+    if op == "$unwind":
+        path = stage[op] if isinstance(stage[op], str) else stage[op].get("path", "")
+        return _top(path.lstrip("$"))
+    return None
+
+
+def hoist_matches(stages, rewrites):
+    """Move $match conditions that don't read joined fields ahead of the $lookup/$unwind they follow."""
+    i = 1
+    while i < len(stages):
+        if _op(stages[i]) != "$match" or _join_output(stages[i - 1]) is None:
+            i += 1
+            continue
+        j, joined = i, set()
+        while j > 0 and _join_output(stages[j - 1]) is not None:
+            joined.add(_join_output(stages[j - 1]))
+            j -= 1
+        movable, staying = {}, {}
+        for key, condition in stages[i]["$match"].items():
+            refs = set()
+            _collect_refs({key: condition}, refs)
+            if key == "$where" or {_top(r) for r in refs} & joined:
+                staying[key] = condition
+            else:
+                movable[key] = condition
+        if not movable:
+            i += 1
+            continue
+        if staying:
+            stages[i] = {"$match": staying}
+        else:
+            stages.pop(i)
+        stages.insert(j, {"$match": movable})
+        rewrites.append(f"Moved $match on {', '.join(movable)} ahead of the {', '.join(sorted(joined))} join")
+        i += 1
+    return stages
+
+
+def _inclusion_project(stage):
+    spec = stage["$project"]
+    return all(value in (1, True) or (key == "_id" and value in (0, False)) for key, value in spec.items())
+
+
+def _window_until_project(stages, start):
+    """Index of the first inclusion $project after ``start`` if every stage in between is understood."""
+    for k in range(start + 1, len(stages)):
+        op = _op(stages[k])
+        if op not in _WINDOW_STAGES:
+            return None
+        if op == "$project":
+            return k if _inclusion_project(stages[k]) else None
+    return None
+
+
+def _drop_covered(paths):
+    # "a" and "a.b" in one projection is a path collision on the server
+    return sorted(p for p in paths if not any(p.startswith(other + ".") for other in paths))
+
+
+def narrow_lookups(stages, rewrites):
+    """Turn simple $lookup stages into the pipeline form projecting only the joined fields read later."""
+    for idx, stage in enumerate(stages):
+        if _op(stage) != "$lookup":
+            continue
+        spec = stage["$lookup"]
+        if "pipeline" in spec or not spec.get("localField") or not spec.get("as"):
+            continue
+        end = _window_until_project(stages, idx)
+        if end is None:
+            continue
+        as_field, subpaths, whole = spec["as"], set(), False
+        for later in stages[idx + 1:end + 1]:
+            for ref in stage_refs(later):
+                if ref == as_field and _op(later) != "$unwind":
+                    whole = True
+                elif ref.startswith(as_field + "."):
+                    subpaths.add(ref[len(as_field) + 1:])
+        if whole:
+            continue
+        projection = {path: 1 for path in _drop_covered(subpaths)}
+        if "_id" not in projection:
+            projection["_id"] = 0 if projection else 1
+        spec["pipeline"] = [{"$project": projection}]
+        kept = ", ".join(p for p in projection if p != "_id") or "_id"
+        rewrites.append(f"Narrowed $lookup from {spec.get('from')} to {kept}")
+    return stages
+
+
+def project_early(stages, rewrites):
+    """Add a $project before the first $lookup so the join carries only the fields used afterwards."""
+    first = next((i for i, s in enumerate(stages) if _op(s) == "$lookup"), None)
+    if first is None or (first > 0 and _op(stages[first - 1]) == "$project"):
+        return stages
+    end = _window_until_project(stages, first)
+    if end is None:
+        return stages
+    joined = {_join_output(s) for s in stages[first:end] if _op(s) == "$lookup"}
+    needed = set()
+    for later in stages[first:end + 1]:
+        needed |= {ref for ref in stage_refs(later) if _top(ref) not in joined}
+    # _id is kept by a $project unless excluded, so drop it early only when the final projection does
+    id_dropped = stages[end]["$project"].get("_id", 1) in (0, False) and not any(
+        _top(ref) == "_id" for later in stages[first:end] for ref in stage_refs(later))
+    needed = {ref for ref in needed if _top(ref) != "_id"}
+    if not needed:
+        return stages
+    projection = {path: 1 for path in _drop_covered(needed)}
+    if id_dropped:
+        projection["_id"] = 0
+    stages.insert(first, {"$project": projection})
+    rewrites.append(f"Added $project of {', '.join(p for p in projection if p != '_id')} before the first $lookup")
+    return stages
+
+
+def add_default_limit(stages, rewrites, limit=DEFAULT_LIMIT):
+    ops = [_op(s) for s in stages]
+    if "$limit" in ops or _WRITE_STAGES & set(ops) or (ops and ops[-1] == "$count"):
+        return stages
+    stages.append({"$limit": limit})
+    rewrites.append(f"Added default $limit {limit}")
+    return stages
+
+
+def optimize(pipeline, max_time_ms=None, default_limit=True):
+    """Rewrite an aggregation pipeline; the input is left untouched.
+
+    Without ``default_limit`` no $limit is added (for pipelines read a page at a time).
+    """
+    if not isinstance(pipeline, list):
+        return OptimizedPipeline(pipeline)
+    rewrites = []
+    stages = copy.deepcopy(pipeline)
+    stages = hoist_matches(stages, rewrites)
+    if LOOKUP_PIPELINE:
+        stages = narrow_lookups(stages, rewrites)
+    stages = project_early(stages, rewrites)
+    if default_limit:
+        stages = add_default_limit(stages, rewrites)
+    time_ms = min(MAX_TIME_MS, max_time_ms) if max_time_ms else MAX_TIME_MS
+    rewrites.append(f"maxTimeMS={time_ms}, batchSize={BATCH_SIZE}")
+    return OptimizedPipeline(stages, rewrites, {"maxTimeMS": time_ms, "batchSize": BATCH_SIZE})
+
+
+def _has_collscan(plan):
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(v) for v in plan)
+    return False
+
+
+def check_plan(collection, pipeline, max_docs=COLLSCAN_MAX_DOCS):
+    """Explain the pipeline and raise PipelineRejected for a collection scan over ``max_docs`` documents."""
+    ops = {_op(s) for s in pipeline}
+    if "$geoNear" in ops or "$search" in ops:
+        return
+    explain = collection.database.command(
+        {"explain": {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}}, "verbosity": "queryPlanner"})
+    if not _has_collscan(explain):
+        return
+    count = collection.estimated_document_count()
+    if count > max_docs:
+        raise PipelineRejected(
+            f"This query would scan all {count:,} documents of `{collection.name}` (COLLSCAN). "
+            f"Add a filter on an indexed field, or raise MONGO_COLLSCAN_MAX_DOCS.")
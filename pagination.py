@@ -0,0 +1,138 @@
+import re
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import resources
+
+# --- Paged result views ---
+# Results are shown a page at a time, and each page fetches only the rows it
+# displays (plus one, to know whether there is a next page): SQL pages add
+# LIMIT / OFFSET to the generated SELECT, MongoDB pages append $skip / $limit
+# to the optimized pipeline. The total comes from a side query run once per
+# result: COUNT(*) over the SELECT, or a $facet $count branch next to the first
+# page. Every result gets a cursor with a token, kept in the Streamlit session,
+# so Previous / Next run the stored query for another page without going back
+# to the LLM.
+
+PAGE_SIZE = int(resources.getenv("RESULT_PAGE_SIZE", "25"))
+MAX_CURSORS = int(resources.getenv("RESULT_CURSORS_MAX", "10"))  # kept per session
+
+
+# --- SQL ---
+_TRAILING_LIMIT_RE = re.compile(r"\s+LIMIT\s+(\d+)(?:\s*,\s*(\d+)|\s+OFFSET\s+(\d+))?\s*$", re.IGNORECASE)
+
+
+def _strip(sql):
+    return sql.strip().rstrip(";").strip()
+
+
+def page_sql(sql, offset, limit):
+    """``sql`` restricted to ``limit`` rows from ``offset``; a LIMIT the query already has still bounds the pages."""
+    sql = _strip(sql)
+    m = _TRAILING_LIMIT_RE.search(sql)
+    if m:
+        if m.group(2) is not None:  # LIMIT offset, count
+            base_offset, base_limit = int(m.group(1)), int(m.group(2))
+        else:
+            base_offset, base_limit = int(m.group(3) or 0), int(m.group(1))
+        limit = max(0, min(limit, base_limit - offset))
+        offset += base_offset
+        sql = sql[:m.start()]
+    return f"{sql} LIMIT {limit} OFFSET {offset}"
+
+
+def count_sql(sql):
+    return f"SELECT COUNT(*) AS total FROM ({_strip(sql)}) AS counted"
+
+
+# --- MongoDB ---
+def pageable(pipeline):
+    """Whether an aggregation's results can be paged ($out / $merge write them instead of returning them)."""
+    return isinstance(pipeline, list) and not any(
+        isinstance(stage, dict) and ("$out" in stage or "$merge" in stage) for stage in pipeline)
+
+
+def page_pipeline(pipeline, skip, limit, with_total=False):
+    """``pipeline`` narrowed to one page; ``with_total`` wraps the page in a $facet that also counts every result."""
+    page = ([{"$skip": skip}] if skip else []) + [{"$limit": limit}]
+    if with_total:
+        return pipeline + [{"$facet": {"rows": page, "total": [{"$count": "n"}]}}]
+    return pipeline + page
+
+
+def unpack_facet(results):
+    """``(rows, total)`` from the single document a ``page_pipeline(..., with_total=True)`` returns."""
+    facet = results[0] if results else {}
+    total = facet.get("total") or [{"n": 0}]
+    return facet.get("rows", []), total[0]["n"]
+
+
+# --- Cursors ---
+@dataclass
+class Page:
+    rows: object        # DataFrame (SQL) or list of documents (MongoDB)
+    number: int         # 0-based
+    page_size: int
+    total: int = None   # None when the count side query failed
+    has_next: bool = False
+
+    @property
+    def start(self):
+        return self.number * self.page_size
+
+    def describe(self):
+        if not len(self.rows):
+            return "No results on this page"
+        text = f"Results {self.start + 1:,}–{self.start + len(self.rows):,}"
+        if self.total is not None:
+            return f"{text} of {self.total:,}"
+        return f"{text}, more available" if self.has_next else text
+
+
+@dataclass
+class Cursor:
+    """Continuation state for one result.
+
+    ``fetch(offset, limit, with_total)`` runs a page query and returns ``(rows, total or None)``;
+    the total is only asked for with the first page that is loaded.
+    """
+    backend: str
+    query: object       # the SQL or pipeline the pages are cut from, for display
+    fetch: object
+    page_size: int = PAGE_SIZE
+    total: int = None
+    counted: bool = False
+    page: Page = None
+    token: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+
+    def load(self, number=0):
+        number = max(0, number)
+        rows, total = self.fetch(number * self.page_size, self.page_size + 1, not self.counted)
+        if not self.counted:
+            self.counted, self.total = True, total
+        self.page = Page(rows[:self.page_size], number, self.page_size, self.total, len(rows) > self.page_size)
+        return self.page
+
+    @property
+    def complete(self):
+        """Whether the first page holds the whole result."""
+        return self.page is not None and self.page.number == 0 and not self.page.has_next
+
+
+def open_cursor(state, cursor):
+    """Keep ``cursor`` in a session's state as its active result; the oldest beyond MAX_CURSORS are dropped."""
+    cursors = state.setdefault("cursors", OrderedDict())
+    cursors[cursor.token] = cursor
+    while len(cursors) > MAX_CURSORS:
+        cursors.popitem(last=False)
+    state["active_cursor"] = cursor.token
+    return cursor
+
+
+def active_cursor(state):
+    return state.get("cursors", {}).get(state.get("active_cursor"))
+
+
+def close_cursor(state):
+    state["active_cursor"] = None
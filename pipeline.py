@@ -0,0 +1,114 @@
+import concurrent.futures as cf
+import contextvars
+import queue
+import time
+
+from langchain.schema import HumanMessage
+
+import resources
+import tracing
+
+# --- Concurrent request pipeline primitives ---
+# Stages (route -> generate -> execute -> summarize) run on a shared thread pool
+# so independent work can overlap (see planner.py for speculative generation);
+# the summary call starts as soon as results exist, while the UI renders them.
+# Every request carries a deadline whose remaining budget is handed to the DB
+# drivers (MAX_EXECUTION_TIME / maxTimeMS). Worker threads never touch `st`.
+
+WORKERS = int(resources.getenv("PIPELINE_WORKERS", "8"))
+REQUEST_DEADLINE_S = float(resources.getenv("REQUEST_DEADLINE_S", "90"))
+STAGE_DEADLINES_S = {
+    "route": float(resources.getenv("ROUTE_DEADLINE_S", "15")),
+    "generate": float(resources.getenv("GENERATE_DEADLINE_S", "30")),
+    "execute": float(resources.getenv("EXECUTE_DEADLINE_S", "20")),
+    "summarize": float(resources.getenv("SUMMARIZE_DEADLINE_S", "30")),
+}
+
+
+class StageTimeout(Exception):
+    pass
+
+
+class ContextExecutor(cf.ThreadPoolExecutor):
+    """Thread pool that runs each task in a copy of the submitter's context (so tracing spans follow the work)."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+@resources.resource
+def get_executor():
+    return ContextExecutor(max_workers=WORKERS, thread_name_prefix="chatbot-pipeline")
+
+
+class Deadline:
+    """Overall request budget; each stage gets ``min(stage budget, time left)``."""
+
+    def __init__(self, seconds=REQUEST_DEADLINE_S):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def for_stage(self, stage):
+        return min(STAGE_DEADLINES_S[stage], self.remaining())
+
+    def ms(self, stage):
+        return max(1, int(self.for_stage(stage) * 1000))
+
+
+def await_stage(future, deadline, stage):
+    try:
+        return future.result(timeout=deadline.for_stage(stage))
+    except cf.TimeoutError:
+        future.cancel()
+        raise StageTimeout(f"The {stage} stage did not finish within its deadline")
+
+
+def run_stage(deadline, stage, fn, *args, **kwargs):
+    """Run ``fn`` on the pool and wait for it within the stage's share of the deadline."""
+    return await_stage(get_executor().submit(fn, *args, **kwargs), deadline, stage)
+
+
+class SummaryStream:
+    """Summary LLM call streaming into a queue from a worker thread.
+
+    Started as soon as results exist; the UI thread later drains ``chunks()``
+    (e.g. with ``st.write_stream``) so tokens appear as they arrive.
+    """
+
+    _DONE = object()
+
+    def __init__(self, summary_prompt):
+        self._queue = queue.Queue()
+        self.future = get_executor().submit(self._produce, summary_prompt)
+
+    def _produce(self, summary_prompt):
+        parts = []
+        try:
+            with tracing.span("llm", purpose="summary") as span:
+                for chunk in resources.get_openai_llm().stream([HumanMessage(content=summary_prompt)]):
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        self._queue.put(chunk.content)
+                span.tokens(summary_prompt, "".join(parts))
+        finally:
+            self._queue.put(self._DONE)
+
+    def chunks(self, deadline):
+        expires = time.monotonic() + deadline.for_stage("summarize")
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, expires - time.monotonic()))
+            except queue.Empty:
+                raise StageTimeout("The summarize stage did not finish within its deadline")
+            if item is self._DONE:
+                break
+            yield item
+        # Surface an error raised by the LLM call
+        self.future.result()
+
+
+def start_summary(summary_prompt):
+    """Kick off the streamed summary LLM call in the background."""
+    return SummaryStream(summary_prompt)
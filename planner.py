@@ -0,0 +1,86 @@
+import time
+from dataclasses import dataclass, field
+
+import router
+import tracing
+import maincpy_cleaned
+import sqlrest_cleaned
+from pipeline import Deadline, await_stage, get_executor
+
+# --- Routing + query generation with speculative dual-backend generation ---
+# When the local router is confident, only that backend's query is generated.
+# Otherwise the LLM classification and both the SQL (Gemini) and MongoDB
+# (OpenAI) generations start at the same time, and the losing candidate is
+# cancelled as soon as the classification resolves, taking a whole serial LLM
+# round trip off the critical path.
+
+@dataclass
+class Plan:
+    backend: str                      # "sql", "mongo" or "unknown"
+    query: str = None                 # generated SQL text or MongoDB JSON text
+    path: str = None                  # template / cache / llm
+    prompt_report: dict = None
+    speculative: bool = False         # both backends were generated while routing was unresolved
+    timings: dict = field(default_factory=dict)
+
+    def generated(self):
+        return self.query, self.path, self.prompt_report
+
+
+def _generate(backend, question):
+    if backend == "sql":
+        return sqlrest_cleaned.generate_sql(question)
+    return maincpy_cleaned.generate_mongo_query(question)
+
+
+def _trace_path(span, path):
+    span.set(path=path)
+    if path in ("cache", "llm"):
+        span.set(translation_cache="hit" if path == "cache" else "miss")
+
+
+def plan(question, mode="Auto Detect", deadline=None):
+    """Route the question and generate its query, speculating on both backends when routing is uncertain."""
+    deadline = deadline or Deadline()
+    executor = get_executor()
+    timings = {}
+    start = time.perf_counter()
+
+    with tracing.span("route", source="mode" if mode in ("Restaurant", "Housing") else "router") as span:
+        if mode in ("Restaurant", "Housing"):
+            backend = router.detect_backend(question, mode)
+        else:
+            backend = router.get_router().route(question).backend
+        span.set(backend=backend)
+    if backend:
+        timings["route"] = time.perf_counter() - start
+        start = time.perf_counter()
+        with tracing.span("generate", backend=backend) as span:
+            query, path, report = await_stage(executor.submit(_generate, backend, question), deadline, "generate")
+            _trace_path(span, path)
+        timings["generate"] = time.perf_counter() - start
+        return Plan(backend, query, path, report, False, timings)
+
+    # Uncertain: ask the LLM and generate both candidates at the same time
+    classification = executor.submit(router.classify_with_llm, question)
+    candidates = {name: executor.submit(_generate, name, question) for name in ("sql", "mongo")}
+    try:
+        with tracing.span("route", source="llm", speculative=True) as span:
+            backend = await_stage(classification, deadline, "route")
+            span.set(backend=backend)
+    except Exception:
+        for future in candidates.values():
+            future.cancel()
+        timings["route"] = time.perf_counter() - start
+        return Plan("unknown", timings=timings)
+    router.get_router().remember(question, backend)
+    timings["route"] = time.perf_counter() - start
+    start = time.perf_counter()
+    # Not yet started -> never runs; already running -> its result is simply dropped
+    candidates["mongo" if backend == "sql" else "sql"].cancel()
+    with tracing.span("generate", backend=backend, speculative=True) as span:
+        query, path, report = await_stage(candidates[backend], deadline, "generate")
+        _trace_path(span, path)
+    timings["generate_after_route"] = time.perf_counter() - start
+    return Plan(backend, query, path, report, True, timings)
+
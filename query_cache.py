@@ -0,0 +1,136 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import resources
+
+# --- Persistent NL -> query translation cache ---
+# Generated SQL / MongoDB queries are stored in a small SQLite file so repeated
+# questions skip the Gemini / OpenAI round trip, even across restarts. Entries
+# are keyed on the normalized question, backend, model and a hash of the prompt
+# source (SQL prompt or Mongo template + sample.txt); when that source changes,
+# the stale entries for the backend are dropped automatically.
+
+DEFAULT_PATH = resources.getenv("TRANSLATION_CACHE_PATH", resources.cache_path("translations.sqlite"))
+DEFAULT_MAX_ENTRIES = int(resources.getenv("TRANSLATION_CACHE_MAX_ENTRIES", "5000"))
+DEFAULT_TTL_SECONDS = int(resources.getenv("TRANSLATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def normalize_question(question):
+    q = re.sub(r"\s+", " ", question.strip().lower())
+    return q.rstrip("?.! ")
+
+
+def source_hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+class TranslationCache:
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._current_sources = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                backend TEXT NOT NULL,
+                model TEXT NOT NULL,
+                source_hash TEXT NOT NULL,
+                question TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+        self._conn.commit()
+
+    def _key(self, backend, model, src_hash, question):
+        return source_hash(backend, model, src_hash, normalize_question(question))
+
+    def _invalidate_stale(self, backend, src_hash):
+        # Runs once per (backend, source) per process: drops entries built from an older prompt
+        if self._current_sources.get(backend) == src_hash:
+            return
+        self._conn.execute("DELETE FROM translations WHERE backend = ? AND source_hash != ?", (backend, src_hash))
+        self._conn.commit()
+        self._current_sources[backend] = src_hash
+
+    def get(self, backend, model, src_hash, question):
+        key = self._key(backend, model, src_hash, question)
+        now = time.time()
+        with self._lock:
+            self._invalidate_stale(backend, src_hash)
+            row = self._conn.execute("SELECT response, created FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE translations SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, backend, model, src_hash, question, response):
+        key = self._key(backend, model, src_hash, question)
+        now = time.time()
+        with self._lock:
+            self._invalidate_stale(backend, src_hash)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (key, backend, model, source_hash, question, response, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, backend, model, src_hash, normalize_question(question), response, now, now))
+            self._conn.execute("DELETE FROM translations WHERE created < ?", (now - self.ttl_seconds,))
+            # LRU eviction down to max_entries
+            self._conn.execute(
+                "DELETE FROM translations WHERE key IN ("
+                "SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+            self._conn.commit()
+
+    def get_or_create(self, backend, model, src_hash, question, generate, should_store=bool):
+        """Return ``(response, hit)``; on a miss ``generate()`` is called and its result stored if ``should_store`` accepts it."""
+        cached = self.get(backend, model, src_hash, question)
+        if cached is not None:
+            return cached, True
+        response = generate()
+        if should_store(response):
+            self.put(backend, model, src_hash, question, response)
+        return response, False
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM translations")
+            self._conn.commit()
+
+
+@resources.resource
+def get_translation_cache():
+    return TranslationCache()
@@ -0,0 +1,139 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import resources
+
+# --- In-memory result-set cache for read-only queries ---
+# SELECT results (DataFrames) and aggregation outputs (lists of documents) are
+# kept under a memory budget, keyed on the canonical SQL text or pipeline JSON
+# and tagged with every table / collection they read. Writes invalidate only the
+# entries tagged with the table or collection they touch.
+
+DEFAULT_MAX_BYTES = int(resources.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_TTL_SECONDS = int(resources.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+
+_SQL_TABLE_RE = re.compile(r"\b(?:from|join|into|update|table)\s+`?(\w+)`?", re.IGNORECASE)
+_SQL_LITERAL_RE = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\")")
+
+
+def canonical_sql(sql):
+    """Collapse whitespace and drop the trailing semicolon, leaving quoted literals untouched."""
+    parts = _SQL_LITERAL_RE.split(sql.strip().rstrip(";").strip())
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)).strip()
+
+
+def sql_tables(sql):
+    return {name.lower() for name in _SQL_TABLE_RE.findall(_SQL_LITERAL_RE.sub("''", sql))}
+
+
+def mongo_collections(collection, pipeline):
+    names = {collection}
+
+    def walk(stages):
+        for stage in stages or []:
+            if not isinstance(stage, dict):
+                continue
+            for op in ("$lookup", "$graphLookup", "$unionWith"):
+                spec = stage.get(op)
+                if isinstance(spec, str):
+                    names.add(spec)
+                elif isinstance(spec, dict):
+                    if spec.get("from") or spec.get("coll"):
+                        names.add(spec.get("from") or spec.get("coll"))
+                    walk(spec.get("pipeline"))
+            if "$facet" in stage and isinstance(stage["$facet"], dict):
+                for sub in stage["$facet"].values():
+                    walk(sub)
+
+    walk(pipeline)
+    return names
+
+
+def sql_key(sql, *extra):
+    return ("sql", canonical_sql(sql)) + extra
+
+
+def mongo_key(collection, pipeline, *extra):
+    return ("mongo", collection, json.dumps(pipeline, sort_keys=True, default=str)) + extra
+
+
+def estimate_size(value):
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return len(json.dumps(value, default=str))
+
+
+def _copy(value):
+    # Callers mutate what they get back (df.index += 1, _id -> str), so never hand out the cached object
+    if hasattr(value, "copy") and hasattr(value, "memory_usage"):
+        return value.copy(deep=False)
+    if isinstance(value, list):
+        return [dict(doc) if isinstance(doc, dict) else doc for doc in value]
+    return value
+
+
+class ResultCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (value, tags, size, created)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[3] > self.ttl_seconds:
+                if entry is not None:
+                    self._drop(key)
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return _copy(entry[0])
+
+    def put(self, key, value, tags):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (_copy(value), {t.lower() for t in tags}, size, time.time())
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+        return True
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
+
+    def invalidate(self, *tags):
+        """Drop every entry that read any of ``tags`` (table or collection names)."""
+        wanted = {t.lower() for t in tags}
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] & wanted]
+            for key in stale:
+                self._drop(key)
+            self._stats["invalidations"] += len(stale)
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+@resources.resource
+def get_result_cache():
+    return ResultCache()
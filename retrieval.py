@@ -0,0 +1,77 @@
+import math
+import re
+from collections import Counter
+
+import resources
+
+# --- Lexical retrieval for few-shot prompt selection ---
+# A small in-memory BM25 index over example questions / queries, used to put
+# only the most relevant examples into the generation prompts, plus a rough
+# token estimate for reporting prompt size.
+
+# PROMPT_RETRIEVAL=0 sends the full static prompts instead
+ENABLED = resources.getenv("PROMPT_RETRIEVAL", "1") == "1"
+
+_STOPWORDS = {
+    "the", "a", "an", "of", "in", "on", "for", "to", "and", "or", "is", "are", "with", "by", "at",
+    "me", "give", "show", "list", "find", "what", "which", "how", "all", "that", "this", "be", "as",
+    "it", "do", "does", "their", "there", "have", "having", "i", "you", "can", "please",
+}
+
+
+def tokenize(text):
+    tokens = []
+    for word in re.findall(r"[a-z0-9]+", text.lower().replace("_", " ")):
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if word not in _STOPWORDS:
+            tokens.append(word)
+    return tokens
+
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for budgeting English + JSON/SQL
+    return math.ceil(len(text) / 4)
+
+
+class BM25Index:
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self._tfs = [Counter(tokenize(doc)) for doc in self.documents]
+        self._lengths = [sum(tf.values()) for tf in self._tfs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        df = Counter(term for tf in self._tfs for term in tf)
+        n = len(self.documents)
+        self._idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def scores(self, query):
+        terms = tokenize(query)
+        result = []
+        for tf, length in zip(self._tfs, self._lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self._avg_length) if self._avg_length else self.k1
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self._idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            result.append(score)
+        return result
+
+    def search(self, query, k=3):
+        """Indices of the ``k`` best matching documents (best first), skipping documents that share no term."""
+        ranked = sorted(enumerate(self.scores(query)), key=lambda item: -item[1])
+        return [i for i, score in ranked[:k] if score > 0]
+
+
+def prompt_report(prompt, full_prompt_tokens, **details):
+    tokens = estimate_tokens(prompt)
+    report = {
+        "prompt_tokens": tokens,
+        "full_prompt_tokens": full_prompt_tokens,
+        "saved_tokens": max(0, full_prompt_tokens - tokens),
+        "saved_pct": round(100 * (1 - tokens / full_prompt_tokens), 1) if full_prompt_tokens else 0.0,
+    }
+    report.update(details)
+    return report
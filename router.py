@@ -0,0 +1,162 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+
+from langchain.schema import HumanMessage
+
+import resources
+import tracing
+import maincpy_cleaned
+import sqlrest_cleaned
+
+# --- Local confidence-scored backend router ---
+# Scores a question against the SQL (restaurant/menu/reviews) and MongoDB
+# (listing/review/host) vocabularies built from the prompts, the Mongo schema
+# and sample.txt. Only questions the router is unsure about fall back to an LLM
+# classification call; every decision is memoized per normalized question.
+
+MIN_CONFIDENCE = float(resources.getenv("ROUTER_MIN_CONFIDENCE", "0.5"))
+MIN_EVIDENCE = float(resources.getenv("ROUTER_MIN_EVIDENCE", "1.0"))
+MEMO_SIZE = 2048
+
+# Hand-picked domain words; these outweigh anything learned from the prompt text
+SQL_KEYWORDS = {
+    "restaurant", "menu", "cuisine", "dish", "food", "vegetarian", "vegan", "eat", "dining", "diner",
+    "cafe", "bistro", "kitchen", "pizza", "ramen", "taco", "wifi", "seating", "outdoor", "alcohol",
+    "kid", "delivery", "reservation", "health", "rating", "item", "music", "romantic", "spicy",
+}
+NOSQL_KEYWORDS = {
+    "listing", "housing", "apartment", "house", "home", "rent", "rental", "bedroom", "bathroom",
+    "host", "landlord", "pet", "dog", "cat", "square", "feet", "studio", "amenity", "neighborhood",
+    "lease", "property", "superhost", "cityname",
+}
+KEYWORD_WEIGHT = 2.0
+
+_STOPWORDS = {
+    "the", "a", "an", "of", "in", "on", "for", "to", "and", "or", "is", "are", "with", "by", "at",
+    "me", "give", "show", "list", "find", "what", "which", "how", "many", "all", "top", "that",
+    "this", "from", "be", "as", "it", "do", "does", "their", "them", "there", "have", "having",
+}
+
+
+def tokenize(text):
+    tokens = []
+    for word in re.findall(r"[a-z]+", text.lower()):
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if word not in _STOPWORDS and len(word) > 1:
+            tokens.append(word)
+    return tokens
+
+
+def normalize_question(question):
+    return " ".join(question.lower().split()).rstrip("?.! ")
+
+
+@dataclass
+class RouteDecision:
+    backend: str = None          # "sql", "mongo" or None when the router is not confident
+    confidence: float = 0.0
+    scores: dict = field(default_factory=dict)
+    source: str = "router"       # "router", "llm", "mode"
+
+
+class BackendRouter:
+    def __init__(self, sql_text, mongo_text, min_confidence=MIN_CONFIDENCE, min_evidence=MIN_EVIDENCE):
+        self.min_confidence = min_confidence
+        self.min_evidence = min_evidence
+        self.weights = {"sql": {}, "mongo": {}}
+        sql_tf, mongo_tf = Counter(tokenize(sql_text)), Counter(tokenize(mongo_text))
+        sql_total, mongo_total = sum(sql_tf.values()) or 1, sum(mongo_tf.values()) or 1
+        for term in set(sql_tf) | set(mongo_tf):
+            p_sql, p_mongo = sql_tf[term] / sql_total, mongo_tf[term] / mongo_total
+            share = p_sql / (p_sql + p_mongo)
+            # Only the discriminative part counts: a word equally common on both sides scores 0
+            strength = math.log1p(sql_tf[term] + mongo_tf[term])
+            if share > 0.5:
+                self.weights["sql"][term] = (2 * share - 1) * strength
+            elif share < 0.5:
+                self.weights["mongo"][term] = (1 - 2 * share) * strength
+        for term in SQL_KEYWORDS:
+            self.weights["sql"][term] = max(self.weights["sql"].get(term, 0.0), KEYWORD_WEIGHT)
+            self.weights["mongo"].pop(term, None)
+        for term in NOSQL_KEYWORDS:
+            self.weights["mongo"][term] = max(self.weights["mongo"].get(term, 0.0), KEYWORD_WEIGHT)
+            self.weights["sql"].pop(term, None)
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def score(self, question):
+        tokens = tokenize(question)
+        scores = {
+            backend: sum(weights.get(t, 0.0) for t in tokens)
+            for backend, weights in self.weights.items()
+        }
+        total = scores["sql"] + scores["mongo"]
+        if total < self.min_evidence:
+            return RouteDecision(None, 0.0, scores)
+        best = max(scores, key=scores.get)
+        confidence = abs(scores["sql"] - scores["mongo"]) / total
+        return RouteDecision(best if confidence >= self.min_confidence else None, confidence, scores)
+
+    def route(self, question):
+        key = normalize_question(question)
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+        decision = self.score(question)
+        if decision.backend:
+            self._remember(key, decision)
+        return decision
+
+    def remember(self, question, backend, source="llm"):
+        self._remember(normalize_question(question), RouteDecision(backend, 1.0, {}, source))
+
+    def _remember(self, key, decision):
+        with self._lock:
+            self._memo[key] = decision
+            while len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+
+
+@resources.resource
+def get_router():
+    sql_text = sqlrest_cleaned.prompt[0]
+    mongo_text = maincpy_cleaned.MONGO_SCHEMA + resources.read_text("sample.txt", default="")
+    return BackendRouter(sql_text, mongo_text)
+
+
+def classify_with_llm(query):
+    classification_prompt = f"""
+    The user asked: \"{query}\"
+
+    Decide which database to use to answer this: SQL (for restaurant/menu/reviews) or MongoDB (for housing/listing data/review).
+    Reply with just one word: SQL or MongoDB.
+    """
+    llm = resources.get_openai_llm()
+    with tracing.span("llm", purpose="classify") as span:
+        result = llm.invoke([HumanMessage(content=classification_prompt)]).content.strip().lower()
+        span.tokens(classification_prompt, result)
+    return "mongo" if "mongo" in result else "sql"
+
+
+def detect_backend(query: str, mode: str = "Auto Detect") -> str:
+    """Route to "sql" or "mongo" locally; the LLM is asked only when the router is not confident."""
+    if mode == "Restaurant": return "sql"
+    if mode == "Housing": return "mongo"
+
+    router = get_router()
+    decision = router.route(query)
+    if decision.backend:
+        return decision.backend
+    try:
+        backend = classify_with_llm(query)
+    except Exception:
+        return "unknown"
+    router.remember(query, backend)
+    return backend
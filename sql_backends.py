@@ -0,0 +1,285 @@
+import re
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+import resources
+import sql_pool
+import loader
+from result_cache import sql_tables
+
+# --- Pluggable SQL backends ---
+# read_sql_query runs SELECTs on the backend chosen by SQL_BACKEND:
+#   mysql     the MySQL server in db_config (default)
+#   embedded  an in-process copy of restaurant / menu / reviews in DuckDB (SQLite
+#             when duckdb isn't installed), loaded from the bundled CSVs with the
+#             loader's dtypes and normalization, so reads make no network hop
+# Writes always go to MySQL. SQL_EMBEDDED_SYNC decides how the local copy follows:
+#   replay    re-run each committed write locally (reload the table if that fails)
+#   reload    re-read the written tables from MySQL
+#   off       keep the copy as loaded
+# A table that can't be synced is marked stale and its reads go to MySQL.
+
+BACKEND = resources.getenv("SQL_BACKEND", "mysql")
+EMBEDDED_ENGINE = resources.getenv("SQL_EMBEDDED_ENGINE", "duckdb")
+EMBEDDED_SOURCE = resources.getenv("SQL_EMBEDDED_SOURCE", "csv")  # "csv" or "mysql"
+EMBEDDED_SYNC = resources.getenv("SQL_EMBEDDED_SYNC", "replay")
+# Retry on MySQL when the local engine can't run a statement (MySQL-only syntax, stale table)
+EMBEDDED_FALLBACK = resources.getenv("SQL_EMBEDDED_FALLBACK", "1") == "1"
+
+EMBEDDED_TABLES = [name for name, spec in loader.TABLES.items() if spec.backend == "sql"]
+
+
+class StaleTable(Exception):
+    pass
+
+
+# --- Capped fetching (shared by every backend) ---
+def row_bytes(row):
+    return sum(len(v) if isinstance(v, (str, bytes, bytearray)) else 8 for v in row)
+
+
+def fetch_capped(cur, max_rows, max_bytes, batch_size):
+    """Fetch in batches until ``max_rows`` / ``max_bytes``; returns ``(columns, rows, bytes, more_available)``."""
+    columns = [desc[0] for desc in cur.description]
+    rows, size, more_available = [], 0, False
+    while not more_available:
+        batch = cur.fetchmany(batch_size)
+        if not batch:
+            break
+        for row in batch:
+            if len(rows) >= max_rows or size >= max_bytes:
+                more_available = True
+                break
+            rows.append(tuple(row))
+            size += row_bytes(row)
+    return columns, rows, size, more_available
+
+
+# --- MySQL dialect -> DuckDB / SQLite ---
+_TOKEN_RE = re.compile(r"('(?:[^'\\]|\\.|'')*')|(\"(?:[^\"\\]|\\.|\"\")*\")|(`[^`]*`)")
+_LIMIT_OFFSET_RE = re.compile(r"\bLIMIT\s+(\d+)\s*,\s*(\d+)", re.IGNORECASE)
+_INSERT_IGNORE_RE = re.compile(r"\bINSERT\s+IGNORE\b", re.IGNORECASE)
+_LIKE_RE = re.compile(r"\bLIKE\b", re.IGNORECASE)
+
+
+def _literal(text):
+    return "'" + text.replace("\\'", "'").replace('\\"', '"').replace("''", "'").replace("'", "''") + "'"
+
+
+def to_embedded_sql(sql, engine):
+    """Rewrite the MySQL-only syntax generated queries use: "strings", `names`, LIMIT a, b, INSERT IGNORE."""
+    out = []
+    for part in _TOKEN_RE.split(sql.strip().rstrip(";")):
+        if not part:
+            continue
+        if part.startswith("'") and part.endswith("'") and len(part) > 1:
+            out.append(_literal(part[1:-1]))
+        elif part.startswith('"') and part.endswith('"') and len(part) > 1:
+            # MySQL reads double quotes as a string; both local engines read them as a name
+            out.append(_literal(part[1:-1].replace('""', '"')))
+        elif part.startswith("`") and part.endswith("`") and len(part) > 1:
+            out.append('"' + part[1:-1] + '"')
+        else:
+            part = _LIMIT_OFFSET_RE.sub(r"LIMIT \2 OFFSET \1", part)
+            part = _INSERT_IGNORE_RE.sub("INSERT OR IGNORE", part)
+            if engine == "duckdb":
+                # MySQL's default collation makes LIKE case-insensitive
+                part = _LIKE_RE.sub("ILIKE", part)
+            out.append(part)
+    return "".join(out)
+
+
+def _concat(*values):
+    return None if any(v is None for v in values) else "".join(str(v) for v in values)
+
+
+def _regexp(pattern, value):
+    return value is not None and re.search(pattern, str(value), re.IGNORECASE) is not None
+
+
+# --- Backends ---
+class MySQLBackend:
+    name = "mysql"
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+
+    def read(self, sql, max_rows, max_bytes, batch_size, timeout_ms=None):
+        with sql_pool.get_pool(self.db_config).connection(timeout_ms=timeout_ms) as conn:
+            cur = conn.cursor(buffered=False)
+            cur.execute(sql)
+            result = fetch_capped(cur, max_rows, max_bytes, batch_size)
+            if not result[3]:
+                cur.close()
+        return result
+
+
+class EmbeddedBackend:
+    name = "embedded"
+
+    def __init__(self, engine=EMBEDDED_ENGINE, db_config=None, source=EMBEDDED_SOURCE):
+        self.db_config = db_config
+        self.engine = engine
+        self.stale = set()
+        self.load_seconds = {}
+        self._lock = threading.RLock()
+        if engine == "duckdb":
+            try:
+                duckdb = resources.optional_module("duckdb")
+            except ImportError:
+                self.engine = "sqlite"
+        if self.engine == "duckdb":
+            self.con = duckdb.connect(":memory:")
+            self.con.execute("SET default_collation = 'nocase'")
+        else:
+            self.con = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+            self.con.create_function("CONCAT", -1, _concat, deterministic=True)
+            self.con.create_function("REGEXP", 2, _regexp, deterministic=True)
+        for table in EMBEDDED_TABLES:
+            self.load(table, source)
+
+    def _frames(self, table, source):
+        spec = loader.TABLES[table]
+        if source == "mysql":
+            with sql_pool.get_pool(self.db_config).connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute(f"SELECT * FROM `{table}`")
+                    yield pd.DataFrame(cur.fetchall(), columns=[desc[0] for desc in cur.description])
+                finally:
+                    cur.close()
+            return
+        for chunk in loader.read_chunks(spec):
+            yield loader.normalize(chunk, spec)
+
+    def _insert(self, table, frame):
+        columns = ", ".join(f'"{c}"' for c in frame.columns)
+        # Duplicate keys are skipped like the loader's INSERT IGNORE (DuckDB only allows OR IGNORE with a key)
+        verb = "INSERT OR IGNORE" if loader.TABLES[table].key else "INSERT"
+        if self.engine == "duckdb":
+            self.con.register("_incoming", frame)
+            try:
+                self.con.execute(f"{verb} INTO {table} ({columns}) SELECT {columns} FROM _incoming")
+            finally:
+                self.con.unregister("_incoming")
+        else:
+            placeholders = ", ".join("?" * len(frame.columns))
+            self.con.executemany(f"{verb} INTO {table} ({columns}) VALUES ({placeholders})",
+                                 loader.records(frame))
+
+    def load(self, table, source="csv"):
+        """(Re)build one table from the CSV or from MySQL in a single transaction; returns the row count."""
+        started = time.perf_counter()
+        ddl = loader.SQL_DDL[table].replace("IF NOT EXISTS ", "")
+        if self.engine == "sqlite":
+            ddl = re.sub(r"\bTEXT\b", "TEXT COLLATE NOCASE", ddl)
+        rows = 0
+        with self._lock:
+            # Readers keep seeing the old table until the new one is committed
+            self.con.execute("BEGIN")
+            try:
+                self.con.execute(f"DROP TABLE IF EXISTS {table}")
+                self.con.execute(ddl)
+                for frame in self._frames(table, source):
+                    self._insert(table, frame)
+                    rows += len(frame)
+                self.con.execute("COMMIT")
+            except Exception:
+                self.con.execute("ROLLBACK")
+                raise
+        self.stale.discard(table)
+        self.load_seconds[table] = round(time.perf_counter() - started, 3)
+        return rows
+
+    def read(self, sql, max_rows, max_bytes, batch_size, timeout_ms=None):
+        stale = sql_tables(sql) & self.stale
+        if stale:
+            raise StaleTable(f"Local copy of {', '.join(sorted(stale))} is out of sync")
+        local_sql = to_embedded_sql(sql, self.engine)
+        if self.engine == "duckdb":
+            cur = self.con.cursor()
+            timer = threading.Timer(timeout_ms / 1000, cur.interrupt) if timeout_ms else None
+            if timer:
+                timer.start()
+            try:
+                cur.execute(local_sql)
+                return fetch_capped(cur, max_rows, max_bytes, batch_size)
+            finally:
+                if timer:
+                    timer.cancel()
+                cur.close()
+        # One SQLite connection is shared, so statements take turns
+        with self._lock:
+            if timeout_ms:
+                expires = time.monotonic() + timeout_ms / 1000
+                self.con.set_progress_handler(lambda: time.monotonic() > expires, 10000)
+            cur = self.con.cursor()
+            try:
+                cur.execute(local_sql)
+                return fetch_capped(cur, max_rows, max_bytes, batch_size)
+            finally:
+                cur.close()
+                self.con.set_progress_handler(None, 0)
+
+    def apply_write(self, sql, sync=EMBEDDED_SYNC):
+        """Mirror a write MySQL has committed, per ``sync``."""
+        tables = sql_tables(sql) & set(EMBEDDED_TABLES)
+        if sync == "off" or not tables:
+            return
+        if sync == "replay":
+            try:
+                with self._lock:
+                    self.con.execute(to_embedded_sql(sql, self.engine))
+                return
+            except Exception:
+                pass  # MySQL-only syntax or a diverged copy: fall back to a reload
+        for table in tables:
+            try:
+                self.load(table, "mysql")
+            except Exception:
+                self.stale.add(table)
+
+    def metrics(self):
+        return {"engine": self.engine, "sync": EMBEDDED_SYNC, "load_seconds": dict(self.load_seconds),
+                "stale_tables": sorted(self.stale)}
+
+
+@resources.resource
+def _embedded_for(engine, config_items):
+    return EmbeddedBackend(engine, dict(config_items))
+
+
+def get_backend(db_config, name=None):
+    """Backend instance for ``name`` (default SQL_BACKEND); the embedded copy is built once per process."""
+    if (name or BACKEND) == "embedded":
+        return _embedded_for(EMBEDDED_ENGINE, tuple(sorted(db_config.items())))
+    return MySQLBackend(db_config)
+
+
+def read(sql, db_config, max_rows, max_bytes, batch_size, timeout_ms=None):
+    """Run a SELECT on the configured backend; returns ``(backend_name, columns, rows, bytes, more_available)``."""
+    if BACKEND == "embedded":
+        try:
+            return ("embedded",) + get_backend(db_config).read(sql, max_rows, max_bytes, batch_size, timeout_ms)
+        except Exception:
+            if not EMBEDDED_FALLBACK:
+                raise
+    return ("mysql",) + MySQLBackend(db_config).read(sql, max_rows, max_bytes, batch_size, timeout_ms)
+
+
+def sync_write(sql, db_config):
+    """Bring the embedded copy up to date after a committed MySQL write (no-op for the mysql backend)."""
+    if BACKEND == "embedded":
+        get_backend(db_config).apply_write(sql)
+
+
+def metrics(db_config):
+    if BACKEND != "embedded":
+        return {"backend": BACKEND}
+    try:
+        return dict(get_backend(db_config).metrics(), backend=BACKEND)
+    except Exception as e:
+        return {"backend": BACKEND, "error": str(e)}
@@ -0,0 +1,171 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+
+import resources
+
+# --- Bounded MySQL connection pool ---
+# One pool per db_config is shared by every Streamlit session (see get_pool).
+# Connections are health-checked on checkout, queries get a per-statement
+# timeout, and the pool keeps simple metrics for the UI.
+
+DEFAULT_POOL_SIZE = int(resources.getenv("SQL_POOL_SIZE", "5"))
+DEFAULT_CHECKOUT_TIMEOUT = float(resources.getenv("SQL_POOL_CHECKOUT_TIMEOUT", "10"))
+DEFAULT_QUERY_TIMEOUT_MS = int(resources.getenv("SQL_QUERY_TIMEOUT_MS", "15000"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, db_config, size=DEFAULT_POOL_SIZE, checkout_timeout=DEFAULT_CHECKOUT_TIMEOUT,
+                 query_timeout_ms=DEFAULT_QUERY_TIMEOUT_MS):
+        self.db_config = dict(db_config)
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.query_timeout_ms = query_timeout_ms
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._metrics = {
+            "created": 0,
+            "in_use": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "discarded": 0,
+            "checkout_seconds_total": 0.0,
+            "checkout_seconds_max": 0.0,
+        }
+
+    def _connect(self):
+        conn = mysql.connector.connect(
+            host=self.db_config["host"],
+            user=self.db_config["user"],
+            password=self.db_config["password"],
+            database=self.db_config["database"],
+            connection_timeout=max(1, int(self.checkout_timeout)),
+        )
+        with self._lock:
+            self._metrics["created"] += 1
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def checkout(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._metrics["waits"] += 1
+            if not self._slots.acquire(timeout=timeout):
+                with self._lock:
+                    self._metrics["timeouts"] += 1
+                raise PoolTimeout(f"No MySQL connection available within {timeout}s (pool size {self.size})")
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    candidate = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._connect()
+                    break
+                if self._healthy(candidate):
+                    conn = candidate
+                else:
+                    self._close(candidate)
+                    with self._lock:
+                        self._metrics["discarded"] += 1
+        except Exception:
+            self._slots.release()
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._metrics["in_use"] += 1
+            self._metrics["checkouts"] += 1
+            self._metrics["checkout_seconds_total"] += elapsed
+            self._metrics["checkout_seconds_max"] = max(self._metrics["checkout_seconds_max"], elapsed)
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return ``conn`` to the pool; broken or half-read connections should be discarded."""
+        try:
+            if discard:
+                self._close(conn)
+                with self._lock:
+                    self._metrics["discarded"] += 1
+            else:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                self._idle.put(conn)
+        finally:
+            with self._lock:
+                self._metrics["in_use"] -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout_ms=None):
+        """Check out a connection with a per-query timeout applied; always released, even on errors."""
+        conn = self.checkout()
+        discard = False
+        try:
+            self.set_query_timeout(conn, self.query_timeout_ms if timeout_ms is None else timeout_ms)
+            yield conn
+            # A streaming read that stopped early leaves rows on the wire; drop the
+            # connection rather than draining a possibly huge result set
+            discard = bool(getattr(conn, "unread_result", False))
+        except Exception:
+            discard = not self._healthy(conn)
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def set_query_timeout(self, conn, timeout_ms):
+        # MAX_EXECUTION_TIME makes the server abort read-only SELECTs that run too long
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SET SESSION MAX_EXECUTION_TIME = {int(timeout_ms)}")
+        finally:
+            cur.close()
+
+    def metrics(self):
+        with self._lock:
+            m = dict(self._metrics)
+        m["size"] = self.size
+        m["idle"] = self._idle.qsize()
+        m["checkout_seconds_avg"] = m["checkout_seconds_total"] / m["checkouts"] if m["checkouts"] else 0.0
+        return m
+
+    def close_all(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+@resources.resource
+def _pool_for(config_items):
+    return ConnectionPool(dict(config_items))
+
+
+def get_pool(db_config):
+    """Process-wide pool for ``db_config``, shared across Streamlit sessions."""
+    return _pool_for(tuple(sorted(db_config.items())))
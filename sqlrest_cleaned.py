@@ -1,23 +1,36 @@
-import os
-import google.generativeai as genai
-import mysql.connector
-from dotenv import load_dotenv
+import functools
+import re
 import pandas as pd
 
-# Load environment variables    
-load_dotenv()
-
-# Configure Genai Key
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+import resources
+import retrieval
+import sql_pool
+import sql_backends
+import query_cache
+import result_cache
+import templates
+import index_advisor
+import compaction
+import tracing
+import bulk_writes
+import pagination
+import pipeline
+import text_search
+from result_cache import sql_tables
 
 # MySQL database configuration
 db_config = {
-    "host": os.getenv("DB_HOST", "localhost"),
-    "user": os.getenv("DB_USER", "root"),
-    "password": os.getenv("DB_PASSWORD", ""),
-    "database": os.getenv("DB_NAME", "chatbot")
+    "host": resources.getenv("DB_HOST", "localhost"),
+    "user": resources.getenv("DB_USER", "root"),
+    "password": resources.getenv("DB_PASSWORD", ""),
+    "database": resources.getenv("DB_NAME", "chatbot")
 }
 
+# Result size caps for SELECTs (rows beyond these are not fetched)
+SQL_MAX_ROWS = int(resources.getenv("SQL_MAX_ROWS", "1000"))
+SQL_MAX_BYTES = int(resources.getenv("SQL_MAX_BYTES", str(8 * 1024 * 1024)))
+SQL_FETCH_BATCH = int(resources.getenv("SQL_FETCH_BATCH", "200"))
+
 # Define Your Prompt
 prompt = ["""You are an expert in converting English questions into SQL queries.
 The SQL database contains tables such as "restaurant", "menu", and "reviews" with the following schema:
@@ -98,45 +111,224 @@ For example:
 🚫 Incorrect: SELECT * FROM restaurant WHERE has_outdoor_seating = TRUE;
 🚫 Incorrect: SELECT * FROM menu WHERE is_vegetarian = TRUE;
 
+-- ✅ Menu Photos:
+When the user asks for photos, pictures or images of dishes or menu items, include m.image_url in the SELECT.
+
 Do not generate any output that is unrelated to the defined restaurant, menu, reviews tables. Only provide SQL queries based on the schemas above.
 Always return only the SQL query without triple backticks or the word SQL.
 """]
 
-def get_gemini_response(question, prompt):
-    model = genai.GenerativeModel('gemini-2.0-flash')
-    response = model.generate_content([prompt[0], question])
-    return response.text.strip()
+# Few-shot retrieval: only the closest sample queries and the tables the
+# question needs go into the Gemini prompt
+SQL_PROMPT_EXAMPLES = int(resources.getenv("SQL_PROMPT_EXAMPLES", "3"))
+
+_TABLE_WORDS = {
+    "menu": {"menu", "menus", "item", "items", "dish", "dishes", "food", "vegetarian", "veg", "price", "prices",
+             "cost", "cheap", "cheapest", "expensive", "usd", "image", "images", "picture", "pictures"},
+    "reviews": {"review", "reviews", "rating", "ratings", "rated", "tag", "tags", "romantic", "quiet", "spicy",
+                "family", "dessert", "quick", "stars", "best", "customer", "customers"},
+}
+_SQL_WRITE = r"\b(add|insert|create|update|change|modify|set|delete|remove)\b"
+
+
+@functools.lru_cache(maxsize=4)
+def _sql_prompt_parts(text):
+    head, rest = text.split("-- ✅ Schema Exploration:", 1)
+    intro, tables_text = head.split("restaurant:\n", 1)
+    tables = {}
+    for block in ("restaurant:\n" + tables_text).strip().split("\n\n"):
+        tables[block.split(":", 1)[0]] = block.strip() + "\n\n"
+    samples_text = rest.split("-- ✅ Sample Queries:", 1)[1].split("-- ✅ Data Modification:", 1)[0]
+    samples = [line.strip() for line in samples_text.strip().splitlines() if line.strip()]
+    modification = "-- ✅ Data Modification:" + rest.split("-- ✅ Data Modification:", 1)[1].split("-- ✅ Boolean Fields Handling:", 1)[0]
+    tail = "-- ✅ Boolean Fields Handling:" + rest.split("-- ✅ Boolean Fields Handling:", 1)[1]
+    return intro, tables, samples, modification, tail, retrieval.BM25Index(samples)
+
+
+def build_sql_prompt(question, prompt=prompt, max_examples=SQL_PROMPT_EXAMPLES):
+    """Return ``([prompt_text], report)`` with only the relevant tables and the top-k sample queries."""
+    full_tokens = retrieval.estimate_tokens(prompt[0] + question)
+    try:
+        intro, tables, samples, modification, tail, index = _sql_prompt_parts(prompt[0])
+    except (ValueError, IndexError):
+        # Prompt no longer has the expected sections: send it whole
+        return prompt, retrieval.prompt_report(prompt[0] + question, full_tokens, retrieval=False)
+    if not retrieval.ENABLED:
+        return prompt, retrieval.prompt_report(prompt[0] + question, full_tokens, retrieval=False)
+
+    chosen = index.search(question, k=max_examples) or list(range(min(2, len(samples))))
+    words = set(re.findall(r"[a-z]+", question.lower()))
+    needed = {"restaurant"} | {table for table, vocab in _TABLE_WORDS.items() if vocab & words}
+    for i in chosen:
+        needed |= sql_tables(samples[i])
+    writing = re.search(_SQL_WRITE, question.lower()) is not None
+    text = (intro
+            + "".join(block for name, block in tables.items() if name in needed)
+            + "-- ✅ Sample Queries:\n" + "\n".join(samples[i] for i in chosen) + "\n\n"
+            + (modification if writing else "")
+            + tail)
+    return [text], retrieval.prompt_report(
+        text + question, full_tokens, retrieval=True, examples=[samples[i] for i in chosen],
+        tables=sorted(t for t in tables if t in needed))
+
+
+def _translate(question, llm_prompt, src_hash, model_name):
+    # Gemini is configured and the model handle built once per process;
+    # repeated questions are answered from the persistent translation cache
+    def generate():
+        model = resources.get_gemini_model(model_name)
+        with tracing.span("llm", purpose="sql_generate", model=model_name) as span:
+            response = model.generate_content([llm_prompt[0], question],
+                                              request_options={"timeout": resources.LLM_REQUEST_TIMEOUT_S})
+            usage = getattr(response, "usage_metadata", None)
+            span.tokens(llm_prompt[0] + question, response.text,
+                        usage and (usage.prompt_token_count, usage.candidates_token_count))
+        return response.text.strip()
+
+    return query_cache.get_translation_cache().get_or_create("sql", model_name, src_hash, question, generate)
+
+def _llm_sql(question, prompt, model_name):
+    # The one place the cache key is built, so every caller shares the same entries
+    llm_prompt, report = build_sql_prompt(question, prompt)
+    # MATCH ... AGAINST guidance only when the FULLTEXT indexes exist
+    guideline = text_search.sql_prompt_guideline(db_config)
+    if guideline:
+        llm_prompt = [llm_prompt[0] + guideline]
+    sql, hit = _translate(question, llm_prompt, query_cache.source_hash(prompt[0], retrieval.ENABLED, guideline),
+                          model_name)
+    report["sent_to_llm"] = not hit
+    return sql, hit, report
+
+def get_gemini_response(question, prompt=prompt, model_name='gemini-2.0-flash'):
+    """The cached or Gemini translation of ``question`` (templates are skipped); ``generate_sql`` adds them and the report."""
+    sql, _, _ = _llm_sql(question, prompt, model_name)
+    return sql
+
+def generate_sql(question, prompt=prompt, model_name='gemini-2.0-flash'):
+    """Return ``(sql, path, prompt_report)``: a filled template when the question matches one, else the cached or Gemini translation."""
+    with templates.timed_path("sql") as timer:
+        match = templates.match(question, "sql")
+        if match:
+            timer.path = "template"
+            return match.query, f"template:{match.template}", None
+        sql, hit, report = _llm_sql(question, prompt, model_name)
+        timer.path = "cache" if hit else "llm"
+        return sql, timer.path, report
 
 def execute_sql_query(sql, db_config):
+    """Run a write script in one transaction; consecutive literal INSERTs are batched through executemany."""
     try:
-        conn = mysql.connector.connect(
-            host=db_config["host"],
-            user=db_config["user"],
-            password=db_config["password"],
-            database=db_config["database"]
-        )
-        cur = conn.cursor()
-        cur.execute(sql)
-        conn.commit()
-        conn.close()
-        return True, "Query executed successfully."
+        statements = bulk_writes.split_statements(sql)
+        batches = bulk_writes.plan_sql(sql)
+        for statement in statements:
+            index_advisor.record_sql(statement)
+        affected = 0
+        with tracing.span("db.sql_write", statements=len(statements), batches=len(batches)) as span, \
+                sql_pool.get_pool(db_config).connection() as conn:
+            cur = conn.cursor()
+            try:
+                for batch in batches:
+                    if batch[0] == "many":
+                        cur.executemany(batch[1], batch[2])
+                    else:
+                        cur.execute(batch[1])
+                    affected += max(cur.rowcount, 0)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+            span.set(rows_affected=affected)
+        # Only cached results that read the written tables are dropped
+        result_cache.get_result_cache().invalidate(*sql_tables(sql))
+        text_search.invalidate(*sql_tables(sql))
+        for statement in statements:
+            sql_backends.sync_write(statement, db_config)
+        return True, f"Query executed successfully, {affected} row(s) affected."
     except Exception as e:
         return False, f"Error executing query: {e}"
 
-def read_sql_query(sql, db_config):
-    try:
-        conn = mysql.connector.connect(
-            host=db_config["host"],
-            user=db_config["user"],
-            password=db_config["password"],
-            database=db_config["database"]
-        )
-        cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        df = pd.DataFrame(rows, columns=columns)
-        conn.close()
-        return df
-    except Exception as e:
-        return pd.DataFrame(), f"Error: {e}"
+def preview_sql_write(sql, db_config):
+    """Dry run of a write script: ``(statement, rows it would touch or None)`` per statement."""
+    previews = []
+    for statement, count in bulk_writes.count_queries(sql):
+        if isinstance(count, str):
+            df = read_sql_query(count, db_config)
+            count = int(df.iat[0, 0]) if isinstance(df, pd.DataFrame) and not df.empty else None
+        previews.append((statement, count))
+    return previews
+
+def read_sql_query(sql, db_config, max_rows=None, max_bytes=None, batch_size=None, timeout_ms=None):
+    """Stream a SELECT from the SQL_BACKEND backend, stopping once the row or byte cap is reached.
+
+    The returned DataFrame carries ``attrs["more_available"]`` when rows were left unread.
+    ``timeout_ms`` overrides the pool's MAX_EXECUTION_TIME for this statement.
+    """
+    max_rows = SQL_MAX_ROWS if max_rows is None else max_rows
+    max_bytes = SQL_MAX_BYTES if max_bytes is None else max_bytes
+    batch_size = SQL_FETCH_BATCH if batch_size is None else batch_size
+    cache = result_cache.get_result_cache()
+    cache_key = result_cache.sql_key(sql, db_config["host"], db_config["database"], max_rows, max_bytes)
+    with tracing.span("db.sql") as span:
+        cached = cache.get(cache_key)
+        span.set(result_cache="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+        try:
+            index_advisor.record_sql(sql)
+            backend, columns, rows, size, more_available = sql_backends.read(
+                sql, db_config, max_rows, max_bytes, batch_size, timeout_ms)
+            span.set(backend=backend, rows=len(rows), bytes=size, more_available=more_available)
+            df = pd.DataFrame(rows, columns=columns)
+            df.attrs["more_available"] = more_available
+            df.attrs["bytes_fetched"] = size
+            df.attrs["sql_backend"] = backend
+            cache.put(cache_key, df, sql_tables(sql))
+            return df
+        except Exception as e:
+            span.set(error=f"{type(e).__name__}: {e}")
+            tracing.record_error(e)
+            return pd.DataFrame(), f"Error: {e}"
+
+def read_sql_page(sql, db_config, offset, limit, with_total=False, timeout_ms=None):
+    """One page of a SELECT and, with ``with_total``, its row count from a COUNT(*) run alongside.
+
+    Returns ``(DataFrame, total or None)``; the total is None when the count fails
+    (MySQL rejects derived tables with duplicate column names) or times out.
+    """
+    count_future = None
+    if with_total:
+        count_future = pipeline.get_executor().submit(
+            read_sql_query, pagination.count_sql(sql), db_config, timeout_ms=timeout_ms)
+    df = read_sql_query(pagination.page_sql(sql, offset, limit), db_config, max_rows=limit, timeout_ms=timeout_ms)
+    if isinstance(df, tuple):
+        raise RuntimeError(df[1])
+    total = None
+    if count_future is not None:
+        try:
+            counted = count_future.result(timeout=timeout_ms / 1000 if timeout_ms else None)
+            if isinstance(counted, pd.DataFrame) and not counted.empty:
+                total = int(counted.iat[0, 0])
+        except Exception:
+            pass
+    return df, total
+
+def sql_summary_prompt(question, df, total=None):
+    """Summary prompt over a token-budgeted compaction of ``df``; ``(None, None)`` when there is nothing to summarize.
+
+    ``total`` is the full row count when ``df`` is only the first page of the result.
+    """
+    if df.empty:
+        return None, None
+    results_text, report = compaction.compact_results(df)
+    if total is not None and total > len(df):
+        results_text = f"(first {len(df)} of {total} rows)\n{results_text}"
+    summary_prompt = f"""You are a helpful assistant. \nUser asked: \"{question}\"\nHere are the SQL results:\n{results_text}\nExplain this in plain English."""
+    return summary_prompt, compaction.finish_report(report, summary_prompt)
+
+def pool_metrics(db_config):
+    return sql_pool.get_pool(db_config).metrics()
+
+def backend_metrics(db_config):
+    return sql_backends.metrics(db_config)
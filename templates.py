@@ -0,0 +1,462 @@
+import csv
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+import resources
+import text_search
+
+# --- Template fast path ---
+# Common question shapes ("top 5 restaurants in Florida", "how many 2-bedroom
+# apartments are in Washington DC?") are answered by filling a parameterized
+# SQL / aggregation template instead of calling an LLM. Entities are matched
+# against value dictionaries built from the actual data, and a template only
+# fires when every word of the question is accounted for; anything it cannot
+# fully explain falls through to the LLM generator. Descriptive words ("quiet
+# apartments", "hosts who love dogs") go through text_search.
+
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas", "CA": "California",
+    "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware", "DC": "District of Columbia",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho", "IL": "Illinois",
+    "IN": "Indiana", "IA": "Iowa", "KS": "Kansas", "KY": "Kentucky", "LA": "Louisiana",
+    "ME": "Maine", "MD": "Maryland", "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota",
+    "MS": "Mississippi", "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma", "OR": "Oregon",
+    "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina", "SD": "South Dakota",
+    "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia",
+    "WA": "Washington", "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming",
+}
+STATE_ABBREVIATIONS = {name.lower(): abbr for abbr, name in US_STATES.items()}
+
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+                "eight": 8, "nine": 9, "ten": 10, "twenty": 20}
+_NUM = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+
+_WRITE_VERBS = r"\b(add|insert|create|update|change|modify|set|delete|remove|drop|take down)\b"
+
+# Yes/No restaurant columns and the phrases that ask for them
+SQL_FEATURES = {
+    "outdoor seating": "has_outdoor_seating", "outdoor": "has_outdoor_seating",
+    "wifi": "has_wifi", "wi-fi": "has_wifi", "wi fi": "has_wifi",
+    "kids menu": "has_kids_menu", "kid menu": "has_kids_menu", "kids menus": "has_kids_menu",
+    "parking": "parking_available", "delivery": "delivery_available", "deliver": "delivery_available",
+    "alcohol": "alcohol_served", "reservation": "reservation_required", "reservations": "reservation_required",
+}
+# Extra restaurant columns a question can ask to see
+SQL_COLUMNS = {
+    "phone number": "phone_number", "phone numbers": "phone_number", "phone": "phone_number",
+    "email": "email", "emails": "email", "address": "address", "addresses": "address",
+    "cuisine": "cuisine", "timings": "opening_hours", "timing": "opening_hours",
+    "opening hours": "opening_hours", "hours": "opening_hours", "city": "city", "state": "state",
+}
+
+SQL_FILLER = {
+    "give", "me", "show", "list", "find", "get", "all", "the", "a", "an", "of", "in", "with", "having",
+    "have", "has", "that", "which", "what", "are", "is", "restaurant", "restaurants", "name", "names",
+    "places", "place", "serve", "serving", "serves", "offer", "offers", "offering", "accept", "accepts",
+    "accepting", "and", "please", "some", "any", "located", "for", "their", "its", "whose", "can", "i",
+    "pay", "using", "by", "to", "do", "does", "available", "options", "option", "there",
+}
+# Words that rank or size listings rather than describe them: never sent to a text search
+NON_TEXT_WORDS = {
+    "cheap", "cheaper", "expensive", "affordable", "big", "bigger", "biggest", "small", "smaller", "smallest",
+    "large", "larger", "largest", "new", "newer", "newest", "latest", "recent", "old", "oldest", "best", "good",
+    "nice", "top", "more", "most", "other", "many", "similar", "different", "random", "total", "number",
+}
+MONGO_FILLER = {
+    "give", "me", "show", "list", "find", "get", "all", "the", "a", "an", "of", "in", "with", "are",
+    "is", "there", "what", "which", "available", "for", "rent", "please", "any", "some", "and",
+    "located", "that", "do", "does", "have", "has", "i", "can", "each", "per", "month", "monthly",
+    "apartment", "apartments", "listing", "listings", "home", "homes", "rental", "rentals", "unit",
+    "units", "place", "places", "property", "properties", "housing", "price", "prices", "rent",
+}
+
+
+@dataclass
+class TemplateMatch:
+    backend: str                 # "sql" or "mongo"
+    template: str                # name of the template that fired
+    query: object                # SQL text or aggregation pipeline (list of stages)
+    entities: dict = field(default_factory=dict)
+
+    def query_text(self):
+        return self.query if isinstance(self.query, str) else json.dumps(self.query, indent=2)
+
+
+class _Question:
+    """Lower-cased question text whose matched spans are blanked out as entities are extracted."""
+
+    def __init__(self, question):
+        self.original = " " + question.strip() + " "
+        self.text = self.original.lower()
+        if len(self.text) != len(self.original):
+            self.original = self.text
+
+    def _blank(self, start, end):
+        self.text = self.text[:start] + " " * (end - start) + self.text[end:]
+
+    def take(self, pattern):
+        m = re.search(pattern, self.text)
+        if m:
+            self._blank(m.start(), m.end())
+        return m
+
+    def take_value(self, values):
+        """Consume the longest known value (``{lowercase: canonical}``) found as a whole phrase."""
+        for low in sorted(values, key=len, reverse=True):
+            if low not in self.text:
+                continue
+            m = self.take(r"(?<![a-z0-9])" + re.escape(low) + r"(?![a-z0-9])")
+            if m:
+                return values[low]
+        return None
+
+    def take_state_abbreviation(self):
+        # Only upper-case two-letter codes count ("in NY"), so words like "in" or "or" never match
+        for m in re.finditer(r"\b([A-Z]{2})\b", self.original):
+            if m.group(1) in US_STATES and self.text[m.start():m.end()].strip():
+                self._blank(m.start(), m.end())
+                return m.group(1)
+        return None
+
+    def leftover(self, filler):
+        return [t for t in re.findall(r"[a-z0-9$]+", self.text) if t not in filler]
+
+
+def _to_int(token):
+    return NUMBER_WORDS.get(token, None) if not token.isdigit() else int(token)
+
+
+def _q(value):
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+# --- Value dictionaries built from the data ---
+def _read_csv(name):
+    path = os.path.join(resources.BASE_DIR, name)
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+
+@resources.resource
+def sql_values():
+    restaurants = _read_csv("restaurant.csv")
+    reviews = _read_csv("review.csv")
+    payments = set()
+    for row in restaurants:
+        for method in row.get("payment_methods", "").split(","):
+            method = method.replace("Only", "").strip()
+            if method and method != "All Methods":
+                payments.add(method)
+    return {
+        "city": {r["city"].lower(): r["city"] for r in restaurants if r.get("city")},
+        "state": {r["state"].lower(): r["state"] for r in restaurants if r.get("state")},
+        "cuisine": {r["cuisine"].lower(): r["cuisine"] for r in restaurants if r.get("cuisine")},
+        "restaurant_name": {r["restaurant_name"].lower(): r["restaurant_name"] for r in restaurants if r.get("restaurant_name")},
+        "payment": {p.lower(): p for p in payments},
+        "tag": {t.strip().lower(): t.strip() for r in reviews for t in r.get("tags", "").split(",") if t.strip()},
+    }
+
+
+@resources.resource
+def mongo_values():
+    cities, states = {}, {}
+    # Seed from sample.txt so the matcher works even before the cluster is reachable
+    sample = resources.read_text("sample.txt", default="")
+    for city in re.findall(r'"cityname":\s*"([^"]+)"', sample):
+        cities[city.lower()] = city
+    for state in re.findall(r'"state":\s*"([^"]+)"', sample):
+        states[state.lower()] = state
+    try:
+        listing = resources.get_collection("listing")
+        for city in listing.distinct("cityname", maxTimeMS=5000):
+            if isinstance(city, str) and city:
+                cities[city.lower()] = city
+        for state in listing.distinct("state", maxTimeMS=5000):
+            if isinstance(state, str) and state:
+                states[state.lower()] = state
+    except Exception:
+        pass
+    return {"city": cities, "state": states}
+
+
+# --- SQL templates (restaurant / reviews) ---
+def match_sql(question):
+    q = _Question(question)
+    if q.take(_WRITE_VERBS) or not re.search(r"\b(restaurants?|places?)\b", q.text):
+        return None
+    values = sql_values()
+    entities = {}
+
+    m = q.take(r"\b(top|first|last)\s+" + _NUM + r"\b")
+    if m:
+        entities["order"], entities["n"] = m.group(1), _to_int(m.group(2))
+    else:
+        m = q.take(r"\b" + _NUM + r"\b(?=\s+(?:\w+\s+)?(?:restaurants?|places?)\b)")
+        if m:
+            entities["n"] = _to_int(m.group(1))
+
+    name = q.take_value(values["restaurant_name"])
+    columns = []
+    while True:
+        column = q.take_value(SQL_COLUMNS)
+        if not column:
+            break
+        if column not in columns:
+            columns.append(column)
+    features = []
+    while True:
+        feature = q.take_value(SQL_FEATURES)
+        if not feature:
+            break
+        features.append(feature)
+    payment = q.take_value(values["payment"])
+    cuisine = q.take_value(values["cuisine"])
+    tag = q.take_value(values["tag"])
+    city = q.take_value(values["city"])
+    state = q.take_state_abbreviation()
+    state = US_STATES.get(state) if state else q.take_value(values["state"])
+    mention = q.take(r"\breviews?\s+(?:that\s+|which\s+)?(?:mention|mentions|mentioning|say|says|saying|about)\s+"
+                     r"([a-z][a-z\s'-]*?)\s*$")
+    review_text = text_search.sql_review_text_condition(mention.group(1)) if mention else None
+    if mention and review_text is None:
+        return None
+
+    if q.leftover(SQL_FILLER):
+        return None
+
+    select = ["r.restaurant_name"] + [f"r.{c}" for c in columns]
+    where, joins, order = [], "", ""
+    if name:
+        where.append(f"r.restaurant_name = {_q(name)}")
+        entities["restaurant_name"] = name
+    for feature in features:
+        where.append(f"r.{feature} = 'yes'")
+    if payment:
+        where.append(f"(r.payment_methods LIKE {_q('%' + payment + '%')} OR r.payment_methods = 'All Methods')")
+    if cuisine:
+        where.append(f"r.cuisine = {_q(cuisine)}")
+    if city:
+        where.append(f"r.city = {_q(city)}")
+    if state:
+        where.append(f"r.state = {_q(state)}")
+    if tag or review_text:
+        joins = " JOIN reviews v ON r.restaurant_id = v.restaurant_id"
+        if tag:
+            where.append(text_search.sql_tag_condition(tag))
+        order = " ORDER BY v.rating DESC"
+        if review_text:
+            where.append(review_text)
+            entities["review_text"] = " ".join(mention.group(1).split())
+            rank = text_search.sql_review_text_rank(entities["review_text"])
+            if rank:
+                order = f" ORDER BY {rank}, v.rating DESC"
+    elif entities.get("order") == "last":
+        order = " ORDER BY r.restaurant_id DESC"
+    entities.update({k: v for k, v in {"columns": columns, "features": features, "payment": payment,
+                                         "cuisine": cuisine, "tag": tag, "city": city, "state": state}.items() if v})
+
+    sql = f"SELECT {', '.join(select)} FROM restaurant r{joins}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += order
+    if entities.get("n"):
+        sql += f" LIMIT {int(entities['n'])}"
+    sql += ";"
+    template = ("restaurant_details" if name else "restaurants_by_tag" if tag
+                else "restaurants_by_review_text" if review_text else "restaurant_list")
+    return TemplateMatch("sql", template, sql, entities)
+
+
+# --- MongoDB templates (listing) ---
+_LIST_PROJECTION = {"title": 1, "address": 1, "cityname": 1, "state": 1, "price": 1,
+                    "bedrooms": 1, "bathrooms": 1, "square_feet": 1, "_id": 0}
+_LISTING_NOUNS = r"(?:apartments?|listings?|homes?|rentals?|units?|places?|propert(?:y|ies)|housing)"
+_TEXT_CUE = (r"\b(?:described as|describing|mentioning|that mentions?|which mentions?|featuring|with the words?)\s+"
+             r"([a-z][a-z\s'-]*?)\s*$")
+
+
+def _take_listing_text(q):
+    """Descriptive words for a $text search: after "described as" / "mentioning", or just before the listing noun."""
+    m = q.take(_TEXT_CUE)
+    if m:
+        return " ".join(text_search.words(m.group(1))) or None
+    m = re.search(r"((?:[a-z]+\s+){1,3})(?=" + _LISTING_NOUNS + r"\b)", q.text)
+    words = [w for w in m.group(1).split() if w not in MONGO_FILLER] if m else []
+    if not words or any(w in NON_TEXT_WORDS or len(w) < 3 for w in words):
+        return None
+    for word in words:
+        q.take(r"(?<![a-z0-9])" + re.escape(word) + r"(?![a-z0-9])")
+    return " ".join(words)
+
+
+def match_mongo(question):
+    q = _Question(question)
+    if q.take(_WRITE_VERBS) or not re.search(r"\b(apartments?|listings?|homes?|rentals?|units?|places?|propert(y|ies)|housing)\b", q.text):
+        return None
+    values = mongo_values()
+    entities = {}
+
+    if q.take(r"\bhow many\b.*\bin each city\b|\bper city\b|\bby city\b"):
+        if q.leftover(MONGO_FILLER | {"how", "many"}):
+            return None
+        pipeline = [
+            {"$group": {"_id": "$cityname", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$project": {"city": "$_id", "count": 1, "_id": 0}},
+        ]
+        return TemplateMatch("mongo", "count_by_city", pipeline, entities)
+
+    kind = "list"
+    if q.take(r"\bhow many\b"):
+        kind = "count"
+    elif q.take(r"\b(average|avg|mean)\b"):
+        kind = "average_price"
+    else:
+        m = q.take(r"\b(most expensive|priciest|cheapest|least expensive|lowest priced|highest priced)\b")
+        if m:
+            kind = "cheapest" if m.group(1) in ("cheapest", "least expensive", "lowest priced") else "most_expensive"
+
+    m = q.take(r"\b(top|first)\s+" + _NUM + r"\b")
+    if m:
+        entities["n"] = _to_int(m.group(2))
+
+    match = {}
+    if q.take(r"\bstudios?\b"):
+        match["bedrooms"] = 0
+    # "at least 2 bedrooms and 2 bathrooms": the "at least" applies to both counts
+    shared_at_least = re.search(r"\bat least\s+\S+[- ]?bed\w*\s+and\s+\S+[- ]?bath", q.text) is not None
+    m = q.take(r"\b(at least\s+)?" + _NUM + r"[- ]?(?:bed(?:room)?s?|br|bhk)\b")
+    if m:
+        match["bedrooms"] = {"$gte": _to_int(m.group(2))} if m.group(1) else _to_int(m.group(2))
+    m = q.take(r"\b(at least\s+)?" + _NUM + r"[- ]?(?:bath(?:room)?s?)\b")
+    if m:
+        at_least = m.group(1) or shared_at_least
+        match["bathrooms"] = {"$gte": _to_int(m.group(2))} if at_least else _to_int(m.group(2))
+    m = q.take(r"\b(under|below|less than|cheaper than|over|above|more than)\s+\$?(\d[\d,]*)(\s*(?:dollars|usd))?")
+    if m:
+        op = "$lt" if m.group(1) in ("under", "below", "less than", "cheaper than") else "$gt"
+        match["price"] = {op: int(m.group(2).replace(",", ""))}
+    if q.take(r"\b(?:that\s+)?(?:allow|allows|allowing)\s+pets\b|\bpet[- ]friendly\b"):
+        match["pets_allowed"] = {"$ne": ""}
+
+    city = q.take_value(values["city"])
+    state = q.take_state_abbreviation()
+    if not state:
+        full = q.take_value({name.lower(): name for name in US_STATES.values()})
+        state = STATE_ABBREVIATIONS.get(full.lower()) if full else None
+    if state and values["state"] and state.lower() not in values["state"]:
+        return None
+    # Only with a text index on listing; otherwise the words are left for the LLM
+    text = _take_listing_text(q) if text_search.mongo_text_fields("listing") else None
+    if text:
+        match = {"$text": {"$search": text_search.mongo_text_search(text)}, **match}
+    if city:
+        match["cityname"] = city
+    if state:
+        match["state"] = state
+
+    if q.leftover(MONGO_FILLER | {"how", "many", "price", "cost"}):
+        return None
+    entities.update(match)
+
+    pipeline = [{"$match": match}] if match else []
+    if kind == "count":
+        pipeline.append({"$count": "count"})
+    elif kind == "average_price":
+        pipeline += [{"$group": {"_id": None, "average_price": {"$avg": "$price"}}},
+                     {"$project": {"_id": 0, "average_price": 1}}]
+    elif kind in ("cheapest", "most_expensive"):
+        pipeline += [{"$sort": {"price": 1 if kind == "cheapest" else -1}},
+                     {"$limit": entities.get("n", 1)},
+                     {"$project": dict(_LIST_PROJECTION)}]
+    else:
+        if not match:
+            return None
+        if text:
+            pipeline.append({"$sort": {"score": {"$meta": "textScore"}}})
+        pipeline += [{"$project": dict(_LIST_PROJECTION)}, {"$limit": entities.get("n", 10)}]
+    return TemplateMatch("mongo", f"listing_{kind}", pipeline, entities)
+
+
+# --- MongoDB templates (hosts) ---
+_HOST_TEXT_RE = (r"\bhosts?\s+(?:who|that|whose\s+(?:bio|about|profile|description)\s+(?:says?|mentions?))\s+"
+                 r"([a-z][a-z\s'-]*?)\s*$")
+
+
+def match_mongo_hosts(question):
+    """"hosts who love dogs": hosts whose host_about mentions every term, best text match first."""
+    q = _Question(question)
+    if q.take(_WRITE_VERBS):
+        return None
+    m = q.take(_HOST_TEXT_RE)
+    if not m or not text_search.terms(m.group(1)):
+        return None
+    entities = {"text": " ".join(m.group(1).split())}
+    n = q.take(r"\b(top|first)\s+" + _NUM + r"\b")
+    if n:
+        entities["n"] = _to_int(n.group(2))
+    if q.leftover(MONGO_FILLER | {"host", "hosts"}):
+        return None
+    return TemplateMatch("mongo", "hosts_by_text", text_search.host_pipeline(entities["text"], entities.get("n", 10)),
+                         entities)
+
+
+def match(question, backend):
+    try:
+        return match_sql(question) if backend == "sql" else match_mongo_hosts(question) or match_mongo(question)
+    except Exception:
+        # A broken template must never block the LLM path
+        return None
+
+
+# --- Path coverage / latency stats ---
+_stats_lock = threading.Lock()
+_path_stats = {}
+
+
+def record_path(backend, path, seconds):
+    with _stats_lock:
+        entry = _path_stats.setdefault((backend, path), {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+
+
+def path_stats():
+    """Per backend: how many questions took each path ("template", "cache", "llm") and their mean latency."""
+    with _stats_lock:
+        report = {}
+        for (backend, path), entry in _path_stats.items():
+            report.setdefault(backend, {})[path] = {
+                "count": entry["count"],
+                "avg_ms": round(1000 * entry["seconds"] / entry["count"], 2),
+            }
+    for paths in report.values():
+        total = sum(p["count"] for p in paths.values())
+        paths["template_coverage"] = round(paths.get("template", {}).get("count", 0) / total, 3) if total else 0.0
+    return report
+
+
+class timed_path:
+    """Context manager that records the path a generation took and how long it needed."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.path = "llm"
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        if exc_type is None:
+            record_path(self.backend, self.path, self.seconds)
+        return False
@@ -0,0 +1,97 @@
+import pytest
+
+import bulk_writes
+
+COLLECTIONS = ("listing", "review", "host")
+
+
+def test_split_ignores_semicolons_in_quotes():
+    sql = "INSERT INTO menu (item_name) VALUES ('a;b'); UPDATE `odd;name` SET x = \"c;d\";\n;"
+    assert bulk_writes.split_statements(sql) == [
+        "INSERT INTO menu (item_name) VALUES ('a;b')",
+        "UPDATE `odd;name` SET x = \"c;d\"",
+    ]
+
+
+def test_parse_insert_literals():
+    prefix, rows = bulk_writes.parse_insert(
+        "INSERT IGNORE INTO menu (restaurant_id, item_name, price_usd, is_vegetarian, image_url)\n"
+        "VALUES (1, 'Chef''s \\n salad', 9.5, TRUE, NULL), (2, \"Soup\", -3, FALSE, 'x')")
+    assert prefix == "INSERT IGNORE INTO menu (restaurant_id, item_name, price_usd, is_vegetarian, image_url)"
+    assert rows == [(1, "Chef's \n salad", 9.5, 1, None), (2, "Soup", -3, 0, "x")]
+
+
+@pytest.mark.parametrize("statement", [
+    "INSERT INTO menu (item_name, created) VALUES ('a', NOW())",
+    "INSERT INTO menu (item_name) VALUES ('a') ON DUPLICATE KEY UPDATE item_name = 'b'",
+    "INSERT INTO menu (a, b) VALUES (1, 2), (3)",
+    "INSERT INTO menu (item_name) SELECT item_name FROM menu",
+    "UPDATE menu SET price_usd = 1",
+])
+def test_statements_run_as_they_are(statement):
+    assert bulk_writes.parse_insert(statement) is None
+
+
+def test_plan_merges_consecutive_inserts_into_chunks():
+    sql = ";".join(f"INSERT INTO menu (restaurant_id, item_name) VALUES ({i}, 'item {i}')" for i in range(5))
+    sql += "; DELETE FROM menu WHERE restaurant_id = 1; INSERT INTO menu (restaurant_id, item_name) VALUES (9, 'x')"
+    batches = bulk_writes.plan_sql(sql, chunk_size=2)
+    template = "INSERT INTO menu (restaurant_id, item_name) VALUES (%s, %s)"
+    assert batches == [
+        ("many", template, [(0, "item 0"), (1, "item 1")]),
+        ("many", template, [(2, "item 2"), (3, "item 3")]),
+        ("many", template, [(4, "item 4")]),
+        ("one", "DELETE FROM menu WHERE restaurant_id = 1"),
+        ("many", template, [(9, "x")]),
+    ]
+
+
+def test_different_columns_are_separate_batches():
+    batches = bulk_writes.plan_sql("INSERT INTO menu (a) VALUES (1); INSERT INTO menu (b) VALUES (2)")
+    assert [batch[1] for batch in batches] == ["INSERT INTO menu (a) VALUES (%s)", "INSERT INTO menu (b) VALUES (%s)"]
+
+
+def test_count_queries():
+    sql = ("INSERT INTO menu (a) VALUES (1), (2), (3);"
+           "UPDATE restaurant r SET has_wifi = 'yes' WHERE r.state = 'Texas';"
+           "DELETE FROM reviews;"
+           "UPDATE menu m JOIN restaurant r ON m.restaurant_id = r.restaurant_id SET m.price_usd = 1;"
+           "DELETE FROM menu WHERE price_usd > 100 LIMIT 5")
+    assert [count for _, count in bulk_writes.count_queries(sql)] == [
+        3,
+        "SELECT COUNT(*) AS matched FROM restaurant r WHERE r.state = 'Texas'",
+        "SELECT COUNT(*) AS matched FROM reviews",
+        None,
+        None,
+    ]
+
+
+def test_mongo_write_parse():
+    write = bulk_writes.MongoWrite.parse(
+        {"operation": "updateMany", "collection": "review_collection", "filter": {"rating": 1},
+         "update": {"$set": {"flagged": True}}}, COLLECTIONS)
+    assert (write.collection, write.bulk, write.verb) == ("review", True, "update")
+    insert = bulk_writes.MongoWrite.parse({"operation": "insertOne", "document": {"title": "x"}}, COLLECTIONS)
+    assert (insert.collection, insert.documents, insert.preview()) == ("listing", [{"title": "x"}], 1)
+    assert insert.describe(1) == "`insertOne` would insert 1 document(s) in `listing`"
+
+
+@pytest.mark.parametrize("response, error", [
+    ({"operation": "drop"}, "Unsupported operation"),
+    ({"operation": "deleteMany", "collection": "users", "filter": {}}, "Unknown collection"),
+    ({"operation": "insertMany", "documents": []}, "needs document"),
+    ({"operation": "insertMany", "documents": ["x"]}, "needs document"),
+    ({"operation": "deleteOne"}, "needs a filter"),
+    ({"operation": "updateOne", "filter": {}}, "needs an update"),
+])
+def test_invalid_mongo_writes(response, error):
+    with pytest.raises(bulk_writes.InvalidWrite, match=error):
+        bulk_writes.MongoWrite.parse(response, COLLECTIONS)
+
+
+def test_mongo_requests():
+    pymongo = pytest.importorskip("pymongo")
+    write = bulk_writes.MongoWrite("deleteMany", "listing", filter={"state": "DC"})
+    assert write.requests() == [pymongo.DeleteMany({"state": "DC"})]
+    inserts = bulk_writes.MongoWrite("insertMany", "listing", documents=[{"a": 1}, {"a": 2}]).requests()
+    assert inserts == [pymongo.InsertOne({"a": 1}), pymongo.InsertOne({"a": 2})]
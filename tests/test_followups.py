@@ -0,0 +1,97 @@
+import pandas as pd
+import pytest
+
+import followups
+import templates
+
+RESTAURANTS = pd.DataFrame({
+    "restaurant_name": ["A", "B", "C"],
+    "state": ["Texas", "Florida", "Texas"],
+    "phone_number": ["1", "2", "3"],
+    "has_wifi": ["yes", "no", "yes"],
+    "health_rating": [90, 80, 70],
+})
+LISTINGS = pd.DataFrame({
+    "title": ["x", "y", "z"], "price": [1500, 2500, 900], "bedrooms": [1, 2, 2], "state": ["DC", "VA", "DC"],
+})
+
+
+@pytest.fixture(autouse=True)
+def mongo_values(monkeypatch):
+    monkeypatch.setattr(templates, "mongo_values", lambda: {"city": {}, "state": {"dc": "DC", "va": "VA"}})
+
+
+@pytest.fixture
+def restaurants():
+    return followups.remember("sql", "restaurants", "SELECT * FROM restaurant r;", RESTAURANTS)
+
+
+@pytest.fixture
+def listings():
+    return followups.remember("mongo", "apartments", [{"$match": {"cityname": "Washington"}}], LISTINGS,
+                              complete=False)
+
+
+@pytest.mark.parametrize("question, refinement", [
+    ("now only the ones in Texas", followups.Refinement(filters=[("state", "==", "Texas")])),
+    ("only those in TX", followups.Refinement(filters=[("state", "==", "Texas")])),
+    ("just the names and phone numbers", followups.Refinement(columns=["restaurant_name", "phone_number"])),
+    ("sort those by health rating descending", followups.Refinement(sort=[("health_rating", False)])),
+    ("only those with wifi", followups.Refinement(filters=[("has_wifi", "==", "yes")])),
+    ("top 2 of those", followups.Refinement(limit=2)),
+    ("now only those with health rating above 75",
+     followups.Refinement(filters=[("health_rating", ">", 75)])),
+])
+def test_parse(restaurants, question, refinement):
+    assert followups.parse(question, restaurants) == refinement
+
+
+@pytest.mark.parametrize("question", [
+    "restaurants in Texas",           # no follow-up marker: a new question
+    "delete those",                   # writes are never refinements
+    "those with a nice vibe",         # words the parser can't account for
+    "now only those cheapest first",  # no price column in the result
+])
+def test_not_a_refinement(restaurants, question):
+    assert followups.parse(question, restaurants) is None
+
+
+def test_complete_result_is_refined_locally(restaurants):
+    followup = followups.refine("now only the ones in Texas sorted by health rating", restaurants)
+    assert followup.kind == "local"
+    assert followup.frame["restaurant_name"].tolist() == ["C", "A"]
+    assert followup.query == ("SELECT * FROM (SELECT * FROM restaurant r) AS previous "
+                              "WHERE `state` = 'Texas' ORDER BY `health_rating` ASC;")
+
+
+def test_capped_sql_result_is_folded(restaurants):
+    restaurants.complete = False
+    followup = followups.refine("just the names and phone numbers", restaurants)
+    assert followup.kind == "fold" and followup.frame is None
+    assert followup.query == ("SELECT `restaurant_name`, `phone_number` "
+                              "FROM (SELECT * FROM restaurant r) AS previous;")
+
+
+def test_capped_pipeline_is_extended(listings):
+    followup = followups.refine("now only those under $2000 with 2 bedrooms, cheapest first", listings)
+    assert followup.kind == "fold"
+    assert followup.query == [
+        {"$match": {"cityname": "Washington"}},
+        {"$match": {"price": {"$lt": 2000}, "bedrooms": {"$eq": 2}}},
+        {"$sort": {"price": 1}},
+    ]
+
+
+def test_state_codes_follow_the_result(listings):
+    assert followups.parse("only those in Virginia", listings).filters == [("state", "==", "VA")]
+
+
+def test_mode_for_the_other_backend_skips_refinement(listings):
+    assert followups.refine("now only those under $2000", listings, mode="Restaurant") is None
+
+
+def test_large_results_keep_only_columns(monkeypatch):
+    monkeypatch.setattr(followups, "MAX_ROWS", 2)
+    state = followups.remember("sql", "restaurants", "SELECT 1;", RESTAURANTS)
+    assert not state.complete
+    assert state.frame.empty and list(state.frame.columns) == list(RESTAURANTS.columns)
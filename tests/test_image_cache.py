@@ -0,0 +1,122 @@
+import functools
+import io
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import image_cache
+
+DELAY_S = 0.3
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # /blob/<n> -> 1000 bytes, /picture/<n> -> a 1200x800 PNG, /slow -> answers after 2 s;
+    # every response waits DELAY_S so overlapping requests show up in `peak`
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            server.requests += 1
+        try:
+            time.sleep(2 if self.path == "/slow" else DELAY_S)
+            if self.path.startswith("/picture/"):
+                body = server.picture
+            else:
+                body = self.path.encode().ljust(1000, b".")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up (timeout test)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+def _png(width, height):
+    image_module = pytest.importorskip("PIL.Image")
+    out = io.BytesIO()
+    image_module.new("RGB", (width, height), (200, 80, 40)).save(out, format="PNG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.active = httpd.peak = httpd.requests = 0
+    httpd.picture = None
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def raw_bytes(monkeypatch):
+    # The blobs aren't images; store them as downloaded
+    monkeypatch.setattr(image_cache, "thumbnail", lambda data: data)
+
+
+def test_fetches_run_concurrently(server, tmp_path, raw_bytes):
+    cache = image_cache.ImageCache(str(tmp_path), workers=4)
+    urls = [f"{server.url}/blob/{i}" for i in range(4)]
+    started = time.perf_counter()
+    results = dict(cache.fetch_each(urls + urls[:1], timeout=5))
+    elapsed = time.perf_counter() - started
+
+    assert all(results[url] and os.path.exists(results[url]) for url in urls)
+    assert server.peak > 1
+    assert elapsed < len(urls) * DELAY_S
+    assert server.requests == len(urls)  # the repeated URL shared its download
+    assert cache.cached(urls[0]) == results[urls[0]]
+
+
+def test_slow_image_times_out(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(image_cache, "download", functools.partial(image_cache.download, timeout=0.5))
+    cache = image_cache.ImageCache(str(tmp_path), workers=2)
+    started = time.perf_counter()
+    assert cache.fetch(f"{server.url}/slow").result(timeout=5) is None
+    assert time.perf_counter() - started < 1.5
+    assert cache.metrics()["failures"] == 1
+    assert cache.cached(f"{server.url}/slow") is None
+
+
+def test_pictures_are_stored_as_thumbnails(server, tmp_path):
+    image_module = pytest.importorskip("PIL.Image")
+    server.picture = _png(1200, 800)
+    cache = image_cache.ImageCache(str(tmp_path), workers=2)
+    path = cache.fetch(f"{server.url}/picture/1").result(timeout=5)
+
+    with image_module.open(path) as image:
+        assert image.format == "JPEG"
+        assert max(image.size) == image_cache.THUMBNAIL_PX
+        assert image.size[0] / image.size[1] == pytest.approx(1.5, rel=0.02)
+    assert os.path.getsize(path) < len(server.picture)
+
+
+def test_least_recently_used_is_evicted(server, tmp_path, raw_bytes):
+    cache = image_cache.ImageCache(str(tmp_path), max_bytes=2500, workers=2)
+    first, second, third = (f"{server.url}/blob/{name}" for name in ("first", "second", "third"))
+    os.utime(cache.fetch(first).result(timeout=5), (1000, 1000))
+    os.utime(cache.fetch(second).result(timeout=5), (2000, 2000))
+    assert cache.cached(first)  # now the most recently used
+
+    cache.fetch(third).result(timeout=5)
+
+    assert cache.cached(second) is None
+    assert cache.cached(first) and cache.cached(third)
+    metrics = cache.metrics()
+    assert metrics["evictions"] == 1
+    assert metrics["bytes"] == 2000 <= metrics["max_bytes"]
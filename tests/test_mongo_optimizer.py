@@ -0,0 +1,112 @@
+import copy
+
+import pytest
+
+import mongo_optimizer
+
+HOST_JOIN = [
+    {"$lookup": {"from": "host", "localField": "host_id", "foreignField": "host_id", "as": "host"}},
+    {"$unwind": "$host"},
+    {"$match": {"cityname": "Washington", "host.host_response_time": "within an hour"}},
+    {"$sort": {"price": 1}},
+    {"$project": {"title": 1, "price": 1, "host.host_name": 1, "_id": 0}},
+]
+
+
+@pytest.fixture(autouse=True)
+def lookup_pipeline(monkeypatch):
+    monkeypatch.setattr(mongo_optimizer, "LOOKUP_PIPELINE", True)
+
+
+def test_join_pipeline_is_rewritten():
+    result = mongo_optimizer.optimize(HOST_JOIN)
+    assert result.pipeline == [
+        {"$match": {"cityname": "Washington"}},
+        {"$project": {"host_id": 1, "price": 1, "title": 1, "_id": 0}},
+        {"$lookup": {"from": "host", "localField": "host_id", "foreignField": "host_id", "as": "host",
+                     "pipeline": [{"$project": {"host_name": 1, "host_response_time": 1, "_id": 0}}]}},
+        {"$unwind": "$host"},
+        {"$match": {"host.host_response_time": "within an hour"}},
+        {"$sort": {"price": 1}},
+        {"$project": {"title": 1, "price": 1, "host.host_name": 1, "_id": 0}},
+        {"$limit": mongo_optimizer.DEFAULT_LIMIT},
+    ]
+    assert result.rewrites[0] == "Moved $match on cityname ahead of the host join"
+
+
+def test_input_is_left_untouched():
+    original = copy.deepcopy(HOST_JOIN)
+    mongo_optimizer.optimize(HOST_JOIN)
+    assert HOST_JOIN == original
+
+
+def test_lookup_stays_simple_without_pipeline_support(monkeypatch):
+    monkeypatch.setattr(mongo_optimizer, "LOOKUP_PIPELINE", False)
+    lookup = next(s for s in mongo_optimizer.optimize(HOST_JOIN).pipeline if "$lookup" in s)
+    assert "pipeline" not in lookup["$lookup"]
+
+
+def test_whole_joined_document_is_not_narrowed():
+    pipeline = [HOST_JOIN[0], {"$project": {"title": 1, "host": 1}}]
+    lookup = next(s for s in mongo_optimizer.optimize(pipeline).pipeline if "$lookup" in s)
+    assert lookup == HOST_JOIN[0]
+
+
+def test_unknown_stage_stops_projection():
+    pipeline = HOST_JOIN[:2] + [{"$addFields": {"n": 1}}] + HOST_JOIN[2:]
+    ops = [next(iter(s)) for s in mongo_optimizer.optimize(pipeline).pipeline]
+    assert ops.count("$project") == 1
+
+
+def test_geonear_stays_first():
+    pipeline = [{"$geoNear": {"near": {"type": "Point", "coordinates": [-77.0, 38.9]}, "distanceField": "d"}},
+                *HOST_JOIN]
+    assert "$geoNear" in mongo_optimizer.optimize(pipeline).pipeline[0]
+
+
+@pytest.mark.parametrize("pipeline", [
+    [{"$match": {"state": "DC"}}, {"$limit": 5}],
+    [{"$match": {"state": "DC"}}, {"$count": "count"}],
+    [{"$match": {"state": "DC"}}, {"$out": "copy"}],
+])
+def test_no_default_limit_when_bounded_or_writing(pipeline):
+    assert mongo_optimizer.optimize(pipeline).pipeline == pipeline
+
+
+def test_paged_pipelines_get_no_default_limit():
+    pipeline = [{"$match": {"state": "DC"}}]
+    assert mongo_optimizer.optimize(pipeline, default_limit=False).pipeline == pipeline
+
+
+def test_time_limit_is_capped():
+    assert mongo_optimizer.optimize([], max_time_ms=250).options["maxTimeMS"] == 250
+    capped = mongo_optimizer.optimize([], max_time_ms=10 ** 9).options["maxTimeMS"]
+    assert capped == mongo_optimizer.MAX_TIME_MS
+
+
+def test_non_list_is_passed_through():
+    assert mongo_optimizer.optimize({"state": "DC"}).pipeline == {"state": "DC"}
+
+
+class _Collection:
+    name = "listing"
+
+    def __init__(self, stage, count):
+        self.plan, self.count = {"queryPlanner": {"winningPlan": {"stage": stage}}}, count
+        self.database = self
+
+    def command(self, spec):
+        return self.plan
+
+    def estimated_document_count(self):
+        return self.count
+
+
+def test_large_collection_scan_is_rejected():
+    with pytest.raises(mongo_optimizer.PipelineRejected, match="COLLSCAN"):
+        mongo_optimizer.check_plan(_Collection("COLLSCAN", 200), [{"$match": {"title": "x"}}], max_docs=100)
+
+
+@pytest.mark.parametrize("stage, count", [("IXSCAN", 10 ** 6), ("COLLSCAN", 50)])
+def test_index_scans_and_small_collections_pass(stage, count):
+    mongo_optimizer.check_plan(_Collection(stage, count), [{"$match": {"state": "DC"}}], max_docs=100)
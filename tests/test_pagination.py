@@ -0,0 +1,97 @@
+import sqlite3
+
+import pytest
+
+import pagination
+
+
+@pytest.mark.parametrize("sql, offset, limit, paged", [
+    ("SELECT * FROM menu;", 0, 26, "SELECT * FROM menu LIMIT 26 OFFSET 0"),
+    ("SELECT * FROM menu  ", 50, 26, "SELECT * FROM menu LIMIT 26 OFFSET 50"),
+    # The query's own LIMIT still bounds the pages
+    ("SELECT * FROM menu LIMIT 30;", 25, 26, "SELECT * FROM menu LIMIT 5 OFFSET 25"),
+    ("SELECT * FROM menu LIMIT 30", 50, 26, "SELECT * FROM menu LIMIT 0 OFFSET 50"),
+    ("SELECT * FROM menu LIMIT 30 OFFSET 10", 25, 26, "SELECT * FROM menu LIMIT 5 OFFSET 35"),
+    ("SELECT * FROM menu limit 10, 30", 0, 26, "SELECT * FROM menu LIMIT 26 OFFSET 10"),
+    # A LIMIT inside a subquery is not the query's own
+    ("SELECT * FROM (SELECT * FROM menu LIMIT 5) AS m WHERE price_usd > 1", 5, 6,
+     "SELECT * FROM (SELECT * FROM menu LIMIT 5) AS m WHERE price_usd > 1 LIMIT 6 OFFSET 5"),
+])
+def test_page_sql(sql, offset, limit, paged):
+    assert pagination.page_sql(sql, offset, limit) == paged
+
+
+def test_count_sql():
+    assert pagination.count_sql(" SELECT a FROM menu LIMIT 3; ") == \
+        "SELECT COUNT(*) AS total FROM (SELECT a FROM menu LIMIT 3) AS counted"
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT n FROM numbers ORDER BY n",
+    "SELECT n FROM numbers ORDER BY n LIMIT 23",
+    "SELECT n FROM numbers ORDER BY n LIMIT 7, 30",
+])
+def test_pages_cover_the_result_once(sql):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE numbers (n INTEGER)")
+    conn.executemany("INSERT INTO numbers VALUES (?)", [(n,) for n in range(100)])
+    expected = conn.execute(sql).fetchall()
+    seen = []
+    for number in range(10):
+        seen += conn.execute(pagination.page_sql(sql, number * 10, 10)).fetchall()
+    assert seen == expected
+    assert conn.execute(pagination.count_sql(sql)).fetchone()[0] == len(expected)
+
+
+def test_page_pipeline():
+    pipeline = [{"$match": {"state": "DC"}}]
+    assert pagination.page_pipeline(pipeline, 0, 26) == pipeline + [{"$limit": 26}]
+    assert pagination.page_pipeline(pipeline, 25, 26, with_total=True) == pipeline + [
+        {"$facet": {"rows": [{"$skip": 25}, {"$limit": 26}], "total": [{"$count": "n"}]}}]
+    assert pipeline == [{"$match": {"state": "DC"}}]
+
+
+def test_unpack_facet():
+    assert pagination.unpack_facet([{"rows": [{"a": 1}], "total": [{"n": 40}]}]) == ([{"a": 1}], 40)
+    assert pagination.unpack_facet([{"rows": [], "total": []}]) == ([], 0)
+    assert pagination.unpack_facet([]) == ([], 0)
+
+
+def test_writing_pipelines_are_not_pageable():
+    assert pagination.pageable([{"$match": {}}])
+    assert not pagination.pageable([{"$match": {}}, {"$out": "copy"}])
+    assert not pagination.pageable({"$match": {}})
+
+
+def test_cursor_pages():
+    rows, calls = list(range(60)), []
+
+    def fetch(offset, limit, with_total):
+        calls.append((offset, limit, with_total))
+        return rows[offset:offset + limit], len(rows) if with_total else None
+
+    cursor = pagination.Cursor("sql", "SELECT ...", fetch, page_size=25)
+    first = cursor.load()
+    assert (first.rows, first.has_next, first.total) == (rows[:25], True, 60)
+    assert first.describe() == "Results 1–25 of 60"
+    assert not cursor.complete
+    last = cursor.load(2)
+    assert (last.rows, last.has_next, last.total) == (rows[50:], False, 60)
+    assert calls == [(0, 26, True), (50, 26, False)]  # counted once, one extra row per page
+
+
+def test_small_result_is_complete():
+    cursor = pagination.Cursor("mongo", [], lambda offset, limit, with_total: ([1, 2], None), page_size=25)
+    page = cursor.load(-1)
+    assert page.number == 0 and cursor.complete
+    assert page.describe() == "Results 1–2"
+
+
+def test_session_keeps_the_newest_cursors(monkeypatch):
+    monkeypatch.setattr(pagination, "MAX_CURSORS", 2)
+    state = {}
+    cursors = [pagination.open_cursor(state, pagination.Cursor("sql", "q", None)) for _ in range(3)]
+    assert list(state["cursors"]) == [cursors[1].token, cursors[2].token]
+    assert pagination.active_cursor(state) is cursors[2]
+    pagination.close_cursor(state)
+    assert pagination.active_cursor(state) is None
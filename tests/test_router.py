@@ -0,0 +1,72 @@
+import pytest
+
+import router
+
+
+@pytest.fixture
+def small_router():
+    return router.BackendRouter("select item_name, price_usd from menu join restaurant",
+                                "db.listing.aggregate bedrooms amenities cityname")
+
+
+def test_tokenize_drops_stopwords_and_plurals():
+    assert router.tokenize("Show the cheapest Pizzas in all cities") == ["cheapest", "pizza", "city"]
+    assert router.normalize_question("  Any   Pools here? ") == "any pools here"
+
+
+def test_keywords_decide_the_backend(small_router):
+    assert small_router.route("vegetarian dishes with outdoor seating").backend == "sql"
+    assert small_router.route("apartments with a pool for my pets").backend == "mongo"
+
+
+def test_unknown_words_leave_the_router_unsure(small_router):
+    decision = small_router.route("what is it")
+    assert decision.backend is None
+    assert decision.confidence == 0.0
+
+
+def test_confident_decisions_are_memoized(small_router, monkeypatch):
+    first = small_router.route("Vegetarian dishes?")
+    monkeypatch.setattr(small_router, "score", lambda question: pytest.fail("not memoized"))
+    assert small_router.route("vegetarian   dishes") is first
+
+
+def test_remembered_llm_answer_is_reused(small_router):
+    small_router.remember("what is it", "mongo")
+    decision = small_router.route("What is it?")
+    assert (decision.backend, decision.source) == ("mongo", "llm")
+
+
+def test_mode_overrides_routing(monkeypatch):
+    monkeypatch.setattr(router, "get_router", lambda: pytest.fail("routed despite an explicit mode"))
+    assert router.detect_backend("apartments with a pool", "Restaurant") == "sql"
+    assert router.detect_backend("vegetarian dishes", "Housing") == "mongo"
+
+
+def test_llm_is_asked_only_when_unsure(small_router, monkeypatch):
+    asked = []
+    monkeypatch.setattr(router, "get_router", lambda: small_router)
+    monkeypatch.setattr(router, "classify_with_llm", lambda query: asked.append(query) or "mongo")
+
+    assert router.detect_backend("vegetarian dishes") == "sql"
+    assert router.detect_backend("what is it") == "mongo"
+    assert router.detect_backend("what is it") == "mongo"
+    assert asked == ["what is it"]
+
+
+def test_llm_failure_routes_nowhere(small_router, monkeypatch):
+    def fail(query):
+        raise TimeoutError("llm")
+    monkeypatch.setattr(router, "get_router", lambda: small_router)
+    monkeypatch.setattr(router, "classify_with_llm", fail)
+    assert router.detect_backend("what is it") == "unknown"
+
+
+@pytest.mark.parametrize("question, backend", [
+    ("Show vegetarian dishes under $10 at Italian restaurants", "sql"),
+    ("Which restaurants have a health rating above 90?", "sql"),
+    ("List listings in Brooklyn with a pool and host response within an hour", "mongo"),
+    ("How many 2-bedroom apartments are available in Washington DC?", "mongo"),
+])
+def test_prompt_vocabulary_routes_sample_questions(question, backend):
+    assert router.get_router().route(question).backend == backend
@@ -0,0 +1,115 @@
+import pytest
+
+import templates
+import text_search
+
+
+@pytest.fixture(autouse=True)
+def no_text_indexes(monkeypatch):
+    # No FULLTEXT / $text index and no local index: the plain LIKE / LLM fallbacks
+    monkeypatch.setattr(text_search, "sql_fulltext", lambda *args, **kwargs: False)
+    monkeypatch.setattr(text_search, "mongo_text_fields", lambda collection: ())
+    monkeypatch.setattr(text_search, "_local_ids", lambda corpus, text: None)
+    monkeypatch.setattr(templates, "mongo_values",
+                        lambda: {"city": {"washington": "Washington"}, "state": {"dc": "DC"}})
+
+
+def test_top_n_restaurants_in_a_state():
+    m = templates.match("top 5 restaurants in Florida", "sql")
+    assert m.template == "restaurant_list"
+    assert m.query == "SELECT r.restaurant_name FROM restaurant r WHERE r.state = 'Florida' LIMIT 5;"
+    assert m.entities == {"order": "top", "n": 5, "state": "Florida"}
+
+
+def test_features_cuisine_and_columns():
+    m = templates.match("show phone numbers of italian restaurants with outdoor seating and wifi", "sql")
+    assert m.query == ("SELECT r.restaurant_name, r.phone_number FROM restaurant r WHERE "
+                       "r.has_outdoor_seating = 'yes' AND r.has_wifi = 'yes' AND r.cuisine = 'Italian';")
+
+
+def test_tag_joins_reviews():
+    m = templates.match("romantic restaurants in Florida", "sql")
+    assert m.template == "restaurants_by_tag"
+    assert " JOIN reviews v ON r.restaurant_id = v.restaurant_id" in m.query
+    assert "v.tags LIKE '%romantic%'" in m.query
+
+
+def test_review_text_needs_every_word():
+    m = templates.match("restaurants with reviews that mention friendly staff", "sql")
+    assert m.template == "restaurants_by_review_text"
+    assert ("(v.sample_review LIKE '%friendly%' OR v.tags LIKE '%friendly%') AND "
+            "(v.sample_review LIKE '%staff%' OR v.tags LIKE '%staff%')") in m.query
+
+
+def test_review_text_uses_fulltext_when_indexed(monkeypatch):
+    monkeypatch.setattr(text_search, "sql_fulltext", lambda *args, **kwargs: True)
+    m = templates.match("restaurants with reviews that mention families", "sql")
+    assert "AGAINST('+families' IN BOOLEAN MODE)" in m.query
+    assert "ORDER BY MATCH(v.sample_review, v.tags)" in m.query
+
+
+@pytest.mark.parametrize("question", [
+    "delete restaurants in Florida",
+    "restaurants with a nice vibe and good food maybe",
+    "what is the weather in Florida",
+])
+def test_unexplained_sql_questions_fall_through(question):
+    assert templates.match(question, "sql") is None
+
+
+def test_listing_count():
+    m = templates.match("How many 2-bedroom apartments are available in Washington DC?", "mongo")
+    assert m.template == "listing_count"
+    assert m.query == [{"$match": {"bedrooms": 2, "cityname": "Washington", "state": "DC"}}, {"$count": "count"}]
+
+
+def test_listing_filters():
+    m = templates.match("listings with at least 2 bedrooms and 2 bathrooms under $2000", "mongo")
+    assert m.template == "listing_list"
+    assert m.query[0] == {"$match": {"bedrooms": {"$gte": 2}, "bathrooms": {"$gte": 2}, "price": {"$lt": 2000}}}
+    assert m.query[-1] == {"$limit": 10}
+
+
+def test_cheapest_listings():
+    m = templates.match("top 3 cheapest apartments in DC", "mongo")
+    assert m.template == "listing_cheapest"
+    assert m.query[:3] == [{"$match": {"state": "DC"}}, {"$sort": {"price": 1}}, {"$limit": 3}]
+
+
+def test_count_by_city():
+    assert templates.match("how many apartments per city", "mongo").template == "count_by_city"
+
+
+def test_descriptive_words_need_a_text_index(monkeypatch):
+    assert templates.match("quiet cozy apartments in Washington", "mongo") is None
+    monkeypatch.setattr(text_search, "mongo_text_fields", lambda collection: ("title",))
+    m = templates.match("quiet cozy apartments in Washington", "mongo")
+    assert m.query[0] == {"$match": {"$text": {"$search": '"quiet" "cozy"'}, "cityname": "Washington"}}
+    assert m.query[1] == {"$sort": {"score": {"$meta": "textScore"}}}
+
+
+def test_hosts_by_text():
+    m = templates.match("hosts who love dogs", "mongo")
+    assert m.template == "hosts_by_text"
+    assert m.entities == {"text": "love dogs"}
+
+
+def test_unknown_state_falls_through():
+    assert templates.match("how many apartments in NY", "mongo") is None
+
+
+def test_broken_template_never_raises(monkeypatch):
+    def broken(question):
+        raise KeyError("values")
+    monkeypatch.setattr(templates, "match_sql", broken)
+    assert templates.match("top 5 restaurants in Florida", "sql") is None
+
+
+def test_path_stats_report_coverage(monkeypatch):
+    monkeypatch.setattr(templates, "_path_stats", {})
+    for path in ("template", "template", "llm", "cache"):
+        with templates.timed_path("sql") as timer:
+            timer.path = path
+    stats = templates.path_stats()["sql"]
+    assert stats["template"]["count"] == 2
+    assert stats["template_coverage"] == 0.5
@@ -0,0 +1,129 @@
+import threading
+
+import pytest
+
+import text_search
+
+
+@pytest.fixture
+def no_fulltext(monkeypatch):
+    monkeypatch.setattr(text_search, "sql_fulltext", lambda *args, **kwargs: False)
+
+
+@pytest.fixture
+def local_hits(monkeypatch):
+    hits = {}
+    monkeypatch.setattr(text_search, "_local_ids", lambda corpus, text: hits.get(corpus))
+    return hits
+
+
+@pytest.mark.parametrize("text, query", [
+    ("families with kids", "+families +kids"),    # as typed: FULLTEXT doesn't stem
+    ("Families, families!", "+families"),
+    ("the best of it", "+best"),
+    ("rooftop bar 24 hours", "+rooftop +bar +24 +hours"),
+    ("", ""),
+])
+def test_boolean_query_uses_the_words_as_typed(text, query):
+    assert text_search._boolean_query(text) == query
+
+
+def test_mongo_search_string():
+    assert text_search.mongo_text_search("quiet") == "quiet"
+    assert text_search.mongo_text_search("quiet cozy lofts") == '"quiet" "cozy" "lofts"'
+
+
+def test_index_requires_every_term_and_ranks_by_bm25():
+    index = text_search.InvertedIndex()
+    index.add(1, "friendly staff, great pizza")
+    index.add(2, "Friendly staff. Friendly owners, friendly prices")
+    index.add(3, "great pizza")
+    assert index.search("friendly staff") == [2, 1]
+    assert index.search("great pizza families") == []
+    assert index.search("") == []
+    assert index.stats() == {"documents": 3, "terms": 6}
+
+
+def test_review_text_with_fulltext(monkeypatch):
+    monkeypatch.setattr(text_search, "sql_fulltext", lambda *args, **kwargs: True)
+    assert text_search.sql_review_text_condition("families") == \
+        "MATCH(v.sample_review, v.tags) AGAINST('+families' IN BOOLEAN MODE)"
+    assert text_search.sql_review_text_rank("families").endswith(" IN BOOLEAN MODE) DESC")
+    assert text_search.sql_tag_condition("kid's menu") == "MATCH(v.tags) AGAINST('+kid +s +menu' IN BOOLEAN MODE)"
+
+
+def test_review_text_is_narrowed_to_local_hits(no_fulltext, local_hits):
+    likes = "(v.sample_review LIKE '%friendly%' OR v.tags LIKE '%friendly%')"
+    assert text_search.sql_review_text_condition("friendly") == likes
+    assert text_search.sql_review_text_rank("friendly") is None
+
+    local_hits["reviews"] = [7, 3]
+    assert text_search.sql_review_text_condition("friendly") == f"v.restaurant_id IN (7, 3) AND {likes}"
+    assert text_search.sql_review_text_rank("friendly") == "CASE v.restaurant_id WHEN 7 THEN 0 WHEN 3 THEN 1 ELSE 2 END"
+
+    local_hits["reviews"] = []
+    assert text_search.sql_review_text_condition("friendly") == "1 = 0"
+    assert text_search.sql_review_text_condition("the of") is None
+
+
+def test_tag_like_is_escaped(no_fulltext, local_hits):
+    assert text_search.sql_tag_condition("kid's menu", alias="r") == "r.tags LIKE '%kid''s menu%'"
+
+
+def test_host_pipeline(local_hits):
+    scan = text_search.host_pipeline("loves dogs", ids=None)
+    assert scan[0] == {"$group": {"_id": "$host_id", "listings": {"$sum": 1}}}
+    assert scan[3] == {"$match": {"$and": [{"host.host_about": {"$regex": r"\blove", "$options": "i"}},
+                                           {"host.host_about": {"$regex": r"\bdog", "$options": "i"}}]}}
+
+    local_hits["host"] = [42, 7]
+    narrowed = text_search.host_pipeline("loves dogs", limit=5)
+    assert narrowed[0] == {"$match": {"host_id": {"$in": [42, 7]}}}
+    assert narrowed[1:4] == scan[:3]
+    assert narrowed[5]["$addFields"]["rank"]["$let"]["vars"]["i"] == {"$indexOfArray": [[42, 7], "$_id"]}
+    assert {"$limit": 5} in narrowed
+
+
+def test_local_ids_give_up_on_unselective_text(monkeypatch):
+    index = text_search.InvertedIndex()
+    for doc in range(5):
+        index.add(doc, "great food")
+    monkeypatch.setattr(text_search, "local_index", lambda corpus: index)
+    monkeypatch.setattr(text_search, "MAX_IDS", 3)
+    assert text_search._local_ids("reviews", "great") is None
+    index.add(9, "great view")
+    assert text_search._local_ids("reviews", "view") == [9]
+
+
+def test_failed_probe_keeps_its_previous_value():
+    results = iter([{"reviews": [("tags",)]}, RuntimeError("server gone")])
+
+    def check():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    probe = text_search._Probe(check, {}, ttl=0)
+    assert probe.get(wait=5) == {"reviews": [("tags",)]}
+    probe.checked.clear()
+    probe.expires = 0.0
+    assert probe.get(wait=5) == {"reviews": [("tags",)]}
+
+
+def test_invalidated_probe_drops_a_build_in_flight():
+    release, started = threading.Event(), threading.Event()
+
+    def slow_build():
+        started.set()
+        release.wait(5)
+        return "old index"
+
+    probe = text_search._Probe(slow_build, None, ttl=60)
+    probe.start()
+    assert started.wait(5)
+    probe.invalidate()  # the data changed while the index was being built
+    release.set()
+    assert probe.checked.wait(5)
+    assert probe.value is None
+    assert probe.expires == 0.0  # rebuilt on the next get()
@@ -0,0 +1,522 @@
+import argparse
+import math
+import re
+import statistics
+import threading
+import time
+from collections import defaultdict
+
+import resources
+import retrieval
+
+# --- Full-text search ---
+# Descriptive questions ("romantic restaurants", "hosts who love dogs", "quiet
+# apartments") used to become LIKE '%word%' scans over reviews.tags or $regex
+# matches on body / description / host_about, which no index can serve. They
+# are now answered, in order of preference, with:
+#   * native text indexes where they exist: a MongoDB text index over listing
+#     title / description / body ($text) and MySQL FULLTEXT indexes on reviews
+#     (MATCH ... AGAINST; not used with the embedded SQL backend);
+#   * otherwise an in-process inverted index over the live reviews table
+#     (review text per restaurant) and host collection (host_about per host).
+#     Its hits narrow the query to `restaurant_id IN (...)` / `host_id $in`,
+#     the original LIKE / $regex confirms the match on those rows only, and
+#     the hits' BM25 order ranks the results. The index is rebuilt in the
+#     background every TEXT_SEARCH_REFRESH_S and dropped when the chatbot
+#     writes the table; until it is back, queries use the plain scan.
+# Templates and the generation prompts use whichever is available.
+#
+#   python text_search.py --create     # create the MongoDB text and MySQL FULLTEXT indexes
+#   python text_search.py --compare    # time text search against the scan-based queries
+
+ENABLED = resources.getenv("TEXT_SEARCH", "1") == "1"
+MAX_IDS = int(resources.getenv("TEXT_SEARCH_MAX_IDS", "200"))  # more local hits than this: plain scan instead
+RANK_IDS = int(resources.getenv("TEXT_SEARCH_RANK_IDS", "50"))  # best local hits ranked in the query
+LOCAL_MAX_DOCS = int(resources.getenv("TEXT_SEARCH_LOCAL_MAX_DOCS", "500000"))  # larger tables aren't indexed
+REFRESH_S = float(resources.getenv("TEXT_SEARCH_REFRESH_S", "300"))  # local index rebuild interval
+COMPARE_REPEAT = int(resources.getenv("TEXT_SEARCH_COMPARE_REPEAT", "5"))
+PROBE_TTL_S = float(resources.getenv("TEXT_SEARCH_PROBE_TTL_S", "300"))  # re-check for created / dropped indexes
+PROBE_RETRY_S = float(resources.getenv("TEXT_SEARCH_PROBE_RETRY_S", "30"))  # after a failed check
+PROBE_WAIT_S = float(resources.getenv("TEXT_SEARCH_PROBE_WAIT_S", "2"))  # the first check a request may wait for
+
+# Native indexes: MongoDB text index weights, MySQL FULLTEXT column lists
+MONGO_TEXT_INDEXES = {"listing": {"title": 10, "description": 3, "body": 1}}
+SQL_FULLTEXT_INDEXES = {
+    "ft_reviews_text": ("reviews", ("sample_review", "tags")),
+    "ft_reviews_tags": ("reviews", ("tags",)),
+}
+
+# In-process corpora: backend, table / collection, id column and text columns
+LOCAL_CORPORA = {
+    "reviews": ("sql", "reviews", "restaurant_id", ("sample_review", "tags")),
+    "host": ("mongo", "host", "host_id", ("host_about",)),
+}
+
+
+def _sql_string(value):
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def _sql_literal(value):
+    return _sql_string(value) if isinstance(value, str) else str(value)
+
+
+def terms(text):
+    """Search terms of ``text``: the retrieval tokenizer's words, deduplicated, in order."""
+    return list(dict.fromkeys(retrieval.tokenize(text)))
+
+
+def words(text):
+    """The words of ``text`` as typed, without stopwords, for MATCH / $text (terms() strips a plural "s")."""
+    return list(dict.fromkeys(word for word in re.findall(r"[a-z0-9]+", text.lower()) if retrieval.tokenize(word)))
+
+
+# --- In-process inverted index ---
+class InvertedIndex:
+    """Postings ``term -> {doc_id: frequency}`` ranked with BM25."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.lengths = defaultdict(int)
+
+    def add(self, doc_id, text):
+        words = retrieval.tokenize(text or "")
+        self.lengths[doc_id] += len(words)
+        for word in words:
+            postings = self.postings[word]
+            postings[doc_id] = postings.get(doc_id, 0) + 1
+
+    def search(self, query, limit=None):
+        """Ids of the documents containing every term of ``query``, best BM25 score first."""
+        query_terms = terms(query)
+        postings = [self.postings.get(term, {}) for term in query_terms]
+        if not postings or not all(postings):
+            return []
+        candidates = set(min(postings, key=len))
+        for other in postings:
+            candidates &= other.keys()
+        n, average = len(self.lengths), sum(self.lengths.values()) / len(self.lengths)
+        idf = [math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for p in postings]
+        scores = {}
+        for doc in candidates:
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / average)
+            scores[doc] = sum(w * p[doc] * (self.k1 + 1) / (p[doc] + norm) for w, p in zip(idf, postings))
+        ranked = sorted(scores, key=lambda doc: -scores[doc])
+        return ranked[:limit] if limit else ranked
+
+    def stats(self):
+        return {"documents": len(self.lengths), "terms": len(self.postings)}
+
+
+# --- Native indexes ---
+class _Probe:
+    """A server-side check (or local index build), run on a background thread and re-run every ``ttl`` seconds.
+
+    A failed run keeps the previous result and is retried after PROBE_RETRY_S, so a transient error doesn't
+    switch text search off (or change the prompts' cache keys). Only the first run makes callers wait, for at
+    most PROBE_WAIT_S.
+    """
+
+    def __init__(self, check, default, ttl=PROBE_TTL_S):
+        self.check = check
+        self.default = self.value = default
+        self.ttl = ttl
+        self.expires = 0.0
+        self.generation = 0
+        self.checked = threading.Event()
+        self._running = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._running or time.monotonic() < self.expires:
+                return
+            self._running = True
+            generation = self.generation
+        threading.Thread(target=self._run, args=(generation,), name="text-search-probe", daemon=True).start()
+
+    def _run(self, generation):
+        try:
+            value, ok = self.check(), True
+        except Exception:
+            value, ok = None, False
+        with self._lock:
+            self._running = False
+            # A result started before invalidate() describes the old data: dropped, and run again on the next get()
+            if generation == self.generation:
+                if ok:
+                    self.value = value
+                self.expires = time.monotonic() + (self.ttl if ok else PROBE_RETRY_S)
+        self.checked.set()
+
+    def get(self, wait=PROBE_WAIT_S):
+        self.start()
+        self.checked.wait(wait)
+        return self.value
+
+    def invalidate(self):
+        """Forget the result (the data changed under it) and run again on the next get()."""
+        with self._lock:
+            self.value, self.expires = self.default, 0.0
+            self.generation += 1
+
+
+_probes = {}
+_probes_lock = threading.Lock()
+
+
+def _probe(key, check, default, ttl=PROBE_TTL_S):
+    with _probes_lock:
+        if key not in _probes:
+            _probes[key] = _Probe(check, default, ttl)
+        return _probes[key]
+
+
+def _mongo_text_fields(collection_name):
+    for spec in resources.get_collection(collection_name).index_information().values():
+        if any(kind == "text" for _, kind in spec["key"]):
+            return tuple(sorted(spec.get("weights", {})))
+    return ()
+
+
+def mongo_text_fields(collection_name):
+    """Fields covered by the collection's text index (empty when it has none or it hasn't been seen yet)."""
+    if not ENABLED:
+        return ()
+    return _probe(("mongo", collection_name), lambda: _mongo_text_fields(collection_name), ()).get()
+
+
+def _default_db_config():
+    import sqlrest_cleaned
+    return sqlrest_cleaned.db_config
+
+
+def _sql_fulltext_indexes(config):
+    """``table -> [column tuple of each FULLTEXT index]``."""
+    import sql_pool
+    found = {}
+    with sql_pool.get_pool(config).connection() as conn:
+        for table in {table for table, _ in SQL_FULLTEXT_INDEXES.values()}:
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute(f"SHOW INDEX FROM `{table}`")
+                by_name = defaultdict(list)
+                for row in cur.fetchall():
+                    if row["Index_type"] == "FULLTEXT":
+                        by_name[row["Key_name"]].append((row["Seq_in_index"], row["Column_name"]))
+            finally:
+                cur.close()
+            found[table] = [tuple(c for _, c in sorted(cols)) for cols in by_name.values()]
+    return found
+
+
+def _sql_fulltext_probe(config):
+    return _probe(("sql", tuple(sorted(config.items()))), lambda: _sql_fulltext_indexes(config), {})
+
+
+def warm(db_config=None):
+    """Start the index checks and local index builds without waiting, so the first request doesn't pay for them."""
+    import sql_backends
+    if not ENABLED:
+        return
+    for name in MONGO_TEXT_INDEXES:
+        _probe(("mongo", name), lambda name=name: _mongo_text_fields(name), ()).start()
+    if sql_backends.BACKEND != "embedded":
+        _sql_fulltext_probe(db_config or _default_db_config()).start()
+    for corpus in LOCAL_CORPORA:
+        _local_probe(corpus).start()
+
+
+def sql_fulltext(table, columns, db_config=None):
+    """Whether MATCH(``columns``) can be used on ``table``: a FULLTEXT index over exactly those columns on MySQL."""
+    import sql_backends
+    if not ENABLED or sql_backends.BACKEND == "embedded":
+        return False
+    return tuple(columns) in _sql_fulltext_probe(db_config or _default_db_config()).get().get(table, [])
+
+
+# --- Local index over the live data ---
+def _doc_id(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return int(value) if value.isdigit() else value
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def _local_rows(corpus):
+    """``(id, text)`` of every row of ``corpus``; raises when it has more than LOCAL_MAX_DOCS."""
+    backend, table, id_column, text_columns = LOCAL_CORPORA[corpus]
+    if backend == "sql":
+        import sql_backends
+        sql = f"SELECT {id_column}, {', '.join(text_columns)} FROM {table}"
+        _, _, rows, _, more = sql_backends.read(sql, _default_db_config(), LOCAL_MAX_DOCS, 1 << 40, 5000)
+    else:
+        projection = {"_id": 0, id_column: 1, **{column: 1 for column in text_columns}}
+        docs = resources.get_collection(table).find({}, projection).limit(LOCAL_MAX_DOCS + 1)
+        rows = [[doc.get(id_column)] + [doc.get(column) for column in text_columns] for doc in docs]
+        more = len(rows) > LOCAL_MAX_DOCS
+    if more:
+        raise RuntimeError(f"{table} has more than {LOCAL_MAX_DOCS} rows to index")
+    for row in rows:
+        if row[0] is not None and row[0] != "":
+            yield _doc_id(row[0]), " ".join(str(v) for v in row[1:] if v is not None)
+
+
+def _build_local(corpus):
+    index = InvertedIndex()
+    for doc_id, text in _local_rows(corpus):
+        index.add(doc_id, text)
+    return index
+
+
+def _local_probe(corpus):
+    return _probe(("local", corpus), lambda: _build_local(corpus), None, REFRESH_S)
+
+
+def local_index(corpus, wait=PROBE_WAIT_S):
+    """The in-process index of ``corpus`` ("reviews" or "host"), or None while it is off, being built or stale."""
+    return _local_probe(corpus).get(wait) if ENABLED else None
+
+
+def invalidate(*names):
+    """Drop the local index of every written table / collection in ``names`` until it has been rebuilt."""
+    for corpus, (_, table, _, _) in LOCAL_CORPORA.items():
+        if table in names:
+            _local_probe(corpus).invalidate()
+
+
+def _local_ids(corpus, text):
+    """Ids of the rows mentioning every term of ``text``, best first; None when the index can't narrow the query."""
+    index = local_index(corpus)
+    if index is None:
+        return None
+    ids = index.search(text)
+    return ids if len(ids) <= MAX_IDS else None
+
+
+# --- Query building ---
+def _boolean_query(text):
+    """MATCH ... AGAINST boolean-mode query requiring every word of ``text`` as typed (FULLTEXT does not stem)."""
+    return " ".join("+" + word for word in words(text))
+
+
+def _id_list(ids):
+    return ", ".join(_sql_literal(i) for i in ids)
+
+
+def _narrowed(column, ids, check):
+    """``check`` on the rows whose ``column`` is one of the local hits ``ids`` (just ``check`` without them)."""
+    if ids is None:
+        return check
+    if not ids:
+        return "1 = 0"
+    return f"{column} IN ({_id_list(ids)}) AND {check}"
+
+
+def sql_tag_condition(tag, alias="v"):
+    """WHERE condition for reviews tagged ``tag``: MATCH on the tags FULLTEXT index, else LIKE on the local hits."""
+    if sql_fulltext("reviews", ("tags",)):
+        return f"MATCH({alias}.tags) AGAINST({_sql_string(_boolean_query(tag))} IN BOOLEAN MODE)"
+    return _narrowed(f"{alias}.restaurant_id", _local_ids("reviews", tag),
+                     f"{alias}.tags LIKE {_sql_string('%' + tag + '%')}")
+
+
+def _review_match(text, alias):
+    return (f"MATCH({alias}.sample_review, {alias}.tags) "
+            f"AGAINST({_sql_string(_boolean_query(text))} IN BOOLEAN MODE)")
+
+
+def sql_review_text_condition(text, alias="v"):
+    """WHERE condition for reviews whose text or tags mention every term of ``text``; None when it has no terms.
+
+    MATCH with the FULLTEXT index; otherwise LIKE, checked only on the local index's hits when there are few.
+    """
+    query_terms = terms(text)
+    if not query_terms:
+        return None
+    if sql_fulltext("reviews", ("sample_review", "tags")):
+        return _review_match(text, alias)
+    likes = " AND ".join(f"({alias}.sample_review LIKE {_sql_string('%' + t + '%')} OR "
+                         f"{alias}.tags LIKE {_sql_string('%' + t + '%')})" for t in query_terms)
+    return _narrowed(f"{alias}.restaurant_id", _local_ids("reviews", text), likes)
+
+
+def sql_review_text_rank(text, alias="v"):
+    """ORDER BY expression putting the reviews that match ``text`` best first, or None.
+
+    MATCH relevance with the FULLTEXT index, else the local index's BM25 order over its best RANK_IDS hits.
+    """
+    if not terms(text):
+        return None
+    if sql_fulltext("reviews", ("sample_review", "tags")):
+        return _review_match(text, alias) + " DESC"
+    ids = (_local_ids("reviews", text) or [])[:RANK_IDS]
+    if not ids:
+        return None
+    arms = " ".join(f"WHEN {_sql_literal(doc)} THEN {rank}" for rank, doc in enumerate(ids))
+    return f"CASE {alias}.restaurant_id {arms} ELSE {len(ids)} END"
+
+
+def mongo_text_search(text):
+    """``$search`` string matching documents that contain every word of ``text`` (each word stemmed when alone)."""
+    typed = words(text)
+    return typed[0] if len(typed) == 1 else " ".join(f'"{word}"' for word in typed)
+
+
+def host_pipeline(text, limit=10, ids=()):
+    """Listing pipeline for the hosts whose host_about mentions every term of ``text``, with their listing counts.
+
+    Only the local index's hits are grouped and looked up, and the $regex confirms the match on those; without
+    usable hits (``ids=None``, or the index unavailable) every listing's host is checked.
+    """
+    if ids == ():
+        ids = _local_ids("host", text)
+    ranked = (ids or [])[:RANK_IDS]
+    rank = {"$let": {"vars": {"i": {"$indexOfArray": [ranked, "$_id"]}},
+                     "in": {"$cond": [{"$lt": ["$$i", 0]}, len(ranked), "$$i"]}}}
+    narrow = [{"$match": {"host_id": {"$in": ids}}}] if ids is not None else []
+    return narrow + [
+        {"$group": {"_id": "$host_id", "listings": {"$sum": 1}}},
+        {"$lookup": {"from": "host", "localField": "_id", "foreignField": "host_id", "as": "host"}},
+        {"$unwind": "$host"},
+        {"$match": {"$and": [{"host.host_about": {"$regex": rf"\b{term}", "$options": "i"}} for term in terms(text)]}},
+        {"$addFields": {"rank": rank}},
+        {"$sort": {"rank": 1, "listings": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "host_id": "$_id", "host_name": "$host.host_name",
+                      "host_about": "$host.host_about", "listings": 1}},
+    ]
+
+
+# --- Prompt guidance ---
+MONGO_GUIDELINE = """TEXT SEARCH:
+    - For words that describe a listing rather than a field value (e.g. "quiet", "sunny", "renovated", "near a park")
+    - Put a $text search in the FIRST $match stage (other conditions may share it): { "$match": { "$text": { "$search": "quiet" } } }
+    - Quote each word to require all of them: { "$search": "\\"sunny\\" \\"renovated\\"" }
+    - Order by relevance with { "$sort": { "score": { "$meta": "textScore" } } }
+    - Never use $regex on title, body or description for this
+"""
+
+SQL_GUIDELINE = """
+-- ✅ Full-Text Search:
+reviews has FULLTEXT indexes on (sample_review, tags) and on (tags). For descriptive words about restaurants or their reviews use them instead of LIKE:
+✅ Correct: SELECT r.restaurant_name FROM restaurant r JOIN reviews v ON r.restaurant_id = v.restaurant_id WHERE MATCH(v.tags) AGAINST('+romantic' IN BOOLEAN MODE);
+✅ Correct: ... WHERE MATCH(v.sample_review, v.tags) AGAINST('+great +food' IN BOOLEAN MODE);
+🚫 Incorrect: ... WHERE v.tags LIKE '%romantic%';
+"""
+
+
+def sql_prompt_guideline(db_config=None):
+    """Full-text guidance for the SQL prompt, or "" when the FULLTEXT indexes aren't there."""
+    if all(sql_fulltext(table, columns, db_config) for table, columns in SQL_FULLTEXT_INDEXES.values()):
+        return SQL_GUIDELINE
+    return ""
+
+
+def metrics():
+    report = {"enabled": ENABLED, "mongo_text": {name: list(mongo_text_fields(name)) for name in MONGO_TEXT_INDEXES},
+              "sql_fulltext": sql_prompt_guideline() != ""}
+    for corpus in LOCAL_CORPORA:
+        index = local_index(corpus)
+        report[corpus] = index.stats() if index else None
+    return report
+
+
+# --- Index creation ---
+def create_indexes(db_config=None):
+    """Create the MongoDB text and MySQL FULLTEXT indexes that are missing; returns what was created."""
+    import sql_pool
+    created = []
+    for name, weights in MONGO_TEXT_INDEXES.items():
+        collection = resources.get_collection(name)
+        if not any(kind == "text" for spec in collection.index_information().values() for _, kind in spec["key"]):
+            index_name = collection.create_index([(field, "text") for field in weights], weights=weights,
+                                                 name=f"tx_{name}", default_language="english")
+            created.append(f"MongoDB {name}: {index_name}")
+    config = db_config or _default_db_config()
+    existing = _sql_fulltext_indexes(config)
+    with sql_pool.get_pool(config).connection(timeout_ms=600000) as conn:
+        cur = conn.cursor()
+        try:
+            for name, (table, columns) in SQL_FULLTEXT_INDEXES.items():
+                if tuple(columns) not in existing.get(table, []):
+                    cur.execute(f"ALTER TABLE `{table}` ADD FULLTEXT INDEX `{name}` ({', '.join(columns)})")
+                    created.append(f"MySQL {table}: {name}")
+        finally:
+            cur.close()
+    with _probes_lock:
+        _probes.clear()
+    return created
+
+
+# --- Latency comparison ---
+def _time(run, repeat=COMPARE_REPEAT):
+    run()  # warm-up
+    timings, rows = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), rows
+
+
+def comparisons(db_config):
+    """``(label, backend, scan, text)`` pairs: each side is a zero-argument callable returning a row count."""
+    import sql_backends
+    read = lambda sql: lambda: len(sql_backends.read(sql, db_config, 100000, 1 << 30, 1000)[2])
+    aggregate = lambda name, stages: lambda: len(list(resources.get_collection(name).aggregate(stages)))
+    select = "SELECT r.restaurant_name FROM restaurant r JOIN reviews v ON r.restaurant_id = v.restaurant_id WHERE "
+    likes = "(v.sample_review LIKE '%great%' OR v.tags LIKE '%great%') AND (v.sample_review LIKE '%food%' OR " \
+            "v.tags LIKE '%food%')"
+    # The text side includes the local lookup (or MATCH) and builds the condition on every run
+    pairs = [
+        ("reviews tagged 'romantic'", "sql", read(select + "v.tags LIKE '%romantic%'"),
+         lambda: read(select + sql_tag_condition("romantic"))()),
+        ("reviews mentioning 'great food'", "sql", read(select + likes),
+         lambda: read(select + sql_review_text_condition("great food"))()),
+        ("hosts who love dogs", "mongo", aggregate("listing", host_pipeline("love dogs", 1000, ids=None)),
+         lambda: aggregate("listing", host_pipeline("love dogs", 1000))()),
+    ]
+    if mongo_text_fields("listing"):
+        pairs.append(("quiet listings", "mongo",
+                      aggregate("listing", [{"$match": {"$or": [{field: {"$regex": "quiet", "$options": "i"}}
+                                                                for field in MONGO_TEXT_INDEXES["listing"]]}},
+                                            {"$project": {"title": 1}}]),
+                      aggregate("listing", [{"$match": {"$text": {"$search": "quiet"}}}, {"$project": {"title": 1}}])))
+    return pairs
+
+
+def compare(db_config=None):
+    config = db_config or _default_db_config()
+    print(f"{'question':<34}{'backend':>8}{'scan ms':>10}{'text ms':>10}{'rows':>14}")
+    for label, backend, scan, text in comparisons(config):
+        try:
+            scan_ms, scan_rows = _time(scan)
+            text_ms, text_rows = _time(text)
+        except Exception as e:
+            print(f"{label:<34}{backend:>8}  skipped: {type(e).__name__}: {e}")
+            continue
+        print(f"{label:<34}{backend:>8}{scan_ms:>10.2f}{text_ms:>10.2f}{f'{scan_rows} / {text_rows}':>14}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Full-text indexes and a latency comparison against scans.")
+    parser.add_argument("--create", action="store_true", help="create the MongoDB text and MySQL FULLTEXT indexes")
+    parser.add_argument("--compare", action="store_true", help="time text search against the scan-based queries")
+    args = parser.parse_args(argv)
+    if args.create:
+        for line in create_indexes() or ["All text indexes already exist"]:
+            print(line)
+    if args.compare or not args.create:
+        started = time.perf_counter()
+        for corpus in LOCAL_CORPORA:
+            index = local_index(corpus, wait=None)
+            print(f"local index {corpus}: {index.stats() if index else 'unavailable'}")
+        print(f"built in {(time.perf_counter() - started) * 1000:.0f} ms\n")
+        compare()
+
+
+if __name__ == "__main__":
+    main()
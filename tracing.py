@@ -0,0 +1,239 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+import resources
+import retrieval
+
+# --- Per-request tracing and metrics ---
+# Each chat turn is a trace holding one span per stage: routing, generation,
+# every LLM call (with prompt / completion tokens), database execution (rows,
+# bytes, cache hits), image rendering and summarization. The current trace
+# lives in a context variable, and the pipeline executor copies the context
+# into its workers, so spans opened on worker threads still land in the right
+# trace. Finished traces are appended to .cache/traces.jsonl, and the running
+# totals are rewritten to .cache/metrics.prom in the Prometheus text format
+# (point a node_exporter textfile collector at it).
+
+ENABLED = resources.getenv("TRACING", "1") == "1"
+TRACE_PATH = resources.getenv("TRACE_LOG_PATH", resources.cache_path("traces.jsonl"))
+TRACE_MAX_BYTES = int(resources.getenv("TRACE_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+METRICS_PATH = resources.getenv("TRACE_METRICS_PATH", resources.cache_path("metrics.prom"))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current = contextvars.ContextVar("chatbot_trace", default=None)
+
+
+class Span:
+    def __init__(self, name, offset=0.0, **attrs):
+        self.name = name
+        self.offset = offset
+        self.seconds = None
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def tokens(self, prompt, completion, usage=None):
+        """Record token counts, from the provider's ``usage`` when given, else estimated from the text."""
+        if usage:
+            self.set(prompt_tokens=usage[0], completion_tokens=usage[1], tokens_estimated=False)
+        else:
+            self.set(prompt_tokens=retrieval.estimate_tokens(prompt or ""),
+                     completion_tokens=retrieval.estimate_tokens(completion or ""), tokens_estimated=True)
+
+    def to_dict(self):
+        return dict(self.attrs, name=self.name, start_ms=round(self.offset * 1000, 2),
+                    duration_ms=round((self.seconds or 0.0) * 1000, 2), thread=self.thread)
+
+
+class Trace:
+    def __init__(self, question, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.ts = time.time()
+        self.started = time.perf_counter()
+        self.question = question
+        self.attrs = attrs
+        self.spans = []
+        self.error = None
+        self.seconds = None
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted((s.to_dict() for s in self.spans), key=lambda s: s["start_ms"])
+        totals = defaultdict(int)
+        for span in spans:
+            for key in ("prompt_tokens", "completion_tokens", "rows", "bytes"):
+                totals[key] += span.get(key, 0)
+        return dict(self.attrs, trace_id=self.id, ts=self.ts, question=self.question,
+                    status="error" if self.error else "ok", error=self.error,
+                    duration_ms=round((self.seconds or 0.0) * 1000, 2), totals=dict(totals), spans=spans)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage of the current trace; outside a trace the span is timed but not recorded."""
+    trace = _current.get()
+    started = time.perf_counter()
+    current = Span(name, started - trace.started if trace else 0.0, **attrs)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.seconds = time.perf_counter() - started
+        if trace is not None:
+            trace.add(current)
+
+
+def current_trace():
+    return _current.get()
+
+
+def record_error(error):
+    """Mark the current trace as failed (for errors that are shown to the user instead of raised)."""
+    trace = _current.get()
+    if trace is not None:
+        trace.fail(error)
+
+
+def start_trace(question, **attrs):
+    trace = Trace(question, **attrs)
+    _current.set(trace)
+    return trace
+
+
+def finish_trace(trace):
+    """Close ``trace``, log it and fold it into the metrics; returns its dict form."""
+    trace.seconds = time.perf_counter() - trace.started
+    if _current.get() is trace:
+        _current.set(None)
+    data = trace.to_dict()
+    if ENABLED:
+        _append(data)
+        get_metrics().observe(data)
+        get_metrics().write()
+    return data
+
+
+_write_lock = threading.Lock()
+
+
+def _append(entry):
+    try:
+        with _write_lock:
+            os.makedirs(os.path.dirname(TRACE_PATH), exist_ok=True)
+            if os.path.exists(TRACE_PATH) and os.path.getsize(TRACE_PATH) > TRACE_MAX_BYTES:
+                os.replace(TRACE_PATH, TRACE_PATH + ".1")
+            with open(TRACE_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+    except OSError:
+        pass  # tracing must never break a request
+
+
+# --- Prometheus metrics ---
+class Metrics:
+    HELP = {
+        "chatbot_requests_total": ("counter", "Chat turns by backend and status"),
+        "chatbot_request_seconds": ("histogram", "End-to-end chat turn latency"),
+        "chatbot_stage_seconds": ("histogram", "Latency of each traced stage"),
+        "chatbot_llm_tokens_total": ("counter", "LLM tokens by call purpose and kind (estimated when the provider reports none)"),
+        "chatbot_db_rows_total": ("counter", "Rows / documents returned by the databases"),
+        "chatbot_db_bytes_total": ("counter", "Approximate bytes returned by the databases"),
+        "chatbot_cache_total": ("counter", "Cache lookups by cache and result"),
+    }
+
+    def __init__(self, path=METRICS_PATH):
+        self.path = path
+        self.counters = defaultdict(float)     # (name, labels) -> value
+        self.histograms = {}                   # (name, labels) -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def _observe(self, name, labels, seconds):
+        key = (name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        hist = self.histograms[key]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+
+    def observe(self, trace):
+        backend = trace.get("backend") or "unknown"
+        with self._lock:
+            self.counters[("chatbot_requests_total", (("backend", backend), ("status", trace["status"])))] += 1
+            self._observe("chatbot_request_seconds", (("backend", backend),), trace["duration_ms"] / 1000)
+            for span in trace["spans"]:
+                self._observe("chatbot_stage_seconds", (("stage", span["name"]),), span["duration_ms"] / 1000)
+                purpose = span.get("purpose")
+                for kind in ("prompt", "completion"):
+                    if purpose and f"{kind}_tokens" in span:
+                        labels = (("purpose", purpose), ("kind", kind))
+                        self.counters[("chatbot_llm_tokens_total", labels)] += span[f"{kind}_tokens"]
+                db = span["name"][3:] if span["name"].startswith("db.") else None
+                if db:
+                    self.counters[("chatbot_db_rows_total", (("db", db),))] += span.get("rows", 0)
+                    self.counters[("chatbot_db_bytes_total", (("db", db),))] += span.get("bytes", 0)
+                for key, value in span.items():
+                    if key.endswith("_cache"):
+                        labels = (("cache", key[:-len("_cache")]), ("result", str(value)))
+                        self.counters[("chatbot_cache_total", labels)] += 1
+
+    def render(self):
+        def fmt(labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in labels + tuple(extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for name, (kind, text) in self.HELP.items():
+                lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+                if kind == "counter":
+                    for (metric, labels), value in sorted(self.counters.items()):
+                        if metric == name:
+                            lines.append(f"{name}{fmt(labels)} {value:g}")
+                    continue
+                for (metric, labels), hist in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(BUCKETS, hist):
+                        lines.append(f"{name}_bucket{fmt(labels, [('le', f'{bound:g}')])} {count}")
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {hist[-1]}")
+                    lines.append(f"{name}_sum{fmt(labels)} {hist[-2]:.6f}")
+                    lines.append(f"{name}_count{fmt(labels)} {hist[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+
+@resources.resource
+def get_metrics():
+    return Metrics()